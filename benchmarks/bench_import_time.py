@@ -0,0 +1,67 @@
+"""
+Import time budget for the entry points, each module is imported in a fresh interpreter.
+
+Run from the repository root: python benchmarks/bench_import_time.py [--repeat 5]
+Exits with 1 when a module is over its budget or pulls in a dependency it should import lazily.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# module -> (budget in milliseconds, modules it must not import)
+BUDGETS = {
+    "me.__main__": (150, ("uvicorn", "yaml", "fastapi", "discord", "pandas", "numpy")),
+    "me.me_api": (1000, ("discord", "pandas", "numpy", "requests")),
+    "me.discord_bot.me_client": (2500, ()),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, forbidden, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+            capture_output=True,
+            text=True,
+        )
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    # The fastest run is the least disturbed by the rest of the machine
+    return min(runs, key=lambda run: run["ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module, (budget, forbidden) in BUDGETS.items():
+        result = measure(module, forbidden, args.repeat)
+        if "error" in result:
+            failed = True
+            print(f"FAIL {module:30} import failed: {result['error']}")
+            continue
+        over = result["ms"] > budget or len(result["loaded"]) > 0
+        failed = failed or over
+        status = "FAIL" if over else "ok"
+        print(f"{status:4} {module:30} {result['ms']:8.1f} ms  budget {budget} ms", end="")
+        if len(result["loaded"]) > 0:
+            print(f"  imported {', '.join(result['loaded'])}", end="")
+        print()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,6 @@ import logging
 import os
 
 import click
-import uvicorn
-import yaml
 
 _logger = logging.getLogger(__name__)
 
@@ -45,13 +43,83 @@ def run(app, host, port, reload, env_vars_path=None):
     if env_vars_path is not None:
         update_env_vars_from_yml(env_vars_path)
 
+    import uvicorn
+
     print(
         f"Starting server {app} with uvicorn on {host} - port {port} - reload={reload}"
     )
     uvicorn.run(app, host=host, port=port, reload=reload)
 
 
+@main.command()
+@click.option(
+    "--env-vars-path",
+    "-e",
+    required=False,
+    type=click.Path(exists=True),
+    help="env_variables yaml, imports environment variables -- not secure for secret information",
+)
+def bot(env_vars_path=None):
+    """Runs the discord client on its own, pair with the API started with ME_RUN_MODE=api"""
+    if env_vars_path is not None:
+        update_env_vars_from_yml(env_vars_path)
+    from me.discord_bot.me_client import run_bot
+
+    run_bot()
+
+
+@main.command()
+@click.option("--guild-id", "-g", required=False, type=int, default=None)
+def refresh_role_messages(guild_id=None):
+    """Asks the running bot to refresh its role messages, for one guild or all of them"""
+    from me.io import ipc
+    from me.io.db_util import SQLiteDB
+
+    db = SQLiteDB()
+    db.setup()
+    payload = {} if guild_id is None else {"guild_id": guild_id}
+    command_id = ipc.CommandQueue(db).send(ipc.REFRESH_ROLE_MESSAGES, **payload)
+    print(f"Queued {ipc.REFRESH_ROLE_MESSAGES} as command {command_id}")
+
+
+@main.command()
+@click.option("--host", required=False, default="127.0.0.1")
+@click.option("--port", "-p", required=False, default=8090, type=int)
+@click.option("--latency", required=False, default=0.0, type=float, help="Seconds added to every response")
+@click.option("--latency-jitter", required=False, default=0.0, type=float, help="Up to this many extra seconds")
+@click.option("--rate-limit-chance", required=False, default=0.0, type=float, help="Chance of a random 429")
+@click.option("--bucket-limit", required=False, default=5, type=int, help="Requests per route bucket per window")
+@click.option("--bucket-window", required=False, default=5.0, type=float, help="Bucket window in seconds")
+@click.option("--guilds", required=False, default=1, type=int)
+@click.option("--channels", required=False, default=3, type=int, help="Text channels per guild")
+def discord_standin(
+    host,
+    port,
+    latency,
+    latency_jitter,
+    rate_limit_chance,
+    bucket_limit,
+    bucket_window,
+    guilds,
+    channels,
+):
+    """Serves a local stand-in for the Discord REST API, set ME_DISCORD_API_ENDPOINT to the printed endpoint"""
+    from me.io import discord_standin as standin
+
+    settings = standin.StandInSettings(
+        latency=latency,
+        latency_jitter=latency_jitter,
+        rate_limit_chance=rate_limit_chance,
+        bucket_limit=bucket_limit,
+        bucket_window=bucket_window,
+    )
+    print(f"Discord stand-in endpoint: {standin.get_standin_endpoint(host, port)}")
+    standin.DiscordStandIn(settings, guild_count=guilds, channels_per_guild=channels).run(host, port)
+
+
 def update_env_vars_from_yml(yml_path):
+    import yaml
+
     print(f"Loading env vars from {yml_path}")
     with open(yml_path, "r") as f:
         env = yaml.safe_load(f).get("env_variables", {})
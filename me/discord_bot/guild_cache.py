@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import itertools
+import logging
+from collections import Counter
+from typing import Callable, Dict, FrozenSet, List
+
+import discord
+
+from me import me_util
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class GuildNames:
+    """
+    Role and channel names of a single guild, counted so duplicate names survive a single delete.
+
+    Text channel names are stored normalized with me_util.normalize_channel_name, other channel names and role names
+    are stored as-is. Role category names live in the database, they're loaded for the role version they were read at.
+    """
+
+    role_names: Counter = dataclasses.field(default_factory=Counter)
+    channel_names: Counter = dataclasses.field(default_factory=Counter)
+    category_names: FrozenSet[str] = frozenset()
+    category_version: int | None = None
+
+    @classmethod
+    def from_guild(cls, guild: discord.Guild) -> GuildNames:
+        names = cls()
+        for role in guild.roles:
+            names.add_role(role)
+        for channel in guild.channels:
+            names.add_channel(channel)
+        return names
+
+    def add_role(self, role: discord.Role):
+        self.role_names[role.name] += 1
+
+    def remove_role(self, role: discord.Role):
+        _decrement(self.role_names, role.name)
+
+    def add_channel(self, channel: discord.abc.GuildChannel):
+        name = _get_channel_name(channel)
+        if name is not None:
+            self.channel_names[name] += 1
+
+    def remove_channel(self, channel: discord.abc.GuildChannel):
+        name = _get_channel_name(channel)
+        if name is not None:
+            _decrement(self.channel_names, name)
+
+    def has_role_name(self, name: str | None) -> bool:
+        return name is not None and self.role_names[name] > 0
+
+    def has_channel_name(self, name: str | None) -> bool:
+        name = me_util.normalize_channel_name(name)
+        return name is not None and self.channel_names[name] > 0
+
+
+# Only text channel names are restricted by Discord, categories and voice channels keep spaces and capitals
+def _get_channel_name(channel: discord.abc.GuildChannel) -> str | None:
+    if isinstance(channel, discord.TextChannel):
+        return me_util.normalize_channel_name(channel.name)
+    return channel.name
+
+
+def _decrement(counter: Counter, key):
+    count = counter[key] - 1
+    if count > 0:
+        counter[key] = count
+    else:
+        counter.pop(key, None)
+
+
+@dataclasses.dataclass
+class GuildCache:
+    """
+    Per-guild name indexes, built lazily from the discord cache and kept current by MEClient's gateway events.
+
+    Every guild also has a snapshot version, caches of data derived from a guild key on it so they expire without
+    explicit invalidation. It changes on the guild's role, channel and member role events, and through bump_roles when
+    its roles or role_categories rows change: SQLiteDB notifies its role_listeners after writing them and the
+    StaleRowReaper reports the servers it deleted rows of. A new writer to those tables has to do the same.
+    """
+
+    _names: Dict[int, GuildNames] = dataclasses.field(default_factory=dict)
+    _versions: Dict[int, int] = dataclasses.field(default_factory=dict)
+    # Only bumped when roles or the role menu tables change, not by member updates
+    _role_versions: Dict[int, int] = dataclasses.field(default_factory=dict)
+    _version_counter: itertools.count = dataclasses.field(
+        default_factory=lambda: itertools.count(1), repr=False
+    )
+
+    def get_version(self, guild_id: int) -> int:
+        version = self._versions.get(guild_id)
+        if version is None:
+            version = self.bump(guild_id)
+        return version
+
+    # Versions come from one counter, so a forgotten guild never reuses a version an old cache entry was keyed on
+    def bump(self, guild_id: int) -> int:
+        version = next(self._version_counter)
+        self._versions[guild_id] = version
+        return version
+
+    def get_role_version(self, guild_id: int) -> int:
+        version = self._role_versions.get(guild_id)
+        if version is None:
+            version = self.bump_roles(guild_id)
+        return version
+
+    def bump_roles(self, guild_id: int) -> int:
+        version = self.bump(guild_id)
+        self._role_versions[guild_id] = version
+        return version
+
+    def get_names(self, guild: discord.Guild) -> GuildNames:
+        names = self._names.get(guild.id)
+        if names is None:
+            _logger.debug(f"Building name index for guild {guild.id}")
+            names = GuildNames.from_guild(guild)
+            self._names[guild.id] = names
+        return names
+
+    def role_name_exists(self, guild: discord.Guild, name: str | None) -> bool:
+        return self.get_names(guild).has_role_name(name)
+
+    def channel_name_exists(self, guild: discord.Guild, name: str | None) -> bool:
+        return self.get_names(guild).has_channel_name(name)
+
+    # Category writes notify the role listeners, which bump the role version, so a stale set is reloaded
+    async def get_category_names(
+        self, guild: discord.Guild, load: Callable[[int], List[str]]
+    ) -> FrozenSet[str]:
+        names = self.get_names(guild)
+        version = self.get_role_version(guild.id)
+        if names.category_version != version:
+            names.category_names = frozenset(await asyncio.to_thread(load, guild.id))
+            names.category_version = version
+        return names.category_names
+
+    async def category_name_exists(
+        self, guild: discord.Guild, name: str | None, load: Callable[[int], List[str]]
+    ) -> bool:
+        return name is not None and name in await self.get_category_names(guild, load)
+
+    # Events only touch indexes that were already built, unbuilt ones will read the up-to-date guild cache later
+    def on_role_create(self, role: discord.Role):
+        self.bump_roles(role.guild.id)
+        names = self._names.get(role.guild.id)
+        if names is not None:
+            names.add_role(role)
+
+    def on_role_delete(self, role: discord.Role):
+        self.bump_roles(role.guild.id)
+        names = self._names.get(role.guild.id)
+        if names is not None:
+            names.remove_role(role)
+
+    def on_role_update(self, before: discord.Role, after: discord.Role):
+        self.bump_roles(after.guild.id)
+        if before.name != after.name:
+            self.on_role_delete(before)
+            self.on_role_create(after)
+
+    def on_channel_create(self, channel: discord.abc.GuildChannel):
+        self.bump(channel.guild.id)
+        names = self._names.get(channel.guild.id)
+        if names is not None:
+            names.add_channel(channel)
+
+    def on_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.bump(channel.guild.id)
+        names = self._names.get(channel.guild.id)
+        if names is not None:
+            names.remove_channel(channel)
+
+    def on_channel_update(
+        self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
+    ):
+        self.bump(after.guild.id)
+        if before.name != after.name:
+            self.on_channel_delete(before)
+            self.on_channel_create(after)
+
+    # Member roles decide what the member can manage and which channels they can see
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self.bump(after.guild.id)
+
+    def forget_guild(self, guild_id: int):
+        self._names.pop(guild_id, None)
+        self.bump_roles(guild_id)
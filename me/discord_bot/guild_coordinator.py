@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Hashable
+
+from me.io import metrics
+from me.io.cache import SingleFlight
+
+
+class GuildCoordinator:
+    """
+    Per-guild coordination of the bot's expensive operations.
+
+    lock(guild_id) serializes operations that change a guild's messages or rows, like displaying, purging and
+    refreshing menus. share runs identical reads of a guild once, concurrent callers await the same result. A guild's
+    lock only exists while something holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._flights = SingleFlight()
+
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        guild_id = int(guild_id)
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[guild_id] = lock
+        return lock
+
+    def is_locked(self, guild_id: int) -> bool:
+        lock = self._locks.get(int(guild_id))
+        return lock is not None and lock.locked()
+
+    async def share(self, guild_id: int, key: Hashable, load: Callable[[], Awaitable]):
+        flight_key = (int(guild_id), key)
+        if flight_key in self._flights:
+            metrics.increment("guild.shared_reads")
+        return await self._flights.do(flight_key, load)
+
+    # For blocking reads like database queries, they run in a worker thread
+    async def share_in_thread(self, guild_id: int, key: Hashable, fn: Callable, *args):
+        return await self.share(guild_id, key, lambda: asyncio.to_thread(fn, *args))
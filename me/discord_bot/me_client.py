@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import asyncio
+import collections
 import logging
 import os
-from typing import Optional, List, Union
+import time
+from typing import Optional, List, Set, Union
 
 import discord
 import pandas as pd
@@ -10,24 +13,104 @@ from discord import app_commands, Thread, Guild, Member, Role
 from discord.abc import PrivateChannel, GuildChannel
 from pandas import DataFrame
 
-from me import me_util
+from me import lifecycle, me_util
+from me.permission_types import PermFlags, PermType
+from me.permissions import NO_ID, PermissionManager
+from me.discord_server import get_server_manager
+from me.discord_bot.guild_cache import GuildCache
+from me.discord_bot.guild_coordinator import GuildCoordinator
+from me.discord_bot.reconcile import Reconciler
 from me.discord_bot.me_views import me_view
 from me.discord_bot.role_commands import RoleCommandGroup, RoleView
-from me.io import db_util
+from me.discord_bot.role_layout import RoleLayoutCache
+from me.discord_bot.role_toggle import RoleToggler
+from me.io import config as me_config
+from me.io import db_util, ipc, settings
+from me.io.cache import LRUCache
+from me.io.data_filter import FilterManager, IsNullFilter
+from me.io.stale_rows import StaleRowReaper
 from me.message_types import MessageType
 
+STATUS_HEARTBEAT_INTERVAL = 5
+
 _logger = logging.getLogger(__name__)
 
 
-# TODO Scrap permission idea?  Maybe just use the built in discord permissions?
-class PermissionGroup(app_commands.Group):
+def format_permissions(flags: PermFlags) -> str:
+    types = flags.get_types()
+    if len(types) == 0:
+        return "no ME permissions"
+    return ", ".join(p.name.lower() for p in types)
+
+
+@app_commands.guild_only()
+class PermissionGroup(app_commands.Group, name="permission"):
     @app_commands.command()
-    async def add(self, interaction: discord.Interaction):
-        await interaction.response.send_message("ping")
+    @app_commands.describe(
+        permission="The permission to grant",
+        member="The member to grant it to",
+        role="The role to grant it to, every member holding it gets it",
+        allow="False takes the permission away instead",
+    )
+    async def add(
+        self,
+        interaction: discord.Interaction,
+        permission: PermType,
+        member: Optional[discord.Member] = None,
+        role: Optional[discord.Role] = None,
+        allow: bool = True,
+    ):
+        """Grants an ME permission to a member or a role"""
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message(
+                "You need Manage Server to change ME permissions", ephemeral=True
+            )
+            return
+        if (member is None) == (role is None):
+            await interaction.response.send_message(
+                "Choose either a member or a role", ephemeral=True
+            )
+            return
+        permissions = interaction.client.permissions
+        if member is not None:
+            flags = permissions.grant(
+                interaction.guild_id, member.id, permission, value=allow
+            )
+            target = member.mention
+        else:
+            flags = permissions.grant(
+                interaction.guild_id, NO_ID, permission, value=allow, role_id=role.id
+            )
+            target = role.mention
+        await interaction.response.send_message(
+            f"{target} now has {format_permissions(flags)}",
+            ephemeral=True,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
 
     @app_commands.command()
-    async def list(self, interaction: discord.Interaction):
-        await interaction.response.send_message("pong")
+    @app_commands.describe(
+        member="The member to list permissions for; defaults to you",
+    )
+    async def list(
+        self, interaction: discord.Interaction, member: Optional[discord.Member] = None
+    ):
+        """Lists a member's effective ME permissions and the role grants they come from"""
+        member = member or interaction.user
+        permissions = interaction.client.permissions
+        lines = [
+            f"{member.mention}: {format_permissions(permissions.get_member_permissions(member))}"
+        ]
+        grants = permissions.get_role_grants(interaction.guild_id)
+        for role in reversed(member.roles):
+            flags = grants.get(role.id)
+            if flags is not None:
+                lines.append(f"{role.mention}: {format_permissions(flags)}")
+        await interaction.response.send_message(
+            "\n".join(lines),
+            ephemeral=True,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
 
 
 class MEClient(discord.Client):
@@ -43,7 +126,24 @@ class MEClient(discord.Client):
         # Note: When using commands.Bot instead of discord.Client, the bot will
         # maintain its own tree instead.
         self.db: db_util.SQLiteDB | None = None
+        self.settings: settings.SettingsStore | None = None
+        self.permissions: PermissionManager | None = None
+        self.stale_rows: StaleRowReaper | None = None
+        self.reconciler: Reconciler | None = None
         self.config = None
+        self.command_queue: ipc.CommandQueue | None = None
+        self.status_board: ipc.StatusBoard | None = None
+        self.lifecycle = lifecycle.Lifecycle()
+        self._status_published_at = 0.0
+        self.ipc_handlers = {ipc.REFRESH_ROLE_MESSAGES: self.update_messages}
+        self.guild_cache = GuildCache()
+        self.guild_ops = GuildCoordinator()
+        self.servers = get_server_manager()
+        self.role_toggler = RoleToggler()
+        self.role_layouts = RoleLayoutCache(
+            self.guild_cache, lambda guild_id: self.db.get_server_role_layout_rows(guild_id)
+        )
+        self.filter_cache = LRUCache(max_entries=256, max_bytes=32 * 1024 * 1024)
         self.tree = app_commands.CommandTree(self)
         self.tree.add_command(PermissionGroup())
         self.role_message_group = me_view.MEViewGroup(
@@ -68,8 +168,61 @@ class MEClient(discord.Client):
         for guild_id in guilds:
             guild = await self.fetch_guild(guild_id)
             await self.sync_commands(guild)
+        self.mark_stage(lifecycle.COMMANDS_SYNCED)
 
-        await self.update_messages()
+        # Stale menus still work, a failed refresh is reported instead of keeping the client from ever being ready
+        error = None
+        try:
+            await self.update_messages()
+        except Exception as e:
+            _logger.exception(f"Failed to refresh role messages: {e}")
+            error = repr(e)
+        finally:
+            self.mark_stage(lifecycle.MESSAGES_REFRESHED, error=error)
+        if self.status_board is not None:
+            asyncio.create_task(self.publish_heartbeat())
+        if self.command_queue is not None:
+            asyncio.create_task(self.process_ipc_commands())
+        if self.reconciler is not None:
+            asyncio.create_task(self.reconciler.run())
+
+    async def on_connect(self):
+        self.mark_stage(lifecycle.GATEWAY_CONNECTED)
+
+    async def on_ready(self):
+        _logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        _logger.info("------")
+        self.mark_stage(lifecycle.READY)
+
+    async def on_test_event(self, **kwargs):
+        # Use like client.dispatch("test_event")   <- With optional other args
+        _logger.info(f"Called test event with: {kwargs}")
+
+    async def on_disconnect(self):
+        self.lifecycle.clear(lifecycle.GATEWAY_CONNECTED)
+        self.publish_status()
+
+    async def close(self):
+        if self.settings is not None:
+            await self.settings.flush_async()
+        if self.stale_rows is not None:
+            await self.stale_rows.flush_async()
+        await super().close()
+
+    def mark_stage(self, stage: str, error: str | None = None):
+        _logger.info(f"Client reached startup stage {stage}")
+        self.lifecycle.mark(stage, error=error)
+        self.publish_status()
+
+    # Lets an API running in another process report on this client
+    def publish_status(self):
+        if self.status_board is None:
+            return
+        try:
+            self.status_board.publish(lifecycle.BOT_STATUS_NAME, self.lifecycle.status())
+            self._status_published_at = time.time()
+        except Exception as e:
+            _logger.warning(f"Failed to publish client status: {e}")
 
     async def sync_commands(self, guild: discord.Guild, log=True):
         if log:
@@ -90,20 +243,86 @@ class MEClient(discord.Client):
         guilds = [int(g) for g in guilds if g != ""]
         return guilds
 
-    def me_setup(self, db, config):
+    def me_setup(
+        self,
+        db,
+        config,
+        command_queue: ipc.CommandQueue | None = None,
+        status_board: ipc.StatusBoard | None = None,
+    ):
         self.db = db
+        # Frames merged with the roles table and role menu layouts are keyed on the guild's versions
+        db.role_listeners.append(self.guild_cache.bump_roles)
+        self.settings = settings.SettingsStore(db)
+        self.permissions = PermissionManager(db)
+        self.stale_rows = StaleRowReaper(db, on_deleted=self.on_stale_rows_deleted)
+        self.reconciler = Reconciler(
+            self,
+            self.stale_rows,
+            interval=float(config.reconcile_interval),
+            guilds_per_tick=int(config.reconcile_guilds_per_tick),
+            cpu_budget=float(config.reconcile_cpu_budget),
+            delete_left_servers=me_config.is_enabled(config.reconcile_delete_left_servers),
+        )
         self.config = config
+        set_api_endpoint(config.discord_api_endpoint)
+        self.command_queue = command_queue
+        self.status_board = status_board
+
+    # Keeps the published status fresh while nothing else publishes it, even when IPC commands are stuck
+    async def publish_heartbeat(self):
+        while not self.is_closed():
+            await asyncio.sleep(STATUS_HEARTBEAT_INTERVAL)
+            if time.time() - self._status_published_at >= STATUS_HEARTBEAT_INTERVAL:
+                await asyncio.to_thread(self.publish_status)
+
+    async def process_ipc_commands(self):
+        interval = float(self.config.ipc_poll_interval)
+        await self.lifecycle.wait(lifecycle.READY)
+        _logger.info(f"Processing IPC commands every {interval} seconds")
+        while not self.is_closed():
+            try:
+                commands = await asyncio.to_thread(self.command_queue.claim)
+            except Exception as e:
+                _logger.exception(f"Failed to claim IPC commands: {e}")
+                commands = []
+            for command in commands:
+                await self.handle_ipc_command(command)
+            if len(commands) == 0:
+                await asyncio.sleep(interval)
+
+    async def handle_ipc_command(self, command: ipc.IPCCommand):
+        handler = self.ipc_handlers.get(command.command)
+        if handler is None:
+            _logger.warning(f"Ignoring unknown IPC command {command.command}")
+            return
+        _logger.info(f"Handling IPC command {command.command} {command.payload}")
+        try:
+            await handler(**command.payload)
+        except Exception as e:
+            _logger.exception(f"IPC command {command.command} failed: {e}")
 
-    async def update_messages(self):
-        df = self.db.get_messages_of_type_df(MessageType.ROLE_MESSAGE)
+    async def update_messages(self, guild_id: int | None = None):
+        if guild_id is None:
+            df = self.db.get_messages_of_type_df(MessageType.ROLE_MESSAGE)
+        else:
+            df = self.db.get_messages_of_type_df_and_server(
+                MessageType.ROLE_MESSAGE.value, guild_id
+            )
         me_role_message: me_view.MEView = self.role_group.message_group.get_views()[0]
-        for channel_id, df_group in df.groupby("channel_id"):
+        for channel_id, df_channel in df.groupby("channel_id"):
             channel = await self.fetch_channel(channel_id)
-            message_ids = df_group["message_id"].values
-            _logger.info(
-                f"Updating Role Message for channel {channel_id} with message ids {len(message_ids)}: {message_ids}"
-            )
-            await me_role_message.update(message_ids, channel)
+            # A group's messages are the pages of one menu
+            for first_message_id, df_group in df_channel.groupby("first_message_id"):
+                message_ids = sorted(df_group["message_id"].values)
+                _logger.info(
+                    f"Updating Role Message for channel {channel_id} with message ids {len(message_ids)}: {message_ids}"
+                )
+                # update sends or deletes pages, a display purging the same group at once would race it
+                async with self.guild_ops.lock(channel.guild.id):
+                    await me_role_message.update(
+                        message_ids, channel, first_message_id=first_message_id
+                    )
 
     # noinspection PyShadowingBuiltins
     def get_channel(
@@ -151,7 +370,10 @@ class MEClient(discord.Client):
             "channel_id": [channel.id for channel in channels],
             "channel_name": [channel.name for channel in channels],
             "channel_category_id": [channel.category_id for channel in channels],
-            "channel_category_name": [channel.category.name for channel in channels],
+            # Few distinct values, categorical keeps name filters per category instead of per row
+            "channel_category_name": pd.Categorical(
+                [channel.category.name for channel in channels]
+            ),
         }
         if permissions_for is not None:
             perms = [channel.permissions_for(permissions_for) for channel in channels]
@@ -162,45 +384,139 @@ class MEClient(discord.Client):
         df = DataFrame(channel_dict)
         if role_df:
             if isinstance(role_df, bool):
-                role_df = self.db.get_server_roles_df(guild.id)
+                # Roles without a channel can't match any channel, SQLite leaves them out
+                has_channel = IsNullFilter(
+                    "channel_id", default_index=False, allow_disable=False
+                )
+                role_df = self.db.get_server_roles_df(
+                    guild.id, filters=FilterManager(filters=[has_channel])
+                )
             df = pd.merge(
                 df, role_df, on="channel_id", how="left", validate="one_to_many"
             )
         return df
 
+    async def on_guild_role_create(self, role: Role):
+        self.guild_cache.on_role_create(role)
+
+    async def on_guild_role_delete(self, role: Role):
+        self.guild_cache.on_role_delete(role)
+        if self.permissions is not None:
+            self.permissions.on_role_delete(role.guild.id, role.id)
+        if self.stale_rows is not None:
+            self.stale_rows.delete_role(role.guild.id, role.id)
+
+    async def on_guild_role_update(self, before: Role, after: Role):
+        self.guild_cache.on_role_update(before, after)
+
+    async def on_guild_channel_create(self, channel: GuildChannel):
+        self.guild_cache.on_channel_create(channel)
+
+    async def on_guild_channel_delete(self, channel: GuildChannel):
+        self.guild_cache.on_channel_delete(channel)
+        if self.stale_rows is not None:
+            self.stale_rows.delete_channel(channel.guild.id, channel.id)
+
+    async def on_guild_channel_update(self, before: GuildChannel, after: GuildChannel):
+        self.guild_cache.on_channel_update(before, after)
+
+    async def on_member_update(self, before: Member, after: Member):
+        self.guild_cache.on_member_update(before, after)
+        if self.permissions is not None:
+            self.permissions.on_member_update(before, after)
+
+    async def on_member_remove(self, member: Member):
+        if self.permissions is not None:
+            self.permissions.on_member_remove(member)
+
+    async def on_guild_remove(self, guild: Guild):
+        self.guild_cache.forget_guild(guild.id)
+        self.servers.forget(guild.id)
+        if self.permissions is not None:
+            self.permissions.forget_guild(guild.id)
+        if self.stale_rows is not None:
+            self.stale_rows.delete_server(guild.id)
+
+    # Raw events also fire for messages that aren't in discord.py's message cache, like menus sent before a restart
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if self.stale_rows is not None and payload.guild_id is not None:
+            self.stale_rows.delete_messages(
+                payload.guild_id, payload.channel_id, [payload.message_id]
+            )
+
+    async def on_raw_bulk_message_delete(
+        self, payload: discord.RawBulkMessageDeleteEvent
+    ):
+        if self.stale_rows is not None and payload.guild_id is not None:
+            self.stale_rows.delete_messages(
+                payload.guild_id, payload.channel_id, payload.message_ids
+            )
+
+    # Role menu layouts and other data keyed on a guild's versions are rebuilt from the remaining rows
+    def on_stale_rows_deleted(self, server_ids: Set[int]):
+        for server_id in server_ids:
+            self.guild_cache.bump_roles(server_id)
+
+    # Shared between renders until the guild's roles or the member's roles change, don't modify the returned frame
     def get_role_df(self, guild_id, user):
+        key = ("roles", int(guild_id), user.id, self.guild_cache.get_version(int(guild_id)))
+        return self.filter_cache.get_or_compute(
+            key, lambda: self.load_role_df(guild_id, user)
+        )
+
+    def load_role_df(self, guild_id, user):
+        # One pass over the members, role.members would walk all of them once per role
+        member_counts = collections.Counter(
+            role.id for member in user.guild.members for role in member.roles
+        )
         all_roles = [
             (
                 role.id,
                 role.name,
                 me_util.can_manage(user, role),
+                role.position,
+                member_counts[role.id],
             )
             for role in user.guild.roles
         ]
         db_df = self.db.get_server_roles_df(guild_id)
-        df = pd.DataFrame(all_roles, columns=["role_id", "role_name", "can_manage"])
+        df = pd.DataFrame(
+            all_roles,
+            columns=["role_id", "role_name", "can_manage", "position", "member_count"],
+        )
         df = df.merge(db_df, how="left", on="role_id")
         return df
 
 
-intents = discord.Intents.default()
-intents.members = True
-client: MEClient = MEClient(intents=intents)
-
-
-@client.event
-async def on_ready():
-    _logger.info(f"Logged in as {client.user} (ID: {client.user.id})")
-    _logger.info("------")
+# Sends discord.py's REST calls to config's endpoint, like the stand-in from "python -m me discord-standin"
+def set_api_endpoint(endpoint: str):
+    endpoint = endpoint.rstrip("/")
+    if endpoint != discord.http.Route.BASE:
+        _logger.warning(f"Sending discord REST requests to {endpoint}")
+        discord.http.Route.BASE = endpoint
+
+
+# Runs the discord client as its own process, for the API's "api" run mode
+def run_bot(cfg: me_config.Config | None = None):
+    if cfg is None:
+        cfg = me_config.get_config()
+    db = db_util.SQLiteDB()
+    db.setup()
+    client = get_client()
+    client.me_setup(
+        db,
+        cfg,
+        command_queue=ipc.CommandQueue(db),
+        status_board=ipc.StatusBoard(db),
+    )
+    client.run(cfg.me_run_token, log_handler=None)
 
 
-@client.tree.command()
 async def meme(interaction: discord.Interaction):
     msg = f'Hi, {",".join([str(member) for member in interaction.user.guild.members])}'
     await interaction.response.send_message(msg)
 
 
-@client.tree.command()
 @app_commands.describe(
     first_value="The first value you want to add something to",
     second_value="The value you want to add to the first value",
@@ -215,7 +531,6 @@ async def add(interaction: discord.Interaction, first_value: int, second_value:
 # The rename decorator allows us to change the display of the parameter on Discord.
 # In this example, even though we use `text_to_send` in the code, the client will use `text` instead.
 # Note that other decorators will still refer to it as `text_to_send` in the code.
-@client.tree.command()
 @app_commands.rename(text_to_send="text")
 @app_commands.describe(text_to_send="Text to send in the current channel")
 async def send(interaction: discord.Interaction, text_to_send: str):
@@ -225,7 +540,6 @@ async def send(interaction: discord.Interaction, text_to_send: str):
 
 # To make an argument optional, you can either give it a supported default argument
 # or you can mark it as Optional from the typing standard library. This example does both.
-@client.tree.command()
 @app_commands.describe(
     member="The member you want to get the joined date from; defaults to the user who uses the command"
 )
@@ -241,7 +555,27 @@ async def joined(
     await interaction.response.send_message(msg)
 
 
-@client.event
-async def on_test_event(**kwargs):
-    # Use like client.dispatch("test_event")   <- With optional other args
-    _logger.info(f"Called test event with: {kwargs}")
+def create_client() -> MEClient:
+    intents = discord.Intents.default()
+    intents.members = True
+    new_client = MEClient(intents=intents)
+    for command in [meme, add, send, joined]:
+        new_client.tree.command()(command)
+    return new_client
+
+
+_client: MEClient | None = None
+
+
+# The shared client is only built when something asks for it, importing this module stays cheap
+def get_client() -> MEClient:
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def __getattr__(name: str):
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,9 +2,8 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, List
 
-import numpy as np
-
 from me.message_types import MessageType
+from me.permission_types import PermType
 
 if TYPE_CHECKING:
     from me.discord_bot.me_client import MEClient
@@ -13,6 +12,7 @@ from typing import Collection, Type, Dict
 
 import discord
 
+from me.io import settings
 from me.io.db_util import SQLiteDB
 from discord.ui import View
 
@@ -42,8 +42,8 @@ class MEView(View):
         Returns the persistent context of the view.
     get_message(**kwargs):
         Raises NotImplementedError. This method should be overridden in a subclass.
-    get_view(**kwargs) -> View:
-        Returns the view.
+    get_view(guild: discord.Guild = None, **kwargs) -> View:
+        Returns the view to send with the message.
     register(client: MEClient):
         Registers the view with the discord client.
     client_check():
@@ -159,6 +159,44 @@ class MEView(View):
         """
         raise NotImplementedError("MEMessage is an interface, override get_message()")
 
+    def get_view(self, guild: discord.Guild = None, **kwargs) -> View:
+        """
+        Returns the view to send with the message, the view itself unless overridden.
+
+        Parameters
+        ----------
+            guild : discord.Guild, optional
+                The guild the message is sent to (default is None).
+            **kwargs : dict
+                Arbitrary keyword arguments.
+
+        Returns
+        -------
+            View
+                The view to send.
+        """
+        return self
+
+    def get_page_count(self, guild: discord.Guild = None, **kwargs) -> int:
+        """
+        Returns the number of messages the view is displayed in, 1 unless overridden.
+
+        Each message gets its page number as the page keyword of get_message and get_view.
+
+        Parameters
+        ----------
+            guild : discord.Guild, optional
+                The guild the messages are sent to (default is None).
+            **kwargs : dict
+                Arbitrary keyword arguments.
+
+        Returns
+        -------
+            int
+                The number of messages.
+        """
+        return 1
+
     def register(self, client: MEClient):
         """
         Registers the view with the discord client.
@@ -192,6 +230,7 @@ class MEView(View):
         interaction: discord.Interaction = None,
         ephemeral=False,
         replace_message=False,
+        page: int = 0,
     ) -> discord.Message:
         """
         Displays the view.
@@ -206,6 +245,8 @@ class MEView(View):
                 Whether the view is ephemeral (default is False).
             replace_message : bool, optional
                 Whether to replace the message (default is False).
+            page : int, optional
+                The page to display, see get_page_count (default is 0).
 
         Returns
         -------
@@ -224,21 +265,22 @@ class MEView(View):
         channel = self.get_client().get_channel(channel)
 
         if channel is not None and not ephemeral:
-            kwargs = {"guild": channel.guild}
+            kwargs = {"guild": channel.guild, "page": page}
             return await channel.send(
                 self.get_message(interaction=interaction, **kwargs),
-                view=self,
+                view=self.get_view(**kwargs),
             )
         elif interaction is not None:
             delete_after = self.timeout if ephemeral else None
-            kwargs = {"guild": channel.guild, "user": interaction.user}
+            kwargs = {"guild": channel.guild, "user": interaction.user, "page": page}
             msg = self.get_message(interaction=interaction, **kwargs)
+            view = self.get_view(**kwargs)
             if replace_message:
                 await interaction.response.defer()
-                return await interaction.edit_original_response(content=msg, view=self)
+                return await interaction.edit_original_response(content=msg, view=view)
             return await interaction.response.send_message(
                 msg,
-                view=self,
+                view=view,
                 ephemeral=ephemeral,
                 delete_after=delete_after,
             )
@@ -251,9 +293,13 @@ class MEView(View):
         self,
         messages: Collection[int | discord.Message] | int | discord.Message,
         channel=None,
+        first_message_id: int = None,
     ):
         """
-        Updates the view.
+        Updates the messages of one displayed group, in the order they were sent.
+
+        When the view now takes a different number of pages, messages are sent or deleted to match and recorded in the
+        group's rows.
 
         Parameters
         ----------
@@ -261,6 +307,8 @@ class MEView(View):
                 The messages to update.
             channel : int, optional
                 The id of the channel where the messages are located (default is None).
+            first_message_id : int, optional
+                The id the group is stored under, looked up from the first message when None (default is None).
 
         Raises
         ------
@@ -272,13 +320,31 @@ class MEView(View):
         channel = self.get_client().get_channel(channel)
         if channel is None:
             raise ValueError("Channel is required to fetch message by id")
-        for message in messages:
-            if not isinstance(message, discord.Message):
-                message = await channel.fetch_message(int(message))
-            await message.edit(
-                content=self.get_message(interaction=None, **{"guild": channel.guild}),
-                view=self,
-            )
+        message_ids = sorted(
+            message.id if isinstance(message, discord.Message) else int(message)
+            for message in messages
+        )
+        page_count = self.get_page_count(guild=channel.guild)
+        for page in range(page_count):
+            kwargs = {"guild": channel.guild, "page": page}
+            content = self.get_message(interaction=None, **kwargs)
+            view = self.get_view(**kwargs)
+            if page < len(message_ids):
+                await channel.get_partial_message(message_ids[page]).edit(
+                    content=content, view=view
+                )
+            else:
+                if first_message_id is None:
+                    first_message_id = self.get_db().get_first_message_id(
+                        channel.id, message_ids[0]
+                    )
+                message = await channel.send(content, view=view)
+                self.get_db().add_group_messages(first_message_id, channel.id, [message.id])
+        surplus = message_ids[page_count:]
+        if len(surplus) > 0:
+            for message_id in surplus:
+                await channel.get_partial_message(message_id).delete()
+            self.get_db().delete_group_messages(channel.id, surplus)
 
     def get_db(self) -> SQLiteDB:
         """
@@ -352,6 +418,28 @@ class MEView(View):
             raise ValueError("No previous view to go back to")
         self.add_nav_button(label="Back", linked_view=self.previous_view, **kwargs)
 
+    def has_permission(self, permission: PermType, member: discord.Member = None) -> bool:
+        """
+        Returns whether a member may use a feature, see PermissionManager.member_can.
+
+        Parameters
+        ----------
+            permission : PermType
+                The permission the feature needs.
+            member : discord.Member, optional
+                The member to check, the user behind the view's interaction when None (default is None).
+
+        Returns
+        -------
+            bool
+                Whether the member has the permission.
+        """
+        if member is None and self.previous_interaction is not None:
+            member = self.previous_interaction.user
+        if not isinstance(member, discord.Member):
+            return False
+        return self.get_client().permissions.member_can(member, permission)
+
     def get_client(self):
         return self._client
 
@@ -369,11 +457,13 @@ class MEViewGroup:
     message_type : MessageType
         The type of the message.
     max_messages_per_user : int
-        The maximum number of messages per user.
+        The default maximum number of messages per user.
     max_messages_per_server : int
-        The maximum number of messages per server.
+        The default maximum number of messages per server.
     max_messages_per_channel : int
-        The maximum number of messages per channel.
+        The default maximum number of messages per channel.
+    max_messages_settings : Dict[str, settings.Setting]
+        The per-guild settings overriding the maximums, keyed by "user", "server" and "channel".
     delete_on_startup : bool
         Whether to delete the messages on startup.
     ephemeral : bool
@@ -385,13 +475,15 @@ class MEViewGroup:
         Returns the views in the group.
     register(client: MEClient):
         Registers the group with the discord client.
+    get_max_messages(scope: str, server_id: int = None) -> int:
+        Returns the guild's maximum number of messages for a scope.
     purge_user_messages(user_id: int, server_id: int, max_messages_per_user: int = None):
         Purges the user's messages.
     delete_oldest(message_df):
         Deletes the oldest message.
     purge_server_messages(server_id: int, max_messages_per_server: int = None):
         Purges the server's messages.
-    purge_channel_messages(channel_id: int, max_messages_per_channel: int = None):
+    purge_channel_messages(channel_id: int, max_messages_per_channel: int = None, server_id: int = None):
         Purges the channel's messages.
     display(user_id: int = None, channel: int = None, interaction: discord.Interaction = None, ephemeral=None)
      -> List[discord.Message]:
@@ -443,6 +535,18 @@ class MEViewGroup:
         self.max_messages_per_server = max_messages_per_server
         self.delete_on_startup = delete_on_startup
         self.ephemeral = ephemeral
+        prefix = message_type.name.lower()
+        self.max_messages_settings = {
+            "user": settings.int_setting(
+                f"{prefix}.max_messages_per_user", max_messages_per_user
+            ),
+            "server": settings.int_setting(
+                f"{prefix}.max_messages_per_server", max_messages_per_server
+            ),
+            "channel": settings.int_setting(
+                f"{prefix}.max_messages_per_channel", max_messages_per_channel
+            ),
+        }
 
     def get_views(self) -> List[MEView]:
         """
@@ -476,6 +580,28 @@ class MEViewGroup:
                 self.get_client().get_channel(channel_id).delete_messages(message_id)
             self.get_db().delete_messages(message_and_channel_ids)
 
+    def get_max_messages(self, scope: str, server_id: int = None) -> int:
+        """
+        Returns the guild's maximum number of messages for a scope, from memory after the guild's first lookup.
+
+        Parameters
+        ----------
+            scope : str
+                One of "user", "server" or "channel".
+            server_id : int, optional
+                The id of the server, the group's default is returned without it (default is None).
+
+        Returns
+        -------
+            int
+                The maximum number of messages.
+        """
+        setting = self.max_messages_settings[scope]
+        store = getattr(self.get_client(), "settings", None)
+        if server_id is None or store is None:
+            return setting.default
+        return store.get(server_id, setting)
+
     async def purge_user_messages(
         self, user_id: int, server_id: int, max_messages_per_user: int = None
     ):
@@ -489,14 +615,14 @@ class MEViewGroup:
             server_id : int
                 The id of the server.
             max_messages_per_user : int, optional
-                The maximum number of messages per user (default is None).
+                The maximum number of messages per user, the guild's setting when None (default is None).
         """
         if max_messages_per_user is None:
-            max_messages_per_user = self.max_messages_per_user
+            max_messages_per_user = self.get_max_messages("user", server_id)
         message_df = self.get_db().get_messages_of_type_and_user_df(
             self.message_type.value, user_id, server_id
         )
-        message_df["first_message_id"] = message_df["first_message_id"].astype(np.int64)
+        message_df["first_message_id"] = message_df["first_message_id"].astype("int64")
         while (
             len(message_df.drop_duplicates(["first_message_id", "channel_id"]))
             > max_messages_per_user
@@ -535,11 +661,11 @@ class MEViewGroup:
         self, server_id: int, max_messages_per_server: int = None
     ):
         if max_messages_per_server is None:
-            max_messages_per_server = self.max_messages_per_server
+            max_messages_per_server = self.get_max_messages("server", server_id)
         message_df = self.get_db().get_messages_of_type_df_and_server(
             self.message_type.value, server_id
         )
-        message_df["first_message_id"] = message_df["first_message_id"].astype(np.int64)
+        message_df["first_message_id"] = message_df["first_message_id"].astype("int64")
         while (
             len(message_df.drop_duplicates(["first_message_id", "channel_id"]))
             > max_messages_per_server
@@ -547,14 +673,17 @@ class MEViewGroup:
             message_df = await self.delete_oldest(message_df)
 
     async def purge_channel_messages(
-        self, channel_id: int, max_messages_per_channel: int = None
+        self,
+        channel_id: int,
+        max_messages_per_channel: int = None,
+        server_id: int = None,
     ):
         if max_messages_per_channel is None:
-            max_messages_per_channel = self.max_messages_per_channel
+            max_messages_per_channel = self.get_max_messages("channel", server_id)
         message_df = self.get_db().get_messages_of_type_df_and_channel(
             self.message_type.value, channel_id
         )
-        message_df["first_message_id"] = message_df["first_message_id"].astype(np.int64)
+        message_df["first_message_id"] = message_df["first_message_id"].astype("int64")
         while (
             len(message_df.drop_duplicates(["first_message_id", "channel_id"]))
             > max_messages_per_channel
@@ -582,28 +711,41 @@ class MEViewGroup:
         if ephemeral is None:
             ephemeral = self.ephemeral
 
+        guild = interaction.guild if interaction is not None else None
+        if guild is None:
+            guild = self.get_client().get_channel(channel).guild
         messages = []
-        for view in self.get_views():
-            message = await view.display(
-                channel=channel, interaction=interaction, ephemeral=ephemeral
-            )
-            ephemeral = False  # Only the one message can be ephemeral
-            messages.append(message)
-
-        if (
-            len(messages) > 0 and not ephemeral
-        ):  # Don't save ephemeral messages, they might not be accurate
-            message_ids = [message.id for message in messages]
-            self.get_db().add_messages(
-                message_ids,
-                self.message_type,
-                messages[0].channel.id,
-                user_id,
-                server_id=messages[0].guild.id,
-            )
-            await self.purge_user_messages(user_id, messages[0].guild.id)
-            await self.purge_server_messages(messages[0].guild.id)
-            await self.purge_channel_messages(messages[0].channel.id)
+        # Sent, stored and purged under one lock: concurrent displays would purge from the same rows and delete the
+        # same messages twice, and a menu refresh could miss pages that are sent but not stored yet
+        async with self.get_client().guild_ops.lock(guild.id):
+            for view in self.get_views():
+                for page in range(view.get_page_count(guild=guild)):
+                    message = await view.display(
+                        channel=channel,
+                        interaction=interaction,
+                        ephemeral=ephemeral,
+                        page=page,
+                    )
+                    ephemeral = False  # Only the one message can be ephemeral
+                    messages.append(message)
+
+            if (
+                len(messages) > 0 and not ephemeral
+            ):  # Don't save ephemeral messages, they might not be accurate
+                message_ids = [message.id for message in messages]
+                server_id = messages[0].guild.id
+                self.get_db().add_messages(
+                    message_ids,
+                    self.message_type,
+                    messages[0].channel.id,
+                    user_id,
+                    server_id=server_id,
+                )
+                await self.purge_user_messages(user_id, server_id)
+                await self.purge_server_messages(server_id)
+                await self.purge_channel_messages(
+                    messages[0].channel.id, server_id=server_id
+                )
         if interaction is not None and not interaction.response.is_done():
             try:
                 await interaction.response.send_message(
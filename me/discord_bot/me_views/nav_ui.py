@@ -7,6 +7,7 @@ import pandas as pd
 from discord import ButtonStyle, Emoji, PartialEmoji
 from me.discord_bot.me_views import me_view
 import me.discord_bot.me_views.items as items
+from me.permission_types import PermType
 
 if TYPE_CHECKING:
     from me.discord_bot.me_client import MEClient
@@ -67,12 +68,21 @@ class NavButton(discord.ui.Button, items.Item):
 
 class NavModal(items.MEModal):
     publish_context = False
+    # Checked again on submit, the member may have lost it since the modal was opened
+    permission: PermType | None = None
 
     def __init__(self, modal_button, **kwargs):
         self.modal_button = modal_button
         super().__init__(**kwargs)
 
     async def on_submit(self, interaction: discord.Interaction):
+        if self.permission is not None and not self.modal_button.get_view().has_permission(
+            self.permission, member=interaction.user
+        ):
+            await interaction.response.send_message(
+                "You don't have permission to do this", ephemeral=True
+            )
+            return
         self.publish_context = True
         await self.modal_button.load_view(interaction)
 
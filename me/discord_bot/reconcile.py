@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, List, Set, Tuple
+
+import discord
+
+from me import lifecycle
+from me.io import metrics
+from me.io.stale_rows import StaleRowReaper
+
+if TYPE_CHECKING:
+    from me.discord_bot.me_client import MEClient
+
+_logger = logging.getLogger(__name__)
+
+
+def get_orphans(
+    guild: discord.Guild, role_ids: Set[int], channel_ids: Set[int]
+) -> Tuple[Set[int], Set[int]]:
+    # Stored ids are few next to a guild's roles and channels, so each is looked up instead of building sets of both
+    orphan_roles = {role_id for role_id in role_ids if guild.get_role(role_id) is None}
+    # Archived threads aren't in the cache either, so these are only candidates until fetched
+    unresolved_channels = {
+        channel_id
+        for channel_id in channel_ids
+        if guild.get_channel_or_thread(channel_id) is None
+    }
+    return orphan_roles, unresolved_channels
+
+
+class Reconciler:
+    """
+    Catches deletions the gateway events missed, like ones made while the bot was offline.
+
+    Each tick checks the next guilds_per_tick guilds of the current pass: their stored role and channel ids are read
+    with one query and compared with discord.py's guild cache, orphans go to the StaleRowReaper. Channels missing from
+    the cache, which archived threads are, are fetched and only deleted when Discord answers NotFound. A tick stops
+    early once the comparisons used cpu_budget seconds and yields to the event loop between guilds.
+
+    Servers the bot left are handled by on_guild_remove. With delete_left_servers, every pass also drops the message
+    rows of stored servers missing from client.guilds, which misses removals made while the bot was offline but would
+    also catch guilds that are only temporarily absent.
+    """
+
+    def __init__(
+        self,
+        client: MEClient,
+        reaper: StaleRowReaper,
+        interval: float = 30,
+        guilds_per_tick: int = 50,
+        cpu_budget: float = 0.005,
+        delete_left_servers: bool = False,
+    ):
+        self.client = client
+        self.reaper = reaper
+        self.interval = interval
+        self.guilds_per_tick = guilds_per_tick
+        self.cpu_budget = cpu_budget
+        self.delete_left_servers = delete_left_servers
+        # Guild ids left in the current pass, the next ones at the end
+        self._queue: List[int] = []
+        self.passes = 0
+
+    async def run(self):
+        await self.client.lifecycle.wait(lifecycle.READY)
+        _logger.info(
+            f"Reconciling {self.guilds_per_tick} guilds every {self.interval} seconds"
+        )
+        while not self.client.is_closed():
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                _logger.exception(f"Failed to reconcile guilds: {e}")
+
+    async def start_pass(self):
+        self.passes += 1
+        guild_ids = {guild.id for guild in self.client.guilds}
+        if self.delete_left_servers:
+            stored = await asyncio.to_thread(self.client.db.get_message_server_ids)
+            for server_id in stored:
+                if server_id not in guild_ids:
+                    self.reaper.delete_server(server_id)
+        self._queue = sorted(guild_ids, reverse=True)
+
+    async def tick(self) -> int:
+        if len(self._queue) == 0:
+            await self.start_pass()
+        batch = self._queue[-self.guilds_per_tick :][::-1]
+        if len(batch) == 0:
+            return 0
+        del self._queue[-len(batch) :]
+        tracked = await asyncio.to_thread(self.client.db.get_tracked_ids, batch)
+        spent = 0.0
+        checked = 0
+        unresolved = []
+        for guild_id in batch:
+            if spent >= self.cpu_budget:
+                break
+            started = time.perf_counter()
+            unresolved.extend(
+                (guild_id, channel_id)
+                for channel_id in self.reconcile_guild(guild_id, *tracked[guild_id])
+            )
+            spent += time.perf_counter() - started
+            checked += 1
+            await asyncio.sleep(0)
+        # Left over guilds are checked first next tick
+        self._queue.extend(reversed(batch[checked:]))
+        metrics.increment("reconcile.guilds", checked)
+        # Fetching waits on Discord, not the CPU, so it isn't part of the budget
+        for guild_id, channel_id in unresolved:
+            if await self.is_channel_deleted(channel_id):
+                self.reaper.delete_channel(guild_id, channel_id)
+                metrics.increment("reconcile.orphan_channels")
+                _logger.info(f"Guild {guild_id} deleted channel {channel_id}")
+        return checked
+
+    # Returns the channel ids that aren't in the cache, their rows are only deleted once is_channel_deleted confirms
+    def reconcile_guild(self, guild_id: int, role_ids: Set[int], channel_ids: Set[int]) -> Set[int]:
+        guild = self.client.get_guild(guild_id)
+        # An unavailable guild's cache is empty, everything would look deleted
+        if guild is None or guild.unavailable:
+            return set()
+        orphan_roles, unresolved_channels = get_orphans(guild, role_ids, channel_ids)
+        for role_id in orphan_roles:
+            self.reaper.delete_role(guild_id, role_id)
+        if orphan_roles:
+            metrics.increment("reconcile.orphan_roles", len(orphan_roles))
+            _logger.info(f"Guild {guild_id} has {len(orphan_roles)} deleted roles")
+        return unresolved_channels
+
+    async def is_channel_deleted(self, channel_id: int) -> bool:
+        try:
+            await self.client.fetch_channel(channel_id)
+        except discord.NotFound:
+            return True
+        # Forbidden and failed requests don't say the channel is gone
+        except discord.HTTPException as e:
+            _logger.debug(f"Couldn't fetch channel {channel_id}, keeping its rows: {e}")
+        return False
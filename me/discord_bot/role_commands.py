@@ -1,45 +1,318 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
+import math
+import re
+from typing import List, Optional, Sequence, Tuple
 
 import discord
 from discord import app_commands
 
 from me.discord_bot.me_views.me_view import MEView, MEViewGroup
+from me.discord_bot.role_layout import (
+    HIDDEN_CATEGORY,
+    MAX_ROWS,
+    RoleButtonSpec,
+    RoleMenuLayout,
+    get_component_emoji,
+)
 from me.discord_bot.views.admin_view import Admin
+from me.permission_types import PermType
+
+# Discord's limit of options per select
+MAX_SELECT_OPTIONS = 25
+# The Change Roles and Admin buttons on the first message of a menu
+HEADER_ROWS = 1
 
 
 class RoleView(MEView):
+    """
+    The role menu message. Every component on it is a DynamicItem, so discord.py routes clicks on any number of menu
+    messages through the registered item classes without keeping a View per message.
+    """
+
     def __init__(self, ephemeral=False, **kwargs):
         super().__init__(timeout=None, **kwargs)
         self.ephemeral = ephemeral
-        self.add_nav_button(
-            linked_view=Admin,
-            label="Admin",
-            replace_message=False,
-        )
+        for item in get_header_items():
+            self.add_item(item)
 
     def get_message(
-        self, interaction: discord.Interaction | None = None, **kwargs
+        self, interaction: discord.Interaction | None = None, page: int = 0, **kwargs
     ) -> str:
-        return (
-            f":ballot_box_with_check:  **ME Bot Role Menu**\n"
-            f"Bot restarted at {datetime.datetime.now().strftime('%H:%M:%S')}"
+        headings = []
+        guild = kwargs.get("guild")
+        if guild is not None:
+            headings = self.get_layout(guild).pages[page].headings
+        if page > 0:
+            return "\n".join(headings)
+        return "\n".join(
+            [
+                ":ballot_box_with_check:  **ME Bot Role Menu**",
+                f"Bot restarted at {datetime.datetime.now().strftime('%H:%M:%S')}",
+            ]
+            + headings
+        )
+
+    def get_layout(self, guild: discord.Guild) -> RoleMenuLayout:
+        return self.get_client().role_layouts.get(guild, header_rows=HEADER_ROWS)
+
+    def get_page_count(self, guild: discord.Guild = None, **kwargs) -> int:
+        if guild is None:
+            return 1
+        return len(self.get_layout(guild).pages)
+
+    def get_view(
+        self, guild: discord.Guild = None, page: int = 0, **kwargs
+    ) -> discord.ui.View:
+        if guild is None:
+            return self
+        view = discord.ui.View(timeout=None)
+        if page == 0:
+            for item in get_header_items():
+                view.add_item(item)
+        menu_page = self.get_layout(guild).pages[page]
+        for i, row in enumerate(menu_page.rows):
+            for spec in row:
+                view.add_item(RoleToggleButton.from_spec(spec, row=menu_page.first_row + i))
+        return view
+
+
+def get_header_items() -> List[discord.ui.Item]:
+    return [ChangeRolesButton(), AdminButton()]
+
+
+class ChangeRolesButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"me_bot:RoleMessageView:change_roles",
+):
+    def __init__(self):
+        super().__init__(
+            discord.ui.Button(
+                label="Change Roles",
+                style=discord.ButtonStyle.blurple,
+                custom_id="me_bot:RoleMessageView:change_roles",
+                row=0,
+            )
+        )
+
+    @classmethod
+    async def from_custom_id(
+        cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /
+    ):
+        return cls()
+
+    async def callback(self, interaction: discord.Interaction):
+        client = interaction.client
+        rows = await client.guild_ops.share_in_thread(
+            interaction.guild_id,
+            "role_rows",
+            client.db.get_server_role_rows,
+            interaction.guild_id,
+        )
+        view = RoleMenuView(interaction.user, rows)
+        if len(view.children) == 0:
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message(
+                "No roles have been added to the role menu yet", ephemeral=True
+            )
+        else:
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message(
+                "Pick the roles you want, changes are applied together",
+                view=view,
+                ephemeral=True,
+            )
+
+
+# Keeps the custom_id the Admin NavButton had, so menus sent before still open the admin view
+class AdminButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"me:NavButton:default:Admin",
+):
+    def __init__(self):
+        super().__init__(
+            discord.ui.Button(
+                label="Admin",
+                style=discord.ButtonStyle.secondary,
+                custom_id="me:NavButton:default:Admin",
+                row=0,
+            )
+        )
+
+    @classmethod
+    async def from_custom_id(
+        cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /
+    ):
+        return cls()
+
+    async def callback(self, interaction: discord.Interaction):
+        client = interaction.client
+        view = Admin(
+            client=client,
+            interaction=interaction,
+            previous_view=client.role_message_group.get_views()[0],
+        )
+        await view.display(interaction=interaction, ephemeral=True)
+
+
+class RoleToggleButton(
+    discord.ui.DynamicItem[discord.ui.Button],
+    template=r"me_bot:role:(?P<category_id>[0-9]+):(?P<role_id>[0-9]+)",
+):
+    """
+    Toggles one role of the roles table, category_id is the category the button was laid out under (0 for none).
+    """
+
+    def __init__(
+        self,
+        role_id: int,
+        category_id: int = 0,
+        label: str | None = None,
+        emoji: discord.PartialEmoji | discord.Emoji | None = None,
+        style: discord.ButtonStyle = discord.ButtonStyle.secondary,
+        row: int | None = None,
+    ):
+        super().__init__(
+            discord.ui.Button(
+                label=label,
+                emoji=emoji,
+                style=style,
+                custom_id=f"me_bot:role:{category_id}:{role_id}",
+                row=row,
+            )
+        )
+        self.role_id = role_id
+        self.category_id = category_id
+
+    @classmethod
+    def from_spec(cls, spec: RoleButtonSpec, row: int | None = None) -> RoleToggleButton:
+        return cls(
+            spec.role_id,
+            spec.category_id,
+            label=spec.label,
+            emoji=spec.emoji,
+            style=spec.style,
+            row=row,
         )
 
-    @discord.ui.button(
-        label="Change Roles",
-        style=discord.ButtonStyle.blurple,
-        custom_id="me_bot:RoleMessageView:change_roles",
-    )
-    async def change_roles(
-        self, interaction: discord.Interaction, button: discord.ui.Button
+    @classmethod
+    async def from_custom_id(
+        cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /
     ):
+        return cls(int(match["role_id"]), int(match["category_id"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        client = interaction.client
         # noinspection PyUnresolvedReferences
-        await interaction.response.send_message(
-            f"TODO Actually put stuff here {datetime.datetime.now()}",
-            view=StaticSampleView(),
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        # Menus sent before a role was taken off the menu still have its button
+        if not await client.guild_ops.share_in_thread(
+            interaction.guild_id,
+            ("is_menu_role", self.role_id),
+            client.db.is_menu_role,
+            interaction.guild_id,
+            self.role_id,
+        ):
+            await interaction.followup.send(
+                "That role is no longer on the role menu", ephemeral=True
+            )
+            return
+        result = await client.role_toggler.toggle(interaction.user, self.role_id)
+        await interaction.followup.send(
+            result.describe(),
+            ephemeral=True,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
+
+
+class RoleMenuSelect(discord.ui.Select):
+    def __init__(self, options: List[discord.SelectOption]):
+        super().__init__(
+            placeholder="Choose your roles",
+            min_values=0,
+            max_values=len(options),
+            options=options,
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        selected = {int(value) for value in self.values}
+        offered = {int(option.value) for option in self.options}
+        # noinspection PyUnresolvedReferences
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        result = await interaction.client.role_toggler.request(
+            interaction.user, add=selected, remove=offered - selected
+        )
+        await interaction.followup.send(
+            result.describe(),
+            ephemeral=True,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
+
+
+class RoleMenuPageButton(discord.ui.Button):
+    def __init__(self, label: str, page: int, disabled: bool = False):
+        super().__init__(
+            label=label,
+            style=discord.ButtonStyle.secondary,
+            disabled=disabled,
+            row=MAX_ROWS - 1,
         )
+        self.page = page
+
+    async def callback(self, interaction: discord.Interaction):
+        view = RoleMenuView(interaction.user, self.view.rows, page=self.page)
+        # noinspection PyUnresolvedReferences
+        await interaction.response.edit_message(view=view)
+
+
+class RoleMenuView(discord.ui.View):
+    """
+    Ephemeral multi-selects over the guild's rows in the roles table, with the member's current roles preselected.
+
+    Up to MAX_ROWS selects fit on one message, larger menus are split into pages of one select less and a row of page
+    buttons.
+    """
+
+    def __init__(
+        self,
+        member: discord.Member,
+        rows: Sequence[Tuple[int, str | None, int | None]],
+        timeout: float = 5 * 60,
+        page: int = 0,
+    ):
+        super().__init__(timeout=timeout)
+        self.rows = rows
+        options = []
+        for role_id, emoji, _channel_id in rows:
+            role = member.guild.get_role(role_id)
+            if role is None or role.is_default():
+                continue
+            options.append(
+                discord.SelectOption(
+                    label=role.name[:100],
+                    value=str(role_id),
+                    emoji=get_component_emoji(member.guild, emoji),
+                    default=member.get_role(role_id) is not None,
+                )
+            )
+        per_page = MAX_SELECT_OPTIONS * MAX_ROWS
+        if len(options) > per_page:
+            per_page = MAX_SELECT_OPTIONS * (MAX_ROWS - 1)
+        page_count = max(math.ceil(len(options) / per_page), 1)
+        page = min(max(page, 0), page_count - 1)
+        options = options[page * per_page : (page + 1) * per_page]
+        for i in range(0, len(options), MAX_SELECT_OPTIONS):
+            self.add_item(RoleMenuSelect(options[i : i + MAX_SELECT_OPTIONS]))
+        if page_count > 1:
+            self.add_item(RoleMenuPageButton("Previous", page - 1, disabled=page == 0))
+            self.add_item(
+                RoleMenuPageButton(f"{page + 1}/{page_count}", page, disabled=True)
+            )
+            self.add_item(
+                RoleMenuPageButton("Next", page + 1, disabled=page == page_count - 1)
+            )
 
 
 class RoleCommandGroup(app_commands.Group):
@@ -47,47 +320,61 @@ class RoleCommandGroup(app_commands.Group):
         super().__init__(name="role", description="Commands for managing roles")
         self.client = role_message_group.get_client()
         self.message_group = role_message_group
-        # more_view.register(self.client)
-        # role_dropdown_group.register(self.client)
-        # For dynamic items, we must register the classes instead of the views.
-        # self.client.add_dynamic_items(DynamicButton)
+        # Role buttons are only sent in per-guild views, so their class is registered here instead of through a view
+        self.client.add_dynamic_items(RoleToggleButton)
 
     @app_commands.command()
     async def message(self, interaction: discord.Interaction):
         await self.message_group.display(interaction=interaction)
 
-
-class StaticSampleView(discord.ui.View):
-    def __init__(self, ephemeral=True):
-        super().__init__(timeout=None)
-        self.ephemeral = ephemeral
-
-    @discord.ui.button(
-        label="Blurple",
-        style=discord.ButtonStyle.blurple,
-        custom_id="me_bot:MessageDropdown:todo43134",
-    )
-    async def green(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # noinspection PyUnresolvedReferences
+    @app_commands.command(description="Move a menu role to a category, leave it empty to uncategorize the role")
+    @app_commands.guild_only()
+    async def category(
+        self,
+        interaction: discord.Interaction,
+        role: discord.Role,
+        category: Optional[str] = None,
+    ):
+        if not self.client.permissions.member_can(interaction.user, PermType.ROLES_CREATE):
+            await interaction.response.send_message(
+                "You don't have permission to manage menu roles", ephemeral=True
+            )
+            return
+        db = self.client.db
+        if category is not None and category != HIDDEN_CATEGORY:
+            if not await self.client.guild_cache.category_name_exists(
+                interaction.guild, category, db.get_server_role_category_names
+            ):
+                await interaction.response.send_message(
+                    f"There is no category named {category}", ephemeral=True
+                )
+                return
+        # The database notifies the role listeners, so the menu layout is rebuilt on the next update
+        async with self.client.guild_ops.lock(interaction.guild_id):
+            updated = await asyncio.to_thread(
+                db.set_role_category, interaction.guild_id, role.id, category
+            )
+        if not updated:
+            await interaction.response.send_message(
+                f"{role.mention} isn't on the role menu", ephemeral=True
+            )
+            return
         await interaction.response.send_message(
-            "This is blurple.", ephemeral=self.ephemeral
-        )
-
-
-class DynamicButton(discord.ui.Button):
-    def __init__(self, user_id: int) -> None:
-        super().__init__(
-            # discord.ui.Button(
-            label="Do Thing",
-            style=discord.ButtonStyle.blurple,
-            custom_id=f"button:user:{user_id}",
-            emoji="\N{THUMBS UP SIGN}",
-            # )
+            f"Moved {role.mention} to {category or 'no category'}", ephemeral=True
         )
-        self.user_id: int = user_id
+        await self.client.update_messages(interaction.guild_id)
 
-    async def callback(self, interaction: discord.Interaction) -> None:
-        # noinspection PyUnresolvedReferences
-        await interaction.response.send_message(
-            f"This is your very own button! ({self.user_id})", ephemeral=True
+    @category.autocomplete("category")
+    async def category_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        names = await self.client.guild_cache.get_category_names(
+            interaction.guild, self.client.db.get_server_role_category_names
         )
+        names = sorted(names | {HIDDEN_CATEGORY})
+        current = current.lower()
+        return [
+            app_commands.Choice(name=name, value=name)
+            for name in names
+            if current in name.lower()
+        ][:MAX_SELECT_OPTIONS]
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import discord
+
+from me.discord_bot.guild_cache import GuildCache
+from me.io.cache import LRUCache
+
+# Discord's limits: buttons per row and component rows per message
+MAX_ROW_BUTTONS = 5
+MAX_ROWS = 5
+# Roles in this category are kept off the menu, RoleCategoryAddView doesn't allow creating it
+HIDDEN_CATEGORY = "hidden"
+UNCATEGORIZED_ID = 0
+
+_logger = logging.getLogger(__name__)
+
+# (role_id, emoji, category rowid, category_name, category emoji), see SQLiteDB.get_server_role_layout_rows
+LayoutRow = Tuple[int, str | None, int | None, str | None, str | None]
+
+
+@dataclasses.dataclass(frozen=True)
+class RoleButtonSpec:
+    role_id: int
+    category_id: int
+    label: str
+    emoji: discord.PartialEmoji | discord.Emoji | None
+    style: discord.ButtonStyle
+
+
+@dataclasses.dataclass
+class RoleMenuPage:
+    # Rows taken by other components above the role buttons
+    first_row: int = 0
+    rows: List[List[RoleButtonSpec]] = dataclasses.field(default_factory=list)
+    # Category headings in the order their rows appear
+    headings: List[str] = dataclasses.field(default_factory=list)
+
+    def get_free_rows(self) -> int:
+        return MAX_ROWS - self.first_row - len(self.rows)
+
+
+@dataclasses.dataclass
+class RoleMenuLayout:
+    version: int
+    pages: List[RoleMenuPage]
+
+    def get_button_count(self) -> int:
+        return sum(len(row) for page in self.pages for row in page.rows)
+
+
+@dataclasses.dataclass
+class _Category:
+    category_id: int
+    name: str
+    heading: str
+    buttons: List[RoleButtonSpec] = dataclasses.field(default_factory=list)
+
+
+# Emoji are stored as :name:, only a guild's custom emoji can be resolved from that
+def get_component_emoji(
+    guild: discord.Guild, text: str | None
+) -> discord.PartialEmoji | discord.Emoji | None:
+    if text is None or text.strip() == "":
+        return None
+    text = text.strip()
+    if text.startswith(":") and text.endswith(":"):
+        return discord.utils.get(guild.emojis, name=text[1:-1])
+    return discord.PartialEmoji.from_str(text)
+
+
+def get_heading(name: str, emoji: str | None) -> str:
+    # role_categories keeps emoji without their colons
+    if emoji:
+        return f":{emoji.strip(':')}:  **{name}**"
+    return f"**{name}**"
+
+
+def build_layout(
+    guild: discord.Guild,
+    rows: Sequence[LayoutRow],
+    header_rows: int = 1,
+    version: int = 0,
+) -> RoleMenuLayout:
+    """
+    Packs the guild's menu roles into pages of at most MAX_ROWS rows of MAX_ROW_BUTTONS buttons, one page per message.
+
+    Each category starts on a new row, in category name order with uncategorized roles last, roles ordered like
+    Discord's role list. Rows are filled in order and a category continues on the next page when a page is full, so the
+    number of pages is the fewest the rows fit in. The first page leaves header_rows rows free for other components.
+    """
+    categories: Dict[int, _Category] = {}
+    roles = []
+    for role_id, emoji, category_id, category_name, category_emoji in rows:
+        if category_name == HIDDEN_CATEGORY:
+            continue
+        role = guild.get_role(role_id)
+        if role is None or role.is_default():
+            continue
+        if category_id is None:
+            category_id, category_name, category_emoji = UNCATEGORIZED_ID, "Other Roles", None
+        if category_id not in categories:
+            categories[category_id] = _Category(
+                category_id, category_name, get_heading(category_name, category_emoji)
+            )
+        roles.append((role, emoji, category_id))
+    ordered = sorted(
+        categories.values(),
+        key=lambda c: (c.category_id == UNCATEGORIZED_ID, c.name.lower()),
+    )
+    # Neighbouring categories get different colors, the rows of a message aren't labeled otherwise
+    styles = {
+        category.category_id: discord.ButtonStyle.blurple if i % 2 == 0 else discord.ButtonStyle.secondary
+        for i, category in enumerate(ordered)
+    }
+    for role, emoji, category_id in sorted(roles, key=lambda r: -r[0].position):
+        categories[category_id].buttons.append(
+            RoleButtonSpec(
+                role.id,
+                category_id,
+                role.name[:80],
+                get_component_emoji(guild, emoji),
+                styles[category_id],
+            )
+        )
+
+    pages = [RoleMenuPage(first_row=header_rows)]
+    for category in ordered:
+        continued = False
+        for i in range(0, len(category.buttons), MAX_ROW_BUTTONS):
+            page = pages[-1]
+            if page.get_free_rows() == 0:
+                page = RoleMenuPage()
+                pages.append(page)
+            if not continued:
+                page.headings.append(category.heading)
+            elif len(page.rows) == 0:
+                page.headings.append(f"{category.heading} (continued)")
+            continued = True
+            page.rows.append(category.buttons[i : i + MAX_ROW_BUTTONS])
+    return RoleMenuLayout(version, pages)
+
+
+class RoleLayoutCache:
+    """
+    Role menu layouts by guild, kept until the guild's GuildCache role version changes.
+
+    Role events and writes to the roles and role_categories tables bump the role version, see GuildCache.
+    """
+
+    def __init__(
+        self,
+        guild_cache: GuildCache,
+        load_rows: Callable[[int], Sequence[LayoutRow]],
+        max_guilds: int = 1000,
+    ):
+        self.guild_cache = guild_cache
+        self.load_rows = load_rows
+        self._layouts = LRUCache(max_entries=max_guilds, sizeof=lambda _: 0)
+
+    def get(self, guild: discord.Guild, header_rows: int = 1) -> RoleMenuLayout:
+        version = self.guild_cache.get_role_version(guild.id)
+        key = (guild.id, header_rows)
+        layout = self._layouts.get(key)
+        if layout is None or layout.version != version:
+            layout = build_layout(guild, self.load_rows(guild.id), header_rows, version)
+            _logger.debug(
+                f"Laid out {layout.get_button_count()} role buttons in {len(layout.pages)} messages for guild {guild.id}"
+            )
+            self._layouts.put(key, layout)
+        return layout
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import time
+from typing import Collection, Dict, List, Set, Tuple
+
+import discord
+
+from me.io import metrics
+
+_logger = logging.getLogger(__name__)
+
+# (guild_id, user_id)
+_Key = Tuple[int, int]
+
+
+@dataclasses.dataclass
+class RoleEditResult:
+    added: List[discord.Role] = dataclasses.field(default_factory=list)
+    removed: List[discord.Role] = dataclasses.field(default_factory=list)
+    # Roles that were asked for but can't be given or taken by the bot
+    skipped: List[discord.Role] = dataclasses.field(default_factory=list)
+    error: str | None = None
+
+    def describe(self) -> str:
+        lines = []
+        if self.added:
+            lines.append("Added " + ", ".join(role.mention for role in self.added))
+        if self.removed:
+            lines.append("Removed " + ", ".join(role.mention for role in self.removed))
+        if self.skipped:
+            lines.append("Can't change " + ", ".join(role.mention for role in self.skipped))
+        if self.error is not None:
+            lines.append(self.error)
+        return "\n".join(lines) if lines else "Your roles are already up to date"
+
+
+@dataclasses.dataclass
+class PendingRoleEdit:
+    member: discord.Member
+    started_at: float
+    add: Set[int] = dataclasses.field(default_factory=set)
+    remove: Set[int] = dataclasses.field(default_factory=set)
+    waiters: List[asyncio.Future] = dataclasses.field(default_factory=list)
+    handle: asyncio.TimerHandle | None = None
+
+    def merge(self, add: Collection[int], remove: Collection[int]):
+        # The latest click for a role wins
+        for role_id in add:
+            self.remove.discard(role_id)
+            self.add.add(role_id)
+        for role_id in remove:
+            self.add.discard(role_id)
+            self.remove.add(role_id)
+
+    def wants(self, role_id: int, has_role: bool) -> bool:
+        if role_id in self.add:
+            return True
+        if role_id in self.remove:
+            return False
+        return has_role
+
+
+class RoleToggler:
+    """
+    Applies role menu clicks as one member.edit(roles=...) per burst instead of one call per role.
+
+    Clicks from the same member in the same guild are merged into a pending diff, which is applied delay seconds after
+    the last click, or max_delay seconds after the first one while clicks keep coming. Edits of one member run one at
+    a time, so a burst never reads roles an earlier edit is still changing.
+    """
+
+    def __init__(self, delay: float = 0.75, max_delay: float = 2.5):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending: Dict[_Key, PendingRoleEdit] = {}
+        self._running: Dict[_Key, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def toggle(self, member: discord.Member, role_id: int) -> RoleEditResult:
+        pending = self._pending.get((member.guild.id, member.id))
+        has_role = member.get_role(role_id) is not None
+        if pending is not None:
+            has_role = pending.wants(role_id, has_role)
+        if has_role:
+            return await self.request(member, remove=[role_id])
+        return await self.request(member, add=[role_id])
+
+    async def request(
+        self,
+        member: discord.Member,
+        add: Collection[int] = (),
+        remove: Collection[int] = (),
+    ) -> RoleEditResult:
+        metrics.increment("roles.toggle.requests")
+        key = (member.guild.id, member.id)
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = PendingRoleEdit(member, now)
+            self._pending[key] = pending
+        else:
+            pending.member = member
+            pending.handle.cancel()
+        pending.merge(add, remove)
+        future = loop.create_future()
+        pending.waiters.append(future)
+        delay = min(self.delay, pending.started_at + self.max_delay - now)
+        pending.handle = loop.call_later(max(delay, 0.0), self._start, key)
+        return await future
+
+    def _start(self, key: _Key):
+        pending = self._pending.pop(key)
+        previous = self._running.get(key)
+        task = asyncio.create_task(self._apply(pending, previous))
+        self._running[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+
+    def _forget(self, key: _Key, task: asyncio.Task):
+        if self._running.get(key) is task:
+            del self._running[key]
+
+    async def _apply(
+        self, pending: PendingRoleEdit, previous: asyncio.Task | None
+    ) -> discord.Member | None:
+        member = pending.member
+        result = RoleEditResult(error="Your role change was interrupted, try again")
+        updated = None
+        try:
+            if previous is not None:
+                # asyncio.wait doesn't raise, a cancelled earlier edit doesn't cancel this one
+                await asyncio.wait([previous])
+                # An edit returns the updated member before the gateway reports it
+                if not previous.cancelled() and previous.result() is not None:
+                    member = previous.result()
+            member = member.guild.get_member(member.id) or member
+            result = RoleEditResult()
+            updated = await self.edit_roles(member, pending.add, pending.remove, result)
+        except asyncio.CancelledError:
+            result = RoleEditResult(error="Your role change was interrupted, try again")
+            raise
+        except discord.HTTPException as e:
+            _logger.warning(f"Failed to edit roles of {member.id} in {member.guild.id}: {e}")
+            result = RoleEditResult(error="Discord didn't accept the role change, try again later")
+        except Exception as e:
+            _logger.exception(f"Failed to edit roles of {member.id} in {member.guild.id}: {e}")
+            result = RoleEditResult(error="Something went wrong changing your roles")
+        finally:
+            for future in pending.waiters:
+                if not future.done():
+                    future.set_result(result)
+        return updated
+
+    @staticmethod
+    async def edit_roles(
+        member: discord.Member,
+        add: Set[int],
+        remove: Set[int],
+        result: RoleEditResult,
+    ) -> discord.Member | None:
+        guild = member.guild
+        current = {role.id for role in member.roles}
+        for role_id in sorted((add - current) | (remove & current)):
+            role = guild.get_role(role_id)
+            if role is None:
+                continue
+            if not role.is_assignable():
+                result.skipped.append(role)
+            elif role_id in add:
+                result.added.append(role)
+            else:
+                result.removed.append(role)
+        if not result.added and not result.removed:
+            return None
+        removed = {role.id for role in result.removed}
+        roles = [
+            role
+            for role in member.roles
+            if not role.is_default() and role.id not in removed
+        ] + result.added
+        metrics.increment("roles.toggle.edits")
+        return await member.edit(roles=roles, reason="ME role menu")
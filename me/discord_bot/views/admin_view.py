@@ -3,6 +3,7 @@ from __future__ import annotations
 import discord
 
 from me.discord_bot.me_views.me_view import MEView
+from me.permission_types import PermType
 from me.discord_bot.views.role_add import CreateRoleView
 from me.discord_bot.views.role_category_add_view import (
     RoleCategoryAddView,
@@ -13,32 +14,38 @@ from me.discord_bot.views.role_category_manage_view import RoleCategoryManageVie
 class Admin(MEView):
     def __init__(self, **kwargs):
         super().__init__(timeout=2 * 60, **kwargs)
+        can_create_roles = self.has_permission(PermType.ROLES_CREATE)
         self.add_nav_button(
             linked_view=CreateRoleView,
             label="Add Role",
             style=discord.ButtonStyle.blurple,
+            disabled=not can_create_roles,
         )
         self.add_nav_button(
             linked_view=CreateRoleView,
             label="TODO: Manage Roles",  # TODO
             style=discord.ButtonStyle.grey,
+            disabled=not can_create_roles,
         )
         self.add_nav_button(
             linked_view=CreateRoleView,
             label="TODO: Hide Roles",  # TODO
             style=discord.ButtonStyle.grey,
+            disabled=not can_create_roles,
         )
         self.add_nav_button(
             linked_view=RoleCategoryAddView,
             label="Create Category",
             style=discord.ButtonStyle.grey,
             row=1,
+            disabled=not can_create_roles,
         )
         self.add_nav_button(
             linked_view=RoleCategoryManageView,
             label="TODO: Manage Categories",  # TODO
             style=discord.ButtonStyle.grey,
             row=1,
+            disabled=not can_create_roles,
         )
 
     def get_message(self, interaction: discord.Interaction, **kwargs):
@@ -1,6 +1,7 @@
 import discord
 
 from me.discord_bot.me_views import me_view
+from me.io.data_filter import IsNullFilter, RangeFilter
 
 
 class MissingRoleView(me_view.MEView):
@@ -13,18 +14,25 @@ class MissingRoleView(me_view.MEView):
             self.previous_interaction.guild_id, self.previous_interaction.user
         )
         s = ""
-        linked_df = df[df["me_role_id"].notna()]
+        linked_df = IsNullFilter("me_role_id", default_index=False).filter(df)
         if len(linked_df) > 0:
             s += (
                 "Already Linked Roles:\n"
                 + " - ".join(linked_df["role_name"].values)
                 + "\n\n"
             )
-        manage_false_df = df[~df["can_manage"]]
-        if len(manage_false_df) > 0:
-            s += (
-                "Role Too Low to Manage:\n"
-                + " - ".join(manage_false_df["role_name"].values)
-                + "\n\n"
-            )
+        user = self.previous_interaction.user
+        if not user.guild_permissions.manage_roles:
+            s += "You need the Manage Roles permission to add roles\n\n"
+        elif user.guild.owner_id != user.id:
+            # Roles at or above the member's highest role can't be managed by them
+            too_high_df = RangeFilter(
+                "position", [(user.top_role.position, None)], selected_index=1
+            ).filter(df)
+            if len(too_high_df) > 0:
+                s += (
+                    "Role Too High to Manage:\n"
+                    + " - ".join(too_high_df["role_name"].values)
+                    + "\n\n"
+                )
         return s
@@ -3,14 +3,14 @@ from typing import Dict
 
 import discord
 from typing_extensions import deprecated
-import re
 
 from me import me_util
 from me.discord_bot.me_views import nav_ui, me_view
 from me.discord_bot.me_views.items import MESelect
 from me.discord_bot.views.missing_role_view import MissingRoleView
 from me.discord_bot.me_views.nav_ui import NavSelect
-from me.io.data_filter import FilterManager, IsNullFilter
+from me.io.data_filter import BoolFilter, FilterManager, IsNullFilter
+from me.permission_types import PermType
 
 EXISTING_DISCORD_ROLE = "Existing Discord Role"
 NEW_CHANNEL_NAME = "New Channel Name"
@@ -40,6 +40,8 @@ class RoleSelect(MESelect):
 
 
 class DescriptionModal(nav_ui.NavModal, title="Optional Descriptions"):
+    permission = PermType.ROLES_CREATE
+
     discord_role_name = discord.ui.TextInput(
         label=DISCORD_ROLE_NAME,
         placeholder="New role name here",
@@ -66,6 +68,8 @@ class DescriptionModal(nav_ui.NavModal, title="Optional Descriptions"):
 
 
 class NewChannelModal(nav_ui.NavModal, title="New Channel"):
+    permission = PermType.CHANNELS_CREATE
+
     discord_role_name = discord.ui.TextInput(
         label=NEW_CHANNEL_NAME,
         placeholder="New role name here",
@@ -194,23 +198,31 @@ class CreateRoleView(me_view.MEView):
         super().__init__(
             timeout=2 * 60, persistent_context=persistent_context, **kwargs
         )
+        if not self.has_permission(PermType.ROLES_CREATE):
+            self.previous_context["bonus_msg"] = f"{EMOJI_OCTAGONAL}  You don't have permission to add roles"
+            return
+        guild = self.previous_interaction.guild
+        guild_cache = self.get_client().guild_cache
         new_role_name = self.get_new_role_name()
-        if new_role_name is not None and new_role_name in [
-            role.name for role in self.previous_interaction.guild.roles
-        ]:
+        if guild_cache.role_name_exists(guild, new_role_name):
             del self.previous_context[DISCORD_ROLE_NAME]
             msg = f"{EMOJI_OCTAGONAL}  The role '{new_role_name}' already exists, please select a different name"
             self.previous_context["bonus_msg"] = msg
         new_channel_name = self.get_new_channel_name()
-        if new_channel_name is not None and new_channel_name in [
-            channel.name for channel in self.previous_interaction.guild.channels
-        ]:
+        if guild_cache.channel_name_exists(guild, new_channel_name):
             del self.previous_context[NEW_CHANNEL_NAME]
             msg = f"{EMOJI_OCTAGONAL}  The channel '{new_channel_name}' already exists, please select a different name"
             self.previous_context["bonus_msg"] = msg
         if self.previous_context.get("channel_filter", None) is None:
             self.previous_context["channel_filter"] = FilterManager(
-                filters=[IsNullFilter(col_name="role_id")]
+                filters=[
+                    IsNullFilter(col_name="role_id", default_index=True),
+                    BoolFilter(
+                        col_name="manage_permissions",
+                        default_index=True,
+                        allow_disable=False,
+                    ),
+                ]
             )
 
         select_channel = self.previous_context.get(SELECT_CHANNEL, False)
@@ -259,17 +271,23 @@ class CreateRoleView(me_view.MEView):
         )
 
     def get_channel_df(self):
-        channel_df = self.get_client().get_channel_df(
-            self.previous_interaction.guild,
-            permissions_for=self.previous_interaction.user,
-            permission_manage_permissions=True,
+        client = self.get_client()
+        guild = self.previous_interaction.guild
+        user = self.previous_interaction.user
+        return self.previous_context["channel_filter"].filter_cached(
+            client.filter_cache,
+            ("channels", guild.id, user.id),
+            client.guild_cache.get_version(guild.id),
+            lambda: client.get_channel_df(
+                guild,
+                role_df=True,
+                permissions_for=user,
+                permission_manage_permissions=True,
+            ),
         )
-        channel_df = self.previous_context["channel_filter"].filter(channel_df)
-        return channel_df
 
     def generate_channel_select(self):
         channel_df = self.get_channel_df()
-        channel_df = channel_df[channel_df["manage_permissions"]]
         self.add_item(
             NavSelect(
                 options=channel_df[["channel_id", "channel_name"]],
@@ -286,8 +304,16 @@ class CreateRoleView(me_view.MEView):
             self.get_new_channel_name() is None
             and self.get_existing_channel_id() is None
         ):
-            self.add_item(CreateChannelModalButton())
-            self.add_item(SelectChannelButton())
+            self.add_item(
+                CreateChannelModalButton(
+                    disabled=not self.has_permission(PermType.CHANNELS_CREATE)
+                )
+            )
+            self.add_item(
+                SelectChannelButton(
+                    disabled=not self.has_permission(PermType.CHANNELS_VIEW)
+                )
+            )
         else:
             self.add_item(CancelChannelButton())
 
@@ -325,13 +351,7 @@ class CreateRoleView(me_view.MEView):
         return self.get_context_str(DISCORD_ROLE_NAME, None)
 
     def get_new_channel_name(self):
-        name = self.get_context_str(NEW_CHANNEL_NAME, "")
-        if name is not None:
-            name = name.replace(" ", "-").lower()
-            name = re.sub(r"[^a-zA-Z0-9_\-]", "", name)
-        if name == "":
-            return None
-        return name
+        return me_util.normalize_channel_name(self.get_context_str(NEW_CHANNEL_NAME, ""))
 
     def get_edit_emoji_color(self):
         if not self.is_emoji_format_ok() or self.get_emoji() == EMOJI_DEFAULT:
@@ -370,7 +390,9 @@ class CreateRoleView(me_view.MEView):
 
     def get_message(self, interaction: discord.Interaction or None = None, **kwargs):
         role_name = self.get_current_role_name()
-        if role_name is not None:
+        if not self.has_permission(PermType.ROLES_CREATE):
+            msg = "Add a role to the menu"
+        elif role_name is not None:
             msg = self.get_message_overview()
         elif self.previous_context.get(EXISTING_DISCORD_ROLE, False):
             if self.get_role_df().empty:
@@ -426,11 +448,12 @@ class CreateRoleView(me_view.MEView):
         df = self.get_client().get_role_df(
             self.previous_interaction.guild_id, self.previous_interaction.user
         )
+        filters = []
         if require_manage:
-            df = df[df["can_manage"]]
+            filters.append(BoolFilter("can_manage", default_index=True))
         if require_missing_me_role:
-            df = df[df["me_role_id"].isna()]
-        return df
+            filters.append(IsNullFilter("me_role_id", default_index=True))
+        return FilterManager(filters=filters).filter(df)
 
     def get_existing_channel_id(self):
         channel = self.previous_context.get(SELECT_CHANNEL)
@@ -1,3 +1,4 @@
+import asyncio
 import re
 import sqlite3
 
@@ -6,10 +7,14 @@ import discord
 from me.const.emoji import CRITICAL, CHECK
 from me.discord_bot.me_views.me_view import MEView
 from me.discord_bot.me_views.nav_ui import NavModal, ModalButton
+from me.discord_bot.role_layout import HIDDEN_CATEGORY
 from me.me_util import validate_emoji
+from me.permission_types import PermType
 
 
 class RoleCategoryAddModal(NavModal):
+    permission = PermType.ROLES_CREATE
+
     def __init__(self, title="Add Role Category", **kwargs):
         super().__init__(title=title,**kwargs)
         category_name = discord.ui.TextInput(
@@ -42,25 +47,47 @@ class RoleCategoryAddView(MEView):
     def __init__(self, **kwargs):
         super().__init__(timeout=2 * 60, **kwargs)
         self.bonus_msg = ""
+        # Written by display, which can wait for the guild's lock
+        self.new_category = ""
+        if not self.has_permission(PermType.ROLES_CREATE):
+            self.bonus_msg += f"{CRITICAL}  You don't have permission to add categories\n"
+            return
         try:
-            category = self.get_category()
-            if category != "":
+            self.new_category = self.get_category()
+            self.get_emoji()
+        except ValueError as e:
+            self.bonus_msg += f"{CRITICAL}  {e}\n"
+            self.new_category = ""
+
+        if self.new_category == "":
+            self.add_item(RoleCategoryAddButton())
+
+    async def display(self, *args, **kwargs):
+        if self.new_category != "":
+            client = self.get_client()
+            async with client.guild_ops.lock(self.previous_interaction.guild_id):
+                # The index answers the common case, the table's primary key still catches a concurrent insert
+                created = not await client.guild_cache.category_name_exists(
+                    self.previous_interaction.guild,
+                    self.new_category,
+                    client.db.get_server_role_category_names,
+                )
+                if created:
+                    try:
+                        await asyncio.to_thread(self.add_category)
+                    except sqlite3.IntegrityError:
+                        created = False
+            if created:
                 emoji = self.get_emoji()
                 if emoji != "":
                     emoji += " "
-                self.add_category()
-                self.bonus_msg += f"{CHECK}  Created Category: {emoji}{category}\n"
+                self.bonus_msg += f"{CHECK}  Created Category: {emoji}{self.new_category}\n"
                 self.timeout = 10
-        except sqlite3.IntegrityError as e:
-            self.bonus_msg += f"{CRITICAL}  Category name already exists\n"
-            category = ""
-        except ValueError as e:
-            self.bonus_msg += f"{CRITICAL}  {e}\n"
-            category = ""
-
-        if category == "":
-            add_button = RoleCategoryAddButton()
-            self.add_item(add_button)
+            else:
+                self.bonus_msg += f"{CRITICAL}  Category name already exists\n"
+                self.add_item(RoleCategoryAddButton())
+            self.new_category = ""
+        return await super().display(*args, **kwargs)
 
     def add_category(self):
         category = self.get_category()
@@ -69,9 +96,8 @@ class RoleCategoryAddView(MEView):
             emoji = None
         else:
             emoji = emoji[1:-1]
-        self.get_client().db.add_role_category(
-            self.previous_interaction.guild_id, category, emoji
-        )
+        guild_id = self.previous_interaction.guild_id
+        self.get_client().db.add_role_category(guild_id, category, emoji=emoji)
 
     def get_message(self, interaction=None, **kwargs):
         msg = ":desktop:  **Add Role Category**\n" + self.bonus_msg
@@ -80,8 +106,8 @@ class RoleCategoryAddView(MEView):
     def get_category(self):
         cat = self.previous_context.get("Category Name", "")
         cat = re.sub(r"[^a-zA-Z0-9_\- ]", "", cat)
-        if cat == "hidden":
-            raise ValueError("Category name cannot be hidden")
+        if cat == HIDDEN_CATEGORY:
+            raise ValueError(f"Category name cannot be {HIDDEN_CATEGORY}")
         return cat
 
     def get_emoji(self):
@@ -1,4 +1,13 @@
+from __future__ import annotations
+
+import asyncio
 import dataclasses
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict
 
 from pathlib import Path
 
@@ -9,56 +18,203 @@ from me import me_util
 _IGNORE_ON_LOAD_CONFIG_KEYS = ["example_old_config_key", "path"]
 _IGNORE_ON_SAVE_CONFIG_KEYS = ["path"]
 
-
-@dataclasses.dataclass
-class ServerManager:
-    pass
+_logger = logging.getLogger(__name__)
 
 
 @dataclasses.dataclass
 class ServerConfig:
-    path = None
-
-    def save(self, path: Path = None):
+    server_id: str
+    values: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    path: Path | None = None
+    # Modification time (ns) of the file when it was loaded or saved, None if it didn't exist
+    mtime: int | None = dataclasses.field(default=None, compare=False)
+    # Counts set() calls, values differ from the file until saved_revision catches up
+    revision: int = dataclasses.field(default=0, compare=False)
+    saved_revision: int = dataclasses.field(default=0, compare=False)
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key: str, value):
+        self.values[key] = value
+        self.revision += 1
+
+    def is_dirty(self) -> bool:
+        return self.revision != self.saved_revision
+
+    # Written to a temporary file first, readers only ever see the old or the new config. revision is the one the
+    # values were copied at, the current one when None
+    def save(
+        self,
+        path: Path = None,
+        values: Dict[str, Any] | None = None,
+        revision: int | None = None,
+    ):
         if path is None:
             if self.path is None:
                 raise ValueError(
                     "path cannot be null in both the 'save' function and 'ServerConfig' instance"
                 )
             path = self.path
-        conf_dict = self.__dict__.copy()
+        conf_dict = self.values.copy() if values is None else values
         conf_dict = {
             k: v for k, v in conf_dict.items() if k not in _IGNORE_ON_SAVE_CONFIG_KEYS
         }
         path.parent.mkdir(exist_ok=True, parents=True)
-        with path.open("w") as f:
-            yaml.dump(conf_dict, f)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml.dump(conf_dict, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        if path == self.path:
+            self.mtime = get_mtime(path)
+            self.saved_revision = self.revision if revision is None else revision
         return conf_dict
 
+    # The values are copied on the event loop, changes made while the thread writes wait for the next save
+    async def save_async(self, path: Path = None):
+        return await asyncio.to_thread(
+            self.save, path, self.values.copy(), self.revision
+        )
+
 
 def load_config(path: Path):
-    with open(path, "r") as f:
-        conf = yaml.safe_load(f)
+    try:
+        with open(path, "r") as f:
+            conf = yaml.safe_load(f)
+    except FileNotFoundError:
+        return {}
+    if conf is None:
+        return {}
     return {k: v for k, v in conf.items() if k not in _IGNORE_ON_LOAD_CONFIG_KEYS}
 
 
-def get_folder_path():
-    return me_util.get_data_folder() / "server_id"
+def get_mtime(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
 
+def get_folder_path(server_id: str | int) -> Path:
+    return me_util.get_data_folder() / str(server_id)
 
-def get_config_path():
-    folder_path = get_folder_path()
-    folder_path.mkdir(parents=True, exist_ok=True)
-    return folder_path / "server_config.yaml"
 
+def get_config_path(server_id: str | int) -> Path:
+    return get_folder_path(server_id) / "server_config.yaml"
 
-def get_config() -> ServerConfig:
-    config_path = get_config_path()
+
+# Reads the file, get_config serves it from memory instead
+def read_config(server_id: str | int) -> ServerConfig:
+    config_path = get_config_path(server_id)
+    mtime = get_mtime(config_path)
     conf_dict = load_config(config_path)
-    conf_dict["path"] = config_path
-    return ServerConfig(**conf_dict)
+    return ServerConfig(str(server_id), conf_dict, path=config_path, mtime=mtime)
+
+
+def get_config(server_id: str | int) -> ServerConfig:
+    return get_server_manager().get_config(server_id)
 
 
 @dataclasses.dataclass
 class DiscordServer:
     server_id: str
+    config: ServerConfig | None = None
+    # When the config file was last checked for changes, on the time.monotonic clock
+    checked_at: float = 0.0
+    lock: asyncio.Lock = dataclasses.field(
+        default_factory=asyncio.Lock, repr=False, compare=False
+    )
+
+    # Unsaved values or a running save would be lost by dropping or reloading the config
+    def is_pinned(self) -> bool:
+        return self.lock.locked() or (self.config is not None and self.config.is_dirty())
+
+
+@dataclasses.dataclass
+class ServerManager:
+    """
+    In-memory registry of DiscordServers, at most max_servers of them with the least recently used dropped first.
+
+    A server's config is loaded on first use and only read again when its file's modification time changes, which is
+    checked at most every check_interval seconds. Saves are atomic and run off the event loop. Servers with unsaved
+    values or a save in progress are neither reloaded nor dropped, so max_servers can be exceeded while they are.
+    """
+
+    max_servers: int = 1000
+    check_interval: float = 5.0
+    _servers: OrderedDict[str, DiscordServer] = dataclasses.field(
+        default_factory=OrderedDict, repr=False
+    )
+
+    def __len__(self):
+        return len(self._servers)
+
+    def __contains__(self, server_id: str | int):
+        return str(server_id) in self._servers
+
+    def get_server(self, server_id: str | int) -> DiscordServer:
+        server_id = str(server_id)
+        server = self._servers.get(server_id)
+        if server is None:
+            server = DiscordServer(server_id)
+            self._servers[server_id] = server
+            self.evict()
+        else:
+            self._servers.move_to_end(server_id)
+        return server
+
+    def evict(self):
+        excess = len(self._servers) - self.max_servers
+        if excess <= 0:
+            return
+        evictable = [k for k, server in self._servers.items() if not server.is_pinned()]
+        for server_id in evictable[:excess]:
+            del self._servers[server_id]
+
+    def get_config(self, server_id: str | int) -> ServerConfig:
+        server = self.get_server(server_id)
+        now = time.monotonic()
+        if server.config is None:
+            server.config = read_config(server.server_id)
+            server.checked_at = now
+        elif now - server.checked_at >= self.check_interval and not server.is_pinned():
+            server.checked_at = now
+            if get_mtime(server.config.path) != server.config.mtime:
+                _logger.info(f"Config for server {server.server_id} changed on disk, reloading")
+                server.config = read_config(server.server_id)
+        return server.config
+
+    def get_setting(self, server_id: str | int, key: str, default=None):
+        return self.get_config(server_id).get(key, default)
+
+    async def save(self, server_id: str | int):
+        server = self.get_server(server_id)
+        if server.config is None:
+            return
+        # Saves of one server run one at a time, so an older snapshot never replaces a newer one
+        async with server.lock:
+            await server.config.save_async()
+
+    async def set_setting(self, server_id: str | int, key: str, value):
+        self.get_config(server_id).set(key, value)
+        await self.save(server_id)
+
+    def forget(self, server_id: str | int):
+        self._servers.pop(str(server_id), None)
+
+
+_server_manager: ServerManager | None = None
+
+
+# The process wide registry, get_config and the discord client share it
+def get_server_manager() -> ServerManager:
+    global _server_manager
+    if _server_manager is None:
+        _server_manager = ServerManager()
+    return _server_manager
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+_logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def get_size(value) -> int:
+    # DataFrames and Series report their buffers, everything else falls back to the shallow object size
+    memory_usage = getattr(value, "memory_usage", None)
+    if memory_usage is not None:
+        usage = memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by both an entry count and a total size in bytes.
+
+    Entries larger than max_bytes are returned to the caller but never stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 32 * 1024 * 1024,
+        sizeof: Callable[[Any], int] = get_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            _logger.debug(f"Not caching {key}, {size} bytes is over the cache limit")
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def pop(self, key: Hashable, default=None):
+        entry = self._entries.pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        self._bytes -= entry[1]
+        return entry[0]
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_bytes(self) -> int:
+        return self._bytes
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one, every caller awaits the first caller's result.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable):
+        return key in self._in_flight
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable]):
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(load())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # Shielded so a cancelled caller doesn't cancel the load for everyone else waiting on it
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            future.exception()  # Marks the exception retrieved when every caller was cancelled
+
+
+class TTLCache:
+    """
+    Cache whose entries expire ttl seconds after they are stored, with the oldest entries dropped past max_entries.
+
+    get_or_load runs concurrent loads of the same key only once.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60,
+        max_entries: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._flights = SingleFlight()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= self.clock():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value, ttl: float | None = None):
+        if ttl is None:
+            ttl = self.ttl
+        self._entries[key] = (value, self.clock() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable]):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        async def load_and_put():
+            loaded = await load()
+            self.put(key, loaded)
+            return loaded
+
+        return await self._flights.do(key, load_and_put)
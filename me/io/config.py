@@ -15,6 +15,48 @@ class Config:
     me_run_guilds: str = ""
     discord_api_endpoint: str = "https://discord.com/api/v10"
 
+    # combined runs the discord client inside the API process, api leaves it to a separate "python -m me bot" process
+    run_mode: str = "combined"
+    ipc_poll_interval: float = 1.0
+
+    # Connection pool and timeout (seconds) for the API's requests to discord
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 0
+    http_timeout: float = 10.0
+    # Attempts per request and the backoff between them (seconds), 429s wait for Retry-After instead
+    http_max_attempts: int = 4
+    http_backoff_base: float = 0.5
+    http_backoff_max: float = 30.0
+    # Consecutive discord failures before requests are refused, and for how long (seconds)
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30.0
+
+    # memory keeps sessions in the worker, sqlite shares them between workers and restarts
+    session_backend: str = "memory"
+    session_ttl: float = 7 * 24 * 60 * 60
+    session_max: int = 10000
+    session_sweep_interval: float = 10 * 60
+
+    # How long (seconds) a session's discord user and guilds are answered from memory
+    identity_cache_ttl: float = 60
+    identity_cache_max: int = 10000
+    # How long (seconds) a guild's roles, categories and message groups are served from memory
+    guild_data_cache_ttl: float = 30
+
+    # OAuth tokens with less than token_refresh_margin seconds left are refreshed before use, ones with less than
+    # token_refresh_ahead left are refreshed in the background
+    token_refresh_margin: float = 60
+    token_refresh_ahead: float = 24 * 60 * 60
+    token_refresh_interval: float = 5 * 60
+
+    # Every reconcile_interval seconds the bot checks up to reconcile_guilds_per_tick guilds' rows for deleted roles and
+    # channels, stopping early once the checks took reconcile_cpu_budget seconds
+    reconcile_interval: float = 30
+    reconcile_guilds_per_tick: int = 50
+    reconcile_cpu_budget: float = 0.005
+    # Also drop the message rows of servers missing from the bot's guilds on every pass, instead of only on removal
+    reconcile_delete_left_servers: bool = False
+
 
 def get_config(use_env_vars=True, **kwargs) -> Config:
     conf_vars = {}
@@ -39,6 +81,13 @@ def get_config_env_vars():
     return env_vars
 
 
+# Environment variables come in as strings
+def is_enabled(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
 def get_env_var(var_name):
     for me_name in [f"me_{var_name}", var_name]:
         for case_name in [me_name.upper(), me_name.lower()]:
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import dataclasses
-from typing import Any, List
+import re
+from typing import Any, Callable, Collection, Hashable, List, Mapping, Tuple, TYPE_CHECKING
 
+import numpy as np
 from pandas import DataFrame
 import pandas as pd
 
+if TYPE_CHECKING:
+    from me.io.cache import LRUCache
+
 OPTION_DISABLED = "disabled_option"
+_SQL_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
 
 
 @dataclasses.dataclass
@@ -33,15 +39,32 @@ class DataFilter:
     options: List[FilterOption] = dataclasses.field(default_factory=list)
     col_name: str | None = None
     label: str | None = None
+    sql_col_name: str | None = None
     selected_index = 0
     default_index = 0
 
     def get_mask(self, df) -> pd.Series or bool:
         return df is not None  # Should return True - override for a boolean mask
 
-    async def filter(self, df: DataFrame):
-        mask = await self.get_mask(df)
-        return df[mask]
+    # Returns a parameterized WHERE fragment and its params, or None when the filter can only run on a DataFrame
+    def get_sql(self) -> Tuple[str, Tuple] | None:
+        return None
+
+    # The column the SQL fragment is written against, a query can only take the filter if it has this column
+    def get_sql_column_name(self) -> str | None:
+        return self.sql_col_name if self.sql_col_name is not None else self.col_name
+
+    def get_sql_column(self) -> str:
+        col = self.get_sql_column_name()
+        if col is None or _SQL_IDENTIFIER.fullmatch(col) is None:
+            raise ValueError(f"Column {col} can't be used in SQL")
+        return col
+
+    def filter(self, df: DataFrame):
+        return CompiledFilter([self]).filter(df)
+
+    async def afilter(self, df: DataFrame):
+        return self.filter(df)
 
     def get_column(self, df) -> pd.Series:
         self.validate_col(df)
@@ -66,6 +89,19 @@ class DataFilter:
     def get_options(self):
         return self.options
 
+    def select(self, index: int):
+        self.selected_index = index
+
+    # Anything that changes which rows get_mask keeps must be part of the state, compiled plans are cached on it
+    def get_state(self):
+        return self.selected_index
+
+    def is_active(self):
+        return (
+            len(self.get_options()) > 0
+            and self.get_selected_option().value != OPTION_DISABLED
+        )
+
 
 @dataclasses.dataclass
 class InverseFilter(DataFilter):
@@ -103,11 +139,11 @@ class InverseFilter(DataFilter):
                 options.append(DisabledOption(label=disabled_label))
         super().__init__(
             label=label,
-            default_index=default_index,
-            selected_index=selected_index,
             options=options,
             **kwargs,
         )
+        self.default_index = default_index
+        self.selected_index = selected_index
 
     def get_mask(self, df: DataFrame):
         val = self.get_selected_option().value
@@ -120,22 +156,296 @@ class InverseFilter(DataFilter):
     def get_truth_mask(self, df: DataFrame):
         raise NotImplementedError("truth mask should be overridden")
 
+    def get_sql(self) -> Tuple[str, Tuple] | None:
+        truth_sql = self.get_truth_sql()
+        val = self.get_selected_option().value
+        if truth_sql is None or val == OPTION_DISABLED:
+            return None
+        elif val:
+            return truth_sql
+        sql, params = truth_sql
+        return f"NOT ({sql})", params
 
-@dataclasses.dataclass
+    def get_truth_sql(self) -> Tuple[str, Tuple] | None:
+        return None
+
+
+@dataclasses.dataclass(init=False)
 class IsNullFilter(InverseFilter):
-    col_name: str
-    false_label: str = "Not Null"
-    true_label: str = "Is Null"
-    disabled_label: str = "Any"
-    label = "Null Filter"
+    def __init__(
+        self,
+        col_name: str,
+        label="Null Filter",
+        false_label: str = "Not Null",
+        true_label: str = "Is Null",
+        disabled_label: str = "Any",
+        **kwargs,
+    ):
+        super().__init__(
+            col_name=col_name,
+            label=label,
+            false_label=false_label,
+            true_label=true_label,
+            disabled_label=disabled_label,
+            **kwargs,
+        )
 
     def get_truth_mask(self, df: DataFrame):
         return self.get_column(df).isnull()
 
+    def get_truth_sql(self):
+        return f"{self.get_sql_column()} IS NULL", ()
+
+
+@dataclasses.dataclass(init=False)
+class BoolFilter(InverseFilter):
+    def __init__(
+        self,
+        col_name: str,
+        label=None,
+        false_label: str = "No",
+        true_label: str = "Yes",
+        disabled_label: str = "Any",
+        default_index: bool | int | None = None,
+        **kwargs,
+    ):
+        super().__init__(
+            col_name=col_name,
+            label=label,
+            false_label=false_label,
+            true_label=true_label,
+            disabled_label=disabled_label,
+            default_index=default_index,
+            **kwargs,
+        )
+
+    def get_truth_mask(self, df: DataFrame):
+        return get_values_mask(
+            self.get_column(df), lambda values: values.fillna(False).astype(bool)
+        )
+
+    def get_truth_sql(self):
+        return f"COALESCE({self.get_sql_column()}, 0) != 0", ()
+
+
+@dataclasses.dataclass(init=False)
+class ChoiceFilter(DataFilter):
+    """
+    Base for filters whose first option disables them and whose other options each hold a value to filter by.
+    """
+
+    def __init__(
+        self,
+        col_name: str,
+        choices: Collection,
+        label=None,
+        disabled_label: str = "Any",
+        selected_index: int = 0,
+        **kwargs,
+    ):
+        options = [DisabledOption(label=disabled_label)]
+        for choice in choices:
+            if not isinstance(choice, FilterOption):
+                choice = self.get_choice_option(choice)
+            options.append(choice)
+        super().__init__(options=options, col_name=col_name, label=label, **kwargs)
+        self.selected_index = selected_index
+
+    def get_choice_option(self, choice) -> FilterOption:
+        return FilterOption(value=choice, label=str(choice))
+
+    def get_selected_value(self):
+        return self.get_selected_option().value
+
+    # Two filters on the same column can hold different choices at the same index
+    def get_state(self):
+        return self.selected_index, self.get_selected_value()
+
+
+@dataclasses.dataclass(init=False)
+class IsInFilter(ChoiceFilter):
+    """
+    Keeps rows whose column is in the selected set. choices is either a collection of single values or a mapping
+    of option labels to collections of values.
+    """
+
+    def __init__(self, col_name: str, choices: Collection | Mapping, **kwargs):
+        if isinstance(choices, Mapping):
+            choices = [
+                FilterOption(value=frozenset(values), label=label)
+                for label, values in choices.items()
+            ]
+        super().__init__(col_name=col_name, choices=choices, **kwargs)
+
+    def get_choice_option(self, choice) -> FilterOption:
+        return FilterOption(value=frozenset([choice]), label=str(choice))
+
+    def get_mask(self, df: DataFrame):
+        values = self.get_selected_value()
+        return get_values_mask(self.get_column(df), lambda col: col.isin(values))
+
+    def get_sql(self):
+        values = tuple(self.get_selected_value())
+        if len(values) == 0:
+            return "0", ()
+        return f"{self.get_sql_column()} IN ({', '.join('?' * len(values))})", values
+
+
+@dataclasses.dataclass(init=False)
+class NameFilter(ChoiceFilter):
+    """
+    Keeps rows whose column contains the selected text, or matches it as a regular expression when regex is set.
+    """
+
+    def __init__(
+        self, col_name: str, choices: Collection[str], case=False, regex=False, **kwargs
+    ):
+        super().__init__(col_name=col_name, choices=choices, **kwargs)
+        self.case = case
+        self.regex = regex
+
+    def get_mask(self, df: DataFrame):
+        pattern = self.get_selected_value()
+        return get_values_mask(
+            self.get_column(df),
+            lambda col: col.astype(str).str.contains(
+                pattern, case=self.case, regex=self.regex, na=False
+            ),
+        )
+
+    # SQLite LIKE is case-insensitive for ASCII only, so only case-insensitive substring searches are pushed down
+    def get_sql(self):
+        if self.regex or self.case:
+            return None
+        pattern = self.get_selected_value()
+        pattern = re.sub(r"([\\%_])", r"\\\1", pattern)
+        return f"{self.get_sql_column()} LIKE ? ESCAPE '\\'", (f"%{pattern}%",)
+
+    def get_state(self):
+        return super().get_state(), self.case, self.regex
+
+
+@dataclasses.dataclass(init=False)
+class RangeFilter(ChoiceFilter):
+    """
+    Keeps rows whose numeric column is within the selected inclusive (low, high) range, None leaves a side open.
+    Missing values are never in range.
+    """
+
+    def get_choice_option(self, choice) -> FilterOption:
+        low, high = choice
+        if low is None:
+            label = f"<= {high}"
+        elif high is None:
+            label = f"{low}+"
+        else:
+            label = f"{low}-{high}"
+        return FilterOption(value=(low, high), label=label)
+
+    def get_mask(self, df: DataFrame):
+        low, high = self.get_selected_value()
+
+        def in_range(col: pd.Series):
+            mask = col.notna()
+            if low is not None:
+                mask &= col >= low
+            if high is not None:
+                mask &= col <= high
+            return mask
+
+        return get_values_mask(self.get_column(df), in_range)
+
+    def get_sql(self):
+        low, high = self.get_selected_value()
+        col = self.get_sql_column()
+        clauses = [f"{col} IS NOT NULL"]
+        params = ()
+        if low is not None:
+            clauses.append(f"{col} >= ?")
+            params += (low,)
+        if high is not None:
+            clauses.append(f"{col} <= ?")
+            params += (high,)
+        return " AND ".join(clauses), params
+
+
+def get_values_mask(
+    column: pd.Series, values_mask: Callable[[pd.Series], pd.Series]
+) -> np.ndarray:
+    """
+    Applies values_mask to the column. Categorical columns are evaluated once per category and expanded through the
+    category codes, so the cost follows the number of distinct values rather than the number of rows.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = pd.Series(column.cat.categories)
+        category_mask = np.asarray(values_mask(categories), dtype=bool)
+        # Missing values have code -1, which picks the appended False
+        return np.append(category_mask, False)[column.cat.codes.to_numpy()]
+    return np.asarray(values_mask(column), dtype=bool)
+
+
+class CompiledFilter:
+    """
+    The active filters of a FilterManager merged into one pass: masks are and-ed into a single boolean array and
+    the DataFrame is indexed once, instead of copying it after every filter.
+    """
+
+    def __init__(self, filters: List[DataFilter]):
+        self.filters = [f for f in filters if f.is_active()]
+
+    def get_mask(self, df: DataFrame) -> np.ndarray | None:
+        combined = None
+        for f in self.filters:
+            mask = f.get_mask(df)
+            if isinstance(mask, (bool, np.bool_)):
+                if mask:
+                    continue
+                return np.zeros(len(df), dtype=bool)
+            if isinstance(mask, pd.Series):
+                mask = mask.fillna(False)
+            mask = np.asarray(mask, dtype=bool)
+            if combined is None:
+                combined = mask.copy()
+            else:
+                combined &= mask
+        return combined
+
+    def filter(self, df: DataFrame) -> DataFrame:
+        mask = self.get_mask(df)
+        if mask is None:
+            return df
+        return df[mask]
+
+    def split_sql(
+        self, columns: Collection[str]
+    ) -> Tuple[str | None, Tuple, CompiledFilter]:
+        """
+        Splits the filters into a WHERE clause for the ones on the given SQL columns and a CompiledFilter for the
+        rest, which still has to run on the returned DataFrame (computed or merged columns).
+        """
+        clauses = []
+        params = ()
+        remaining = []
+        for f in self.filters:
+            sql = f.get_sql() if f.get_sql_column_name() in columns else None
+            if sql is None:
+                remaining.append(f)
+            else:
+                clauses.append(f"({sql[0]})")
+                params += tuple(sql[1])
+        where = " AND ".join(clauses) if len(clauses) > 0 else None
+        return where, params, CompiledFilter(remaining)
+
 
 @dataclasses.dataclass
 class FilterManager:
     filters: List[DataFilter] = dataclasses.field(default_factory=list)
+    _plan: CompiledFilter | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _plan_state: Tuple | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def get_filter_dict(self):
         filter_dict = {}
@@ -145,11 +455,33 @@ class FilterManager:
             filter_dict[f.get_label()].append(f)
         return filter_dict
 
-    def filter(self, df: DataFrame):
-        for f in self.filters:
-            if (
-                len(f.get_options()) > 0
-                and f.get_selected_option().value != OPTION_DISABLED
-            ):
-                df = f.filter(df)
-        return df
+    # Equal filters give equal states, so another view's manager with the same selections shares cached results
+    def get_state(self) -> Tuple:
+        return tuple((type(f).__name__, f.col_name, f.get_state()) for f in self.filters)
+
+    def compile(self) -> CompiledFilter:
+        state = self.get_state()
+        if self._plan is None or state != self._plan_state:
+            self._plan = CompiledFilter(self.filters)
+            self._plan_state = state
+        return self._plan
+
+    def filter(self, df: DataFrame) -> DataFrame:
+        return self.compile().filter(df)
+
+    async def afilter(self, df: DataFrame) -> DataFrame:
+        return self.filter(df)
+
+    def filter_cached(
+        self,
+        cache: LRUCache,
+        source_key: Hashable,
+        version: Hashable,
+        load_df: Callable[[], DataFrame],
+    ) -> DataFrame:
+        """
+        Returns the filtered frame for (source_key, version, filter state) from the cache, only loading and filtering
+        the source when the filters or the source version changed. The returned frame is shared, don't modify it.
+        """
+        key = (source_key, version, self.get_state())
+        return cache.get_or_compute(key, lambda: self.filter(load_df()))
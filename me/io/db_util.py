@@ -3,31 +3,77 @@ from __future__ import annotations
 import sqlite3
 from contextlib import closing
 from sqlite3 import Connection, Cursor
-from typing import Mapping, Collection, List
-
-import pandas as pd
+from typing import Callable, Mapping, Collection, List, Dict, Set, Tuple, TYPE_CHECKING
 
 from me.permission_types import PermType
 from me.message_types import MessageType
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from me.io.data_filter import FilterManager
+
 SELECT_MESSAGES_AND_GROUPS = "SELECT m.message_id, g.channel_id, g.first_message_id, g.server_id, g.type_id, g.user_id FROM messages m JOIN message_groups g ON m.first_message_id = g.first_message_id AND m.channel_id = g.channel_id"
 PRAGMA = "PRAGMA foreign_keys = 1"
+CREATE_MESSAGES_TABLE_SQL = "CREATE TABLE IF NOT EXISTS messages(message_id INTEGER NOT NULL, first_message_id INTEGER, channel_id INTEGER, FOREIGN KEY(first_message_id, channel_id) REFERENCES message_groups(first_message_id, channel_id), PRIMARY KEY(message_id, channel_id))"
 
 
 class SQLiteDB:
     def __init__(self, db_path="data/me.db"):
         self.db_path = db_path
+        self._column_cache: Dict[str, Tuple[str, ...]] = {}
+        # Called with the server id after each write to its roles or role_categories rows
+        self.role_listeners: List[Callable[[int], None]] = []
 
     def read_sql(
-        self, sql: str, params: Collection[str] or Mapping[str, str] = (), debug=False
+        self,
+        sql: str,
+        params: Collection[str] or Mapping[str, str] = (),
+        debug=False,
+        filters: FilterManager | None = None,
     ) -> pd.DataFrame:
+        # pandas is imported on first use, processes that never read a frame (the CLI, api-mode sessions) skip it
+        import pandas as pd
+
+        remaining = None
+        if filters is not None:
+            sql, params, remaining = self.push_down_filters(sql, params, filters)
         if debug:
             print(f"Executing SQL: {sql}".replace("?", "{}").format(*params))
         with self.connect() as conn:
             df = pd.read_sql(sql, conn, params=params)
             if debug:
                 print(df)
-            return df
+        if remaining is not None:
+            df = remaining.filter(df)
+        return df
+
+    def push_down_filters(
+        self, sql: str, params: Collection[str], filters: FilterManager
+    ):
+        """
+        Wraps the query so the filters that can be written in SQL run inside SQLite, SQLite flattens the subquery
+        so indexes on the inner tables still apply. Returns the new query, its params and the CompiledFilter for the
+        filters that still need to run on the DataFrame.
+        """
+        if isinstance(params, Mapping):
+            raise ValueError("Filters can only be pushed down into queries with positional params")
+        where, where_params, remaining = filters.compile().split_sql(
+            self.get_columns(sql, params)
+        )
+        if where is not None:
+            sql = f"SELECT * FROM ({sql}) WHERE {where}"
+            params = tuple(params) + where_params
+        return sql, params, remaining
+
+    def get_columns(self, sql: str, params: Collection[str] = ()) -> Tuple[str, ...]:
+        columns = self._column_cache.get(sql)
+        if columns is None:
+            with closing(self.connect()) as conn:
+                cursor = conn.execute(f"SELECT * FROM ({sql}) LIMIT 0", tuple(params))
+                columns = tuple(d[0] for d in cursor.description)
+            self._column_cache[sql] = columns
+        return columns
 
     def execute(
         self,
@@ -116,6 +162,31 @@ class SQLiteDB:
                     ],
                 )
 
+    # Messages sent or deleted when an existing group is updated to a different number of messages
+    def add_group_messages(self, first_message_id: int, channel_id: int, message_ids: List[int]):
+        with closing(self.connect()) as conn, conn:
+            conn.execute(PRAGMA)
+            conn.executemany(
+                "INSERT INTO messages (message_id, first_message_id, channel_id) VALUES (?, ?, ?)",
+                [(int(message_id), int(first_message_id), int(channel_id)) for message_id in message_ids],
+            )
+
+    # The group a message belongs to is keyed on its first message, which may have been deleted since
+    def get_first_message_id(self, channel_id: int, message_id: int) -> int | None:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT first_message_id FROM messages WHERE message_id = ? AND channel_id = ?",
+                (int(message_id), int(channel_id)),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def delete_group_messages(self, channel_id: int, message_ids: List[int]):
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(
+                "DELETE FROM messages WHERE message_id = ? AND channel_id = ?",
+                [(int(message_id), int(channel_id)) for message_id in message_ids],
+            )
+
     def delete_messages(self, first_message_id: int):
         first_message_id = int(first_message_id)
         with self.connect() as conn:
@@ -130,79 +201,210 @@ class SQLiteDB:
                     (first_message_id,),
                 )
 
-    def get_messages_of_type_df(self, message_type: MessageType):
+    def get_messages_of_type_df(
+        self, message_type: MessageType, filters: FilterManager | None = None
+    ):
         sql = f"{SELECT_MESSAGES_AND_GROUPS} WHERE g.type_id = ?"
-        return self.read_sql(sql, params=(message_type.value,))
+        return self.read_sql(sql, params=(message_type.value,), filters=filters)
 
     def get_messages_of_type_and_user_df(
-        self, message_type: MessageType, user_id: int, server_id: int
+        self,
+        message_type: MessageType,
+        user_id: int,
+        server_id: int,
+        filters: FilterManager | None = None,
     ):
         sql = f"{SELECT_MESSAGES_AND_GROUPS} WHERE g.type_id = ? AND g.user_id = ? AND g.server_id = ?"
-        return self.read_sql(sql, params=(message_type, user_id, server_id))
+        return self.read_sql(
+            sql, params=(message_type, user_id, server_id), filters=filters
+        )
 
     def setup(self):
         create_servers_table_sql = (
             "CREATE TABLE IF NOT EXISTS servers(server_id INTEGER NOT NULL PRIMARY KEY)"
         )
         create_permission_types_table_sql = "CREATE TABLE IF NOT EXISTS permission_types(permission_id INTEGER NOT NULL PRIMARY KEY, permission_name TEXT)"
+        # user_id or role_id is 0 for a role's or a user's row, a NULL in the primary key wouldn't be unique
+        create_permissions_table_sql = "CREATE TABLE IF NOT EXISTS permissions(server_id INTEGER NOT NULL, user_id INTEGER NOT NULL DEFAULT 0, role_id INTEGER NOT NULL DEFAULT 0, permission_bits INTEGER NOT NULL DEFAULT 0, FOREIGN KEY(server_id) REFERENCES servers(server_id), PRIMARY KEY(server_id, user_id, role_id))"
         create_user_table_sql = "CREATE TABLE IF NOT EXISTS users(user_id INTEGER NOT NULL PRIMARY KEY , active_server INTEGER)"
         create_server_settings_table_sql = "CREATE TABLE IF NOT EXISTS server_settings(server_id INTEGER NOT NULL, setting TEXT NOT NULL, setting_value TEXT, FOREIGN KEY(server_id) REFERENCES servers(server_id), PRIMARY KEY(server_id, setting))"
         create_user_settings_table_sql = "CREATE TABLE IF NOT EXISTS user_settings(server_id INTEGER NOT NULL, user_id INTEGER NOT NULL, setting TEXT NOT NULL, setting_value TEXT, FOREIGN KEY(server_id) REFERENCES servers(server_id), FOREIGN KEY(user_id) REFERENCES users(user_id), PRIMARY KEY(server_id, user_id, setting))"
         create_message_types_table_sql = "CREATE TABLE IF NOT EXISTS message_types(type_id INTEGER NOT NULL PRIMARY KEY, type_name TEXT)"
         create_message_groups_table_sql = "CREATE TABLE IF NOT EXISTS message_groups(first_message_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, server_id INTEGER NOT NULL,type_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY(first_message_id, channel_id), FOREIGN KEY(server_id) REFERENCES servers, FOREIGN KEY(type_id) REFERENCES message_types)"
-        create_messags_table_sql = "CREATE TABLE IF NOT EXISTS messages(message_id INTEGER NOT NULL, first_message_id INTEGER, channel_id INTEGER, FOREIGN KEY(first_message_id, channel_id) REFERENCES message_groups(first_message_id, channel_id), PRIMARY KEY(first_message_id, channel_id))"
-        create_roles_table_sql = "CREATE TABLE IF NOT EXISTS roles(role_id INTEGER NOT NULL, server_id INTEGER NOT NULL, me_role_id INTEGER, channel_id INTEGER, emoji TEXT, FOREIGN KEY(server_id) REFERENCES servers, PRIMARY KEY(role_id, server_id))"
+        create_roles_table_sql = "CREATE TABLE IF NOT EXISTS roles(role_id INTEGER NOT NULL, server_id INTEGER NOT NULL, me_role_id INTEGER, channel_id INTEGER, emoji TEXT, category_name TEXT, FOREIGN KEY(server_id) REFERENCES servers, PRIMARY KEY(role_id, server_id))"
+        create_sessions_table_sql = "CREATE TABLE IF NOT EXISTS sessions(session_id TEXT NOT NULL PRIMARY KEY, info_session_id TEXT NOT NULL, token_dict TEXT, expires_at REAL NOT NULL)"
+        create_sessions_expiry_index_sql = "CREATE INDEX IF NOT EXISTS sessions_expires_at_index ON sessions(expires_at)"
+        create_ipc_commands_table_sql = "CREATE TABLE IF NOT EXISTS ipc_commands(command_id INTEGER PRIMARY KEY AUTOINCREMENT, command TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        create_process_status_table_sql = "CREATE TABLE IF NOT EXISTS process_status(name TEXT NOT NULL PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL)"
         create_role_categories_table_sql = "CREATE TABLE IF NOT EXISTS role_categories(server_id integer constraint role_categories_servers_server_id_fk references servers, category_name integer TEXT not null, role_id integer, emoji TEXT, constraint role_categories_pk primary key (server_id, category_name))"
 
         queries = [
             create_permission_types_table_sql,
             create_servers_table_sql,
             create_user_table_sql,
-            # create_permissions_table_sql,
+            create_permissions_table_sql,
             create_server_settings_table_sql,
             create_user_settings_table_sql,
             create_message_types_table_sql,
             create_message_groups_table_sql,
-            create_messags_table_sql,
+            CREATE_MESSAGES_TABLE_SQL,
             create_roles_table_sql,
             create_role_categories_table_sql,
+            create_sessions_table_sql,
+            create_sessions_expiry_index_sql,
+            create_ipc_commands_table_sql,
+            create_process_status_table_sql,
         ]
         for create_table_sql in queries:
             self.execute(create_table_sql)
+        self.migrate()
         self.update_perm_types()
         self.update_message_types()
 
+    # Brings tables created by older versions up to the current schema
+    def migrate(self):
+        with closing(self.connect()) as conn, conn:
+            if "category_name" not in get_table_columns(conn, "roles"):
+                conn.execute("ALTER TABLE roles ADD COLUMN category_name TEXT")
+            # Messages used to be keyed by their group, which only allowed one message per group
+            if "message_id" not in get_primary_key(conn, "messages"):
+                conn.execute("ALTER TABLE messages RENAME TO messages_old")
+                conn.execute(CREATE_MESSAGES_TABLE_SQL)
+                conn.execute(
+                    "INSERT INTO messages (message_id, first_message_id, channel_id) SELECT message_id, first_message_id, channel_id FROM messages_old"
+                )
+                conn.execute("DROP TABLE messages_old")
+
     def connect(self) -> Connection:
         return sqlite3.connect(self.db_path)
 
-    def get_permission(self, server_id: str, user_id: str, permission: str):
-        sql = "SELECT * FROM permissions WHERE server_id = ? AND user_id = ? AND permission_id = ?"
-        df = pd.read_sql(sql, self.connect(), params=(server_id, user_id, permission))
-        df["permission_value"] = df["permission_value"].astype(bool)
-        return df
+    # (user_id, role_id, permission_bits) of every permissions row for the server
+    def get_server_permission_rows(self, server_id) -> List[Tuple[int, int, int]]:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT user_id, role_id, permission_bits FROM permissions WHERE server_id = ?",
+                (int(server_id),),
+            ).fetchall()
 
-    def get_messages_of_type_df_and_server(self, type_id, server_id):
+    def get_messages_of_type_df_and_server(
+        self, type_id, server_id, filters: FilterManager | None = None
+    ):
         server_id = int(server_id)
         sql = f"{SELECT_MESSAGES_AND_GROUPS} WHERE g.type_id = ? AND g.server_id = ?"
-        return self.read_sql(sql, params=(type_id, server_id))
+        return self.read_sql(sql, params=(type_id, server_id), filters=filters)
 
-    def get_messages_of_type_df_and_channel(self, type_id, channel_id):
+    def get_messages_of_type_df_and_channel(
+        self, type_id, channel_id, filters: FilterManager | None = None
+    ):
         channel_id = int(channel_id)
         sql = f"{SELECT_MESSAGES_AND_GROUPS} WHERE g.type_id = ? AND g.channel_id = ?"
-        return self.read_sql(sql, params=(type_id, channel_id))
+        return self.read_sql(sql, params=(type_id, channel_id), filters=filters)
 
-    def get_server_roles_df(self, server_id):
+    def get_server_roles_df(self, server_id, filters: FilterManager | None = None):
         sql = "SELECT * FROM roles WHERE server_id = ?"
-        return self.read_sql(sql, params=(server_id,))
+        return self.read_sql(sql, params=(server_id,), filters=filters)
+
+    # (role_id, emoji, channel_id) of the server's menu roles, for the click path where a DataFrame isn't needed
+    def get_server_role_rows(self, server_id) -> List[Tuple[int, str | None, int | None]]:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT role_id, emoji, channel_id FROM roles WHERE server_id = ? ORDER BY role_id",
+                (int(server_id),),
+            ).fetchall()
+
+    # (role_id, emoji, category rowid or None, category_name, category emoji) of the server's menu roles
+    def get_server_role_layout_rows(
+        self, server_id
+    ) -> List[Tuple[int, str | None, int | None, str | None, str | None]]:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT r.role_id, r.emoji, c.rowid, r.category_name, c.emoji FROM roles r LEFT JOIN role_categories c ON c.server_id = r.server_id AND c.category_name = r.category_name WHERE r.server_id = ?",
+                (int(server_id),),
+            ).fetchall()
+
+    # Server id -> (role ids, channel ids) the server's rows point at, for the servers given
+    def get_tracked_ids(
+        self, server_ids: Collection[int]
+    ) -> Dict[int, Tuple[Set[int], Set[int]]]:
+        server_ids = [int(server_id) for server_id in server_ids]
+        tracked = {server_id: (set(), set()) for server_id in server_ids}
+        if len(server_ids) == 0:
+            return tracked
+        marks = ", ".join("?" * len(server_ids))
+        sql = (
+            f"SELECT server_id, 0, role_id FROM roles WHERE server_id IN ({marks}) "
+            f"UNION SELECT server_id, 0, role_id FROM role_categories WHERE server_id IN ({marks}) AND role_id IS NOT NULL "
+            f"UNION SELECT server_id, 1, channel_id FROM message_groups WHERE server_id IN ({marks}) "
+            f"UNION SELECT server_id, 1, channel_id FROM roles WHERE server_id IN ({marks}) AND channel_id IS NOT NULL"
+        )
+        with closing(self.connect()) as conn:
+            for server_id, is_channel, id_ in conn.execute(sql, server_ids * 4):
+                tracked[server_id][is_channel].add(id_)
+        return tracked
+
+    def get_message_server_ids(self) -> List[int]:
+        with closing(self.connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT server_id FROM message_groups")]
+
+    def is_menu_role(self, server_id, role_id) -> bool:
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM roles WHERE server_id = ? AND role_id = ?",
+                (int(server_id), int(role_id)),
+            ).fetchone()
+        return row is not None
 
-    def get_server_role_categories_df(self, server_id):
+    def get_server_role_categories_df(
+        self, server_id, filters: FilterManager | None = None
+    ):
         sql = "SELECT * FROM role_categories WHERE server_id = ?"
-        return self.read_sql(sql, params=(server_id,))
+        return self.read_sql(sql, params=(server_id,), filters=filters)
+
+    def get_server_message_groups_df(
+        self, server_id, filters: FilterManager | None = None
+    ):
+        sql = "SELECT * FROM message_groups WHERE server_id = ?"
+        return self.read_sql(sql, params=(server_id,), filters=filters)
 
-    def add_role_category(self, server_id, category_name, role_id=None):
-        sql = "INSERT INTO role_categories (server_id, category_name, role_id) VALUES (?, ?, ?)"
-        self.execute(sql, params=(server_id, category_name, role_id))
+    def add_role_category(self, server_id, category_name, role_id=None, emoji=None):
+        sql = "INSERT INTO role_categories (server_id, category_name, role_id, emoji) VALUES (?, ?, ?, ?)"
+        self.execute(sql, params=(server_id, category_name, role_id, emoji))
+        self.notify_roles_changed(server_id)
+
+    def get_server_role_category_names(self, server_id) -> List[str]:
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT category_name FROM role_categories WHERE server_id = ? ORDER BY category_name",
+                (int(server_id),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # Moves a menu role to a category, None leaves it uncategorized. Returns False when the role isn't on the menu
+    def set_role_category(self, server_id, role_id, category_name=None) -> bool:
+        with closing(self.connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE roles SET category_name = ? WHERE server_id = ? AND role_id = ?",
+                (category_name, int(server_id), int(role_id)),
+            )
+            updated = cursor.rowcount > 0
+        if updated:
+            self.notify_roles_changed(server_id)
+        return updated
 
     def delete_role_category(self, server_id, category_name):
         sql = "DELETE FROM role_categories WHERE server_id = ? AND category_name = ?"
         self.execute(sql, params=(server_id, category_name))
+        self.notify_roles_changed(server_id)
+
+    def notify_roles_changed(self, server_id):
+        for listener in self.role_listeners:
+            listener(int(server_id))
+
+
+def get_table_columns(conn: Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def get_primary_key(conn: Connection, table: str) -> List[str]:
+    rows = [row for row in conn.execute(f"PRAGMA table_info({table})") if row[5] > 0]
+    return [row[1] for row in sorted(rows, key=lambda row: row[5])]
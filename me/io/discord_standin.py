@@ -0,0 +1,507 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import itertools
+import json
+import logging
+import random
+import secrets
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Tuple
+
+from aiohttp import web
+
+# Same version prefix as the real API, so an endpoint swap is only a host change
+API_PREFIX = "/api/v10"
+DISCORD_EPOCH = 1420070400000
+TEXT_CHANNEL = 0
+
+_logger = logging.getLogger(__name__)
+
+
+def get_standin_endpoint(host: str, port: int) -> str:
+    return f"http://{host}:{port}{API_PREFIX}"
+
+
+@dataclasses.dataclass
+class StandInSettings:
+    # Seconds added to every response, plus up to latency_jitter more
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    # Chance of answering any request with a 429 regardless of its bucket
+    rate_limit_chance: float = 0.0
+    retry_after: float = 1.0
+    # Requests allowed per bucket per bucket_window seconds, like Discord's per-route buckets
+    bucket_limit: int = 5
+    bucket_window: float = 5.0
+    global_rate_limit: bool = False
+    token_expires_in: int = 604800
+    log_size: int = 10000
+
+
+@dataclasses.dataclass
+class RequestLogEntry:
+    at: float
+    method: str
+    route: str
+    path: str
+    status: int
+    duration: float
+
+
+@dataclasses.dataclass
+class _Bucket:
+    reset_at: float
+    remaining: int
+
+
+class DiscordStandIn:
+    """
+    In-memory stand-in for the Discord REST routes the bot and API use, for offline load and latency tests.
+
+    Point Config.discord_api_endpoint at get_standin_endpoint(host, port) to use it. Only REST is served, a discord
+    client still needs the real gateway to log in.
+    """
+
+    def __init__(
+        self,
+        settings: StandInSettings | None = None,
+        guild_count: int = 1,
+        channels_per_guild: int = 3,
+        roles_per_guild: int = 5,
+    ):
+        self.settings = settings if settings is not None else StandInSettings()
+        self.request_log: Deque[RequestLogEntry] = deque(maxlen=self.settings.log_size)
+        self._sequence = itertools.count()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self.bot_user = self.make_user("ME Bot", bot=True)
+        self.user = self.make_user("Stand-in User")
+        self.guilds: Dict[str, dict] = {}
+        self.channels: Dict[str, dict] = {}
+        self.messages: Dict[str, Dict[str, dict]] = {}
+        self.commands: Dict[str | None, List[dict]] = {}
+        for i in range(guild_count):
+            self.add_guild(f"Guild {i}", channels_per_guild, roles_per_guild)
+
+    def next_snowflake(self) -> str:
+        ms = int(time.time() * 1000) - DISCORD_EPOCH
+        return str((ms << 22) | (next(self._sequence) & 0x3FFFFF))
+
+    def make_user(self, name: str, bot=False) -> dict:
+        return {
+            "id": self.next_snowflake(),
+            "username": name,
+            "global_name": name,
+            "discriminator": "0",
+            "avatar": None,
+            "bot": bot,
+        }
+
+    def add_guild(self, name: str, channel_count: int, role_count: int) -> dict:
+        guild_id = self.next_snowflake()
+        everyone = {
+            "id": guild_id,
+            "name": "@everyone",
+            "color": 0,
+            "hoist": False,
+            "position": 0,
+            "permissions": "1071698660929",
+            "managed": False,
+            "mentionable": False,
+        }
+        roles = [everyone] + [
+            {**everyone, "id": self.next_snowflake(), "name": f"role-{i}", "position": i + 1}
+            for i in range(role_count)
+        ]
+        guild = {
+            "id": guild_id,
+            "name": name,
+            "icon": None,
+            "owner_id": self.user["id"],
+            "roles": roles,
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "member_count": 2,
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "premium_tier": 0,
+            "preferred_locale": "en-US",
+            "nsfw_level": 0,
+        }
+        self.guilds[guild_id] = guild
+        for i in range(channel_count):
+            channel_id = self.next_snowflake()
+            self.channels[channel_id] = {
+                "id": channel_id,
+                "type": TEXT_CHANNEL,
+                "guild_id": guild_id,
+                "name": f"channel-{i}",
+                "position": i,
+                "permission_overwrites": [],
+                "parent_id": None,
+                "topic": None,
+                "nsfw": False,
+                "last_message_id": None,
+                "rate_limit_per_user": 0,
+            }
+            self.messages[channel_id] = {}
+        return guild
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        p = API_PREFIX
+        app.add_routes(
+            [
+                web.post(f"{p}/oauth2/token", self.token),
+                web.get(f"{p}/oauth2/@me", self.oauth_me),
+                web.get(f"{p}/users/@me", self.users_me),
+                web.get(f"{p}/users/@me/guilds", self.users_me_guilds),
+                web.get(f"{p}/guilds/{{guild_id}}", self.get_guild),
+                web.get(f"{p}/guilds/{{guild_id}}/channels", self.get_guild_channels),
+                web.get(f"{p}/guilds/{{guild_id}}/roles", self.get_guild_roles),
+                web.get(f"{p}/channels/{{channel_id}}", self.get_channel),
+                web.get(f"{p}/channels/{{channel_id}}/messages", self.get_messages),
+                web.post(f"{p}/channels/{{channel_id}}/messages", self.send_message),
+                web.post(
+                    f"{p}/channels/{{channel_id}}/messages/bulk-delete",
+                    self.bulk_delete_messages,
+                ),
+                web.get(
+                    f"{p}/channels/{{channel_id}}/messages/{{message_id}}",
+                    self.get_message,
+                ),
+                web.patch(
+                    f"{p}/channels/{{channel_id}}/messages/{{message_id}}",
+                    self.edit_message,
+                ),
+                web.delete(
+                    f"{p}/channels/{{channel_id}}/messages/{{message_id}}",
+                    self.delete_message,
+                ),
+                web.get(f"{p}/applications/{{app_id}}/commands", self.get_commands),
+                web.put(f"{p}/applications/{{app_id}}/commands", self.sync_commands),
+                web.get(
+                    f"{p}/applications/{{app_id}}/guilds/{{guild_id}}/commands",
+                    self.get_commands,
+                ),
+                web.put(
+                    f"{p}/applications/{{app_id}}/guilds/{{guild_id}}/commands",
+                    self.sync_commands,
+                ),
+                web.get("/_standin/requests", self.get_request_log),
+                web.delete("/_standin/requests", self.clear_request_log),
+                web.get("/_standin/stats", self.get_stats_route),
+            ]
+        )
+        return app
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        start = time.perf_counter()
+        route = request.match_info.route.resource
+        route = route.canonical if route is not None else request.path
+        if route.startswith("/_standin/"):
+            return await handler(request)
+
+        delay = self.settings.latency + random.random() * self.settings.latency_jitter
+        if delay > 0:
+            await asyncio.sleep(delay)
+        bucket_key = self.get_bucket_key(request, route)
+        status = 500
+        try:
+            if random.random() < self.settings.rate_limit_chance:
+                response = self.rate_limited(self.settings.retry_after, bucket_key)
+            else:
+                bucket = self.take_bucket(bucket_key)
+                if bucket.remaining < 0:
+                    response = self.rate_limited(bucket.reset_at - time.time(), bucket_key)
+                else:
+                    response = await handler(request)
+                    response.headers.update(self.get_rate_limit_headers(bucket_key, bucket))
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            self.request_log.append(
+                RequestLogEntry(
+                    at=time.time(),
+                    method=request.method,
+                    route=route,
+                    path=request.path,
+                    status=status,
+                    duration=time.perf_counter() - start,
+                )
+            )
+
+    # Discord scopes buckets by route and its major parameter (channel, guild or webhook)
+    @staticmethod
+    def get_bucket_key(request: web.Request, route: str) -> Tuple[str, str]:
+        info = request.match_info
+        major = info.get("channel_id") or info.get("guild_id") or ""
+        return f"{request.method} {route}", major
+
+    def take_bucket(self, key: Tuple[str, str]) -> _Bucket:
+        now = time.time()
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.reset_at <= now:
+            bucket = _Bucket(now + self.settings.bucket_window, self.settings.bucket_limit)
+            self._buckets[key] = bucket
+        bucket.remaining -= 1
+        return bucket
+
+    def get_rate_limit_headers(self, key: Tuple[str, str], bucket: _Bucket) -> Dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(self.settings.bucket_limit),
+            "X-RateLimit-Remaining": str(max(bucket.remaining, 0)),
+            "X-RateLimit-Reset": f"{bucket.reset_at:.3f}",
+            "X-RateLimit-Reset-After": f"{max(bucket.reset_at - time.time(), 0):.3f}",
+            "X-RateLimit-Bucket": f"{abs(hash(key[0])):x}",
+        }
+
+    def rate_limited(self, retry_after: float, key: Tuple[str, str]) -> web.Response:
+        retry_after = max(retry_after, 0.0)
+        is_global = self.settings.global_rate_limit
+        headers = {
+            "Retry-After": f"{retry_after:.3f}",
+            "X-RateLimit-Limit": str(self.settings.bucket_limit),
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": f"{retry_after:.3f}",
+            "X-RateLimit-Bucket": f"{abs(hash(key[0])):x}",
+            "X-RateLimit-Scope": "global" if is_global else "user",
+        }
+        if is_global:
+            headers["X-RateLimit-Global"] = "true"
+        body = {
+            "message": "You are being rate limited.",
+            "retry_after": retry_after,
+            "global": is_global,
+        }
+        return json_response(body, status=429, headers=headers)
+
+    def get_token_dict(self, scope: str) -> dict:
+        return {
+            "access_token": secrets.token_urlsafe(24),
+            "token_type": "Bearer",
+            "expires_in": self.settings.token_expires_in,
+            "refresh_token": secrets.token_urlsafe(24),
+            "scope": scope,
+        }
+
+    async def token(self, request: web.Request):
+        data = await request.post()
+        grant_type = data.get("grant_type")
+        if grant_type not in ("authorization_code", "client_credentials", "refresh_token"):
+            return json_response({"error": "unsupported_grant_type"}, status=400)
+        token_dict = self.get_token_dict(data.get("scope", "identify guilds"))
+        if grant_type == "client_credentials":
+            token_dict.pop("refresh_token")
+        return json_response(token_dict)
+
+    async def oauth_me(self, request: web.Request):
+        expires = datetime.fromtimestamp(
+            time.time() + self.settings.token_expires_in, tz=timezone.utc
+        )
+        return json_response(
+            {
+                "application": {"id": self.bot_user["id"], "name": self.bot_user["username"]},
+                "scopes": ["identify", "guilds"],
+                "expires": expires.isoformat(),
+                "user": self.user,
+            }
+        )
+
+    async def users_me(self, request: web.Request):
+        return json_response(self.user)
+
+    async def users_me_guilds(self, request: web.Request):
+        return json_response(
+            [
+                {
+                    "id": guild["id"],
+                    "name": guild["name"],
+                    "icon": None,
+                    "owner": guild["owner_id"] == self.user["id"],
+                    "permissions": "1071698660929",
+                    "features": [],
+                }
+                for guild in self.guilds.values()
+            ]
+        )
+
+    def find_guild(self, request: web.Request) -> dict:
+        guild = self.guilds.get(request.match_info["guild_id"])
+        if guild is None:
+            raise not_found("Unknown Guild", 10004)
+        return guild
+
+    def find_channel(self, request: web.Request) -> dict:
+        channel = self.channels.get(request.match_info["channel_id"])
+        if channel is None:
+            raise not_found("Unknown Channel", 10003)
+        return channel
+
+    def find_message(self, request: web.Request) -> dict:
+        channel = self.find_channel(request)
+        message = self.messages[channel["id"]].get(request.match_info["message_id"])
+        if message is None:
+            raise not_found("Unknown Message", 10008)
+        return message
+
+    async def get_guild(self, request: web.Request):
+        return json_response(self.find_guild(request))
+
+    async def get_guild_channels(self, request: web.Request):
+        guild = self.find_guild(request)
+        return json_response(
+            [c for c in self.channels.values() if c["guild_id"] == guild["id"]]
+        )
+
+    async def get_guild_roles(self, request: web.Request):
+        return json_response(self.find_guild(request)["roles"])
+
+    async def get_channel(self, request: web.Request):
+        return json_response(self.find_channel(request))
+
+    async def get_messages(self, request: web.Request):
+        channel = self.find_channel(request)
+        limit = min(int(request.query.get("limit", 50)), 100)
+        messages = sorted(
+            self.messages[channel["id"]].values(), key=lambda m: int(m["id"]), reverse=True
+        )
+        return json_response(messages[:limit])
+
+    async def get_message(self, request: web.Request):
+        return json_response(self.find_message(request))
+
+    async def send_message(self, request: web.Request):
+        channel = self.find_channel(request)
+        body = await read_json(request)
+        message_id = self.next_snowflake()
+        message = {
+            "id": message_id,
+            "channel_id": channel["id"],
+            "guild_id": channel["guild_id"],
+            "author": self.bot_user,
+            "content": body.get("content") or "",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": body.get("embeds") or [],
+            "components": body.get("components") or [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+        self.messages[channel["id"]][message_id] = message
+        channel["last_message_id"] = message_id
+        return json_response(message)
+
+    async def edit_message(self, request: web.Request):
+        message = self.find_message(request)
+        body = await read_json(request)
+        for key in ("content", "embeds", "components", "flags"):
+            if key in body and body[key] is not None:
+                message[key] = body[key]
+        message["edited_timestamp"] = datetime.now(timezone.utc).isoformat()
+        return json_response(message)
+
+    async def delete_message(self, request: web.Request):
+        message = self.find_message(request)
+        del self.messages[message["channel_id"]][message["id"]]
+        return web.Response(status=204)
+
+    async def bulk_delete_messages(self, request: web.Request):
+        channel = self.find_channel(request)
+        message_ids = (await read_json(request)).get("messages", [])
+        if not 2 <= len(message_ids) <= 100:
+            return json_response(
+                {"message": "Bulk delete takes between 2 and 100 messages", "code": 50016},
+                status=400,
+            )
+        for message_id in message_ids:
+            self.messages[channel["id"]].pop(str(message_id), None)
+        return web.Response(status=204)
+
+    async def get_commands(self, request: web.Request):
+        return json_response(self.commands.get(request.match_info.get("guild_id"), []))
+
+    async def sync_commands(self, request: web.Request):
+        guild_id = request.match_info.get("guild_id")
+        if guild_id is not None:
+            self.find_guild(request)
+        commands = [
+            {
+                **command,
+                "id": self.next_snowflake(),
+                "application_id": request.match_info["app_id"],
+                "guild_id": guild_id,
+                "version": self.next_snowflake(),
+                "default_member_permissions": command.get("default_member_permissions"),
+                "type": command.get("type", 1),
+            }
+            for command in await read_json(request, default=[])
+        ]
+        self.commands[guild_id] = commands
+        return json_response(commands)
+
+    async def get_request_log(self, request: web.Request):
+        limit = int(request.query.get("limit", 100))
+        entries = list(self.request_log)[-limit:]
+        return json_response([dataclasses.asdict(entry) for entry in entries])
+
+    async def clear_request_log(self, request: web.Request):
+        self.request_log.clear()
+        return web.Response(status=204)
+
+    def get_stats(self) -> Dict[str, Any]:
+        entries = list(self.request_log)
+        durations = sorted(entry.duration for entry in entries)
+        return {
+            "requests": len(entries),
+            "by_route": dict(Counter(f"{e.method} {e.route}" for e in entries)),
+            "by_status": dict(Counter(str(e.status) for e in entries)),
+            "duration_p50": durations[len(durations) // 2] if durations else None,
+            "duration_p99": durations[int(len(durations) * 0.99)] if durations else None,
+        }
+
+    async def get_stats_route(self, request: web.Request):
+        return json_response(self.get_stats())
+
+    def run(self, host="127.0.0.1", port=8090):
+        _logger.info(f"Discord stand-in serving {get_standin_endpoint(host, port)}")
+        web.run_app(self.create_app(), host=host, port=port)
+
+
+# discord.py only parses bodies whose content type is exactly application/json, without a charset
+def json_response(data, status: int = 200, headers: Dict[str, str] | None = None) -> web.Response:
+    return web.Response(
+        body=json.dumps(data).encode(),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+    )
+
+
+def not_found(message: str, code: int) -> web.HTTPNotFound:
+    return web.HTTPNotFound(
+        body=json.dumps({"message": message, "code": code}).encode(),
+        content_type="application/json",
+    )
+
+
+async def read_json(request: web.Request, default=None):
+    if not request.can_read_body:
+        return {} if default is None else default
+    return await request.json()
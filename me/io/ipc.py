@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+import time
+from contextlib import closing
+from typing import Any, Dict, List
+
+from me.io.db_util import SQLiteDB
+
+REFRESH_ROLE_MESSAGES = "refresh_role_messages"
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class IPCCommand:
+    command_id: int
+    command: str
+    payload: Dict[str, Any]
+    created_at: float
+
+
+class CommandQueue:
+    """
+    Command channel between the API workers and the bot process, backed by the ipc_commands table of the shared db.
+
+    Any process can send(), the bot process claims commands in order and each command is handed out only once.
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    def send(self, command: str, **payload) -> int:
+        with closing(self.db.connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO ipc_commands (command, payload, created_at) VALUES (?, ?, ?)",
+                (command, json.dumps(payload), time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit: int = 50) -> List[IPCCommand]:
+        with closing(self.db.connect()) as conn:
+            # IMMEDIATE takes the write lock up front so two claimers can't read the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT command_id, command, payload, created_at FROM ipc_commands ORDER BY command_id LIMIT ?",
+                    (limit,),
+                ).fetchall()
+                if len(rows) > 0:
+                    conn.execute(
+                        "DELETE FROM ipc_commands WHERE command_id <= ?", (rows[-1][0],)
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return [
+            IPCCommand(command_id, command, json.loads(payload), created_at)
+            for command_id, command, payload, created_at in rows
+        ]
+
+
+class StatusBoard:
+    """
+    Latest status published by each process, so the API can report on a bot running in another process.
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    def publish(self, name: str, status: Dict[str, Any]):
+        with closing(self.db.connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO process_status (name, status, updated_at) VALUES (?, ?, ?)",
+                (name, json.dumps(status), time.time()),
+            )
+
+    def read(self, name: str, max_age: float | None = None) -> Dict[str, Any] | None:
+        with closing(self.db.connect()) as conn:
+            row = conn.execute(
+                "SELECT status, updated_at FROM process_status WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None or (max_age is not None and row[1] < time.time() - max_age):
+            return None
+        status = json.loads(row[0])
+        status["updated_at"] = row[1]
+        return status
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from typing import Dict
+
+
+class Counters:
+    """
+    Named, process wide counters. Names are dotted, like discord.requests or discord.status.429.
+    """
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        # Counters are bumped from worker threads (asyncio.to_thread) as well as the event loop
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counts[name] += value
+
+    def get(self, name: str) -> int:
+        return self._counts[name]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+counters = Counters()
+
+
+def increment(name: str, value: int = 1):
+    counters.increment(name, value)
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import bisect
+import dataclasses
+import hashlib
+import json
+from typing import Any, Collection, Dict, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+MAX_PAGE_SIZE = 200
+
+
+@dataclasses.dataclass
+class CachedTable:
+    """
+    Rows of one table for one guild, sorted by the cursor column so pages are found with a binary search.
+    """
+
+    rows: List[Dict[str, Any]]
+    keys: List[Any]
+    columns: Tuple[str, ...]
+    etag: str
+
+    @classmethod
+    def from_df(cls, df: DataFrame, cursor_col: str) -> CachedTable:
+        df = df.sort_values(cursor_col, kind="stable")
+        df = df.astype(object).where(df.notna(), None)
+        rows = [
+            {col: _to_json_value(col, val) for col, val in row.items()}
+            for row in df.to_dict("records")
+        ]
+        keys = df[cursor_col].tolist()
+        etag = hashlib.sha1(
+            json.dumps(rows, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return cls(rows=rows, keys=keys, columns=tuple(df.columns), etag=etag)
+
+    def parse_cursor(self, after: str | None):
+        if after is None or len(self.keys) == 0:
+            return after
+        if isinstance(self.keys[0], int):
+            return int(after)
+        return after
+
+    def get_page(
+        self, after: str | None, limit: int, fields: Collection[str] | None = None
+    ) -> Tuple[List[Dict[str, Any]], str | None]:
+        """
+        Returns up to limit rows after the cursor, projected to fields, and the cursor of the next page if any.
+        """
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = self.parse_cursor(after)
+        start = 0 if after is None else bisect.bisect_right(self.keys, after)
+        end = start + limit
+        rows = self.rows[start:end]
+        if fields is not None:
+            rows = [{field: row[field] for field in fields} for row in rows]
+        next_cursor = str(self.keys[end - 1]) if end < len(self.keys) else None
+        return rows, next_cursor
+
+    def get_page_etag(self, *params) -> str:
+        page = json.dumps([self.etag, *params], default=str)
+        return '"' + hashlib.sha1(page.encode()).hexdigest() + '"'
+
+
+# Snowflakes are bigger than javascript's safe integers, send them as strings like discord does
+def _to_json_value(col: str, val):
+    if val is None:
+        return None
+    if col.endswith("_id"):
+        return str(int(val)) if not isinstance(val, str) else val
+    if hasattr(val, "item"):
+        return val.item()
+    return val
+
+
+def parse_fields(fields: str | None, columns: Collection[str]) -> List[str] | None:
+    if fields is None or fields.strip() == "":
+        return None
+    fields = [f.strip() for f in fields.split(",") if f.strip() != ""]
+    unknown = [f for f in fields if f not in columns]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown fields {unknown}, expected some of {list(columns)}")
+    return fields
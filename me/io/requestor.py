@@ -1,7 +1,12 @@
+import asyncio
 import dataclasses
+import hashlib
 import logging
 
-import requests
+import aiohttp
+
+from me.io import metrics
+from me.io.retry import CircuitBreaker, RateLimiter, RetryPolicy
 
 FORM_URLENCODED = "application/x-www-form-urlencoded"
 DEFAULT_DISCORD_API_ENDPOINT = "https://discord.com/api/v10"
@@ -9,10 +14,40 @@ DEFAULT_DISCORD_API_ENDPOINT = "https://discord.com/api/v10"
 _logger = logging.getLogger(__name__)
 
 
+# OAuth2 grants use up their code or refresh token, only a 429 is known to have been rejected before being processed
+def get_grant_retry_policy(policy: RetryPolicy | None = None) -> RetryPolicy:
+    if policy is None:
+        policy = RetryPolicy()
+    return dataclasses.replace(
+        policy, retry_statuses=frozenset({429}), retry_connection_errors=False
+    )
+
+
 def get_form_encoded_headers():
     return {"Content-Type": FORM_URLENCODED}
 
 
+def get_token_headers(token_dict: dict[str, str]):
+    return {
+        "Authorization": f"{token_dict['token_type']} {token_dict['access_token']}"
+    }
+
+
+# User routes are rate limited per token, keyed on a digest so the token itself isn't kept around
+def get_token_key(token_dict: dict[str, str]) -> str:
+    return hashlib.sha1(token_dict["access_token"].encode()).hexdigest()[:16]
+
+
+async def get_retry_after(r: aiohttp.ClientResponse) -> float:
+    retry_after = r.headers.get("Retry-After")
+    if retry_after is None:
+        try:
+            retry_after = (await r.json()).get("retry_after")
+        except (aiohttp.ContentTypeError, ValueError):
+            retry_after = None
+    return float(retry_after) if retry_after is not None else 1.0
+
+
 @dataclasses.dataclass
 class Requestor:
     pass
@@ -24,32 +59,49 @@ class DiscordRequestor(Requestor):
     oauth_secret: str
     oauth_redirect_uri: str
     api_endpoint: str = DEFAULT_DISCORD_API_ENDPOINT
+    # Connection pool for the async methods, limit_per_host=0 means only the total limit applies
+    pool_limit: int = 100
+    pool_limit_per_host: int = 0
+    keepalive_timeout: float = 30.0
+    timeout: float = 10.0
+    retry_policy: RetryPolicy = dataclasses.field(default_factory=RetryPolicy)
+    grant_retry_policy: RetryPolicy = dataclasses.field(
+        default_factory=get_grant_retry_policy
+    )
+    breaker: CircuitBreaker = dataclasses.field(default_factory=CircuitBreaker)
+    rate_limits: RateLimiter = dataclasses.field(
+        default_factory=RateLimiter, init=False, repr=False, compare=False
+    )
+    _http: aiohttp.ClientSession | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def get_auth_tuple(self):
         return str(self.bot_id), self.oauth_secret
 
+    def get_basic_auth(self) -> aiohttp.BasicAuth:
+        return aiohttp.BasicAuth(*self.get_auth_tuple())
+
     # Gets account information about user
     def get_user_info(self, token_dict: dict[str, str]):
-        headers = {
-            "Authorization": f"{token_dict['token_type']} {token_dict['access_token']}"
-        }
-        r = requests.get("%s/oauth2/@me" % self.api_endpoint, headers=headers)
+        import requests
+
+        r = requests.get(
+            "%s/oauth2/@me" % self.api_endpoint,
+            headers=get_token_headers(token_dict),
+        )
         # _logger.info(r.json())
         r.raise_for_status()
         return r.json()
 
-    # TODO Document
+    # Trades the code from the OAuth redirect for the user's token dict
     def exchange_code(self, code) -> dict[str, str]:
-        data = {
-            "grant_type": "authorization_code",
-            "code": code,
-            "redirect_uri": self.oauth_redirect_uri,
-        }
-        headers = get_form_encoded_headers()
+        import requests
+
         r = requests.post(
             "%s/oauth2/token" % self.api_endpoint,
-            data=data,
-            headers=headers,
+            data=self.get_exchange_code_data(code),
+            headers=get_form_encoded_headers(),
             auth=self.get_auth_tuple(),
         )
         try:
@@ -61,19 +113,164 @@ class DiscordRequestor(Requestor):
 
     # Bot token requests?
     def get_bot_token_dict(self, session, scope="identify connections"):
-        data = {
-            "grant_type": "client_credentials",  # client_credentials always gives the bot owner
-            "redirect_uri": self.oauth_redirect_uri,
-            "scope": scope,
-        }
         r = session.post(
             "%s/oauth2/token" % self.api_endpoint,
-            data=data,
+            data=self.get_client_credentials_data(scope),
             headers=get_form_encoded_headers(),
         )
         r.raise_for_status()
         return r.json()
 
+    def get_exchange_code_data(self, code) -> dict[str, str]:
+        return {
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": self.oauth_redirect_uri,
+        }
+
+    def get_refresh_token_data(self, refresh_token) -> dict[str, str]:
+        return {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        }
+
+    def get_client_credentials_data(self, scope) -> dict[str, str]:
+        return {
+            "grant_type": "client_credentials",  # client_credentials always gives the bot owner
+            "redirect_uri": self.oauth_redirect_uri,
+            "scope": scope,
+        }
+
+    # The session is shared by every async call so connections are kept alive, create it from the running loop
+    def get_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._http = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._http
+
+    async def close(self):
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
+
+    # Sends a request to the discord api, waiting out rate limits and retrying what policy allows (retry_policy's
+    # 429s, 5xx and connection errors by default)
+    async def request_json(
+        self,
+        method: str,
+        path: str,
+        major: str = "",
+        policy: RetryPolicy | None = None,
+        **kwargs,
+    ):
+        route = f"{method} {path}"
+        if policy is None:
+            policy = self.retry_policy
+        attempt = 0
+        while True:
+            retry_after = None
+            self.breaker.before_call()
+            # Only server errors and failed connections count as failures, other exits like cancellation give the half
+            # open trial back, otherwise it would hold the circuit open forever
+            recorded = False
+            try:
+                await self.rate_limits.wait(route, major)
+                metrics.increment("discord.requests")
+                async with self.get_http().request(
+                    method, f"{self.api_endpoint}{path}", **kwargs
+                ) as r:
+                    self.rate_limits.update(route, r.headers, major)
+                    metrics.increment(f"discord.status.{r.status}")
+                    # A 429 still means discord is up, only server errors count against the circuit
+                    if r.status >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    recorded = True
+                    if r.status == 429:
+                        retry_after = await get_retry_after(r)
+                        is_global = r.headers.get("X-RateLimit-Global") == "true"
+                        self.rate_limits.on_rate_limited(route, retry_after, is_global, major)
+                        metrics.increment("discord.rate_limited")
+                    if r.ok:
+                        return await r.json()
+                    give_up = not policy.should_retry(attempt, r.status) or (
+                        retry_after is not None and retry_after > policy.max_delay
+                    )
+                    if give_up:
+                        _logger.info(f"{route} failed with {r.status}: {await r.text()}")
+                        metrics.increment("discord.failures")
+                        r.raise_for_status()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if not recorded:
+                    self.breaker.record_failure()
+                    recorded = True
+                metrics.increment("discord.connection_errors")
+                if not policy.should_retry(attempt):
+                    metrics.increment("discord.failures")
+                    raise
+                _logger.info(f"{route} failed to connect, retrying: {e!r}")
+            finally:
+                if not recorded:
+                    self.breaker.release_trial()
+            metrics.increment("discord.retries")
+            await asyncio.sleep(policy.get_delay(attempt, retry_after))
+            attempt += 1
+
+    async def get_user_info_async(self, token_dict: dict[str, str]):
+        return await self.request_json(
+            "GET",
+            "/oauth2/@me",
+            major=get_token_key(token_dict),
+            headers=get_token_headers(token_dict),
+        )
+
+    # Needs the guilds scope on the user's token
+    async def get_user_guilds_async(self, token_dict: dict[str, str]):
+        return await self.request_json(
+            "GET",
+            "/users/@me/guilds",
+            major=get_token_key(token_dict),
+            headers=get_token_headers(token_dict),
+        )
+
+    async def exchange_code_async(self, code) -> dict[str, str]:
+        return await self.request_json(
+            "POST",
+            "/oauth2/token",
+            policy=self.grant_retry_policy,
+            data=self.get_exchange_code_data(code),
+            headers=get_form_encoded_headers(),
+            auth=self.get_basic_auth(),
+        )
+
+    async def refresh_token_async(self, refresh_token) -> dict[str, str]:
+        return await self.request_json(
+            "POST",
+            "/oauth2/token",
+            policy=self.grant_retry_policy,
+            data=self.get_refresh_token_data(refresh_token),
+            headers=get_form_encoded_headers(),
+            auth=self.get_basic_auth(),
+        )
+
+    async def get_bot_token_dict_async(self, scope="identify connections"):
+        return await self.request_json(
+            "POST",
+            "/oauth2/token",
+            policy=self.grant_retry_policy,
+            data=self.get_client_credentials_data(scope),
+            headers=get_form_encoded_headers(),
+            auth=self.get_basic_auth(),
+        )
+
 
 @dataclasses.dataclass
 class MERequestor(Requestor):
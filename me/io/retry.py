@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import random
+import time
+from typing import Callable, Dict, Mapping, Tuple
+
+_logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, attempt n waits a random time up to min(max_delay, base_delay * 2 ** n).
+
+    A Retry-After longer than max_delay isn't waited out, the request fails instead. Requests that aren't safe to send
+    twice turn off retry_connection_errors, a timed out request may still have reached the server.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_statuses: frozenset = RETRY_STATUSES
+    retry_connection_errors: bool = True
+
+    def should_retry(self, attempt: int, status: int | None = None) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if status is None:
+            return self.retry_connection_errors
+        return status in self.retry_statuses
+
+    def get_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+@dataclasses.dataclass
+class RateLimitBucket:
+    remaining: int | None = None
+    reset_at: float = 0.0
+
+    def get_wait(self, now: float) -> float:
+        if self.remaining is None or self.remaining > 0:
+            return 0.0
+        return max(self.reset_at - now, 0.0)
+
+
+class RateLimiter:
+    """
+    Discord's rate limit state, learned from X-RateLimit-* headers.
+
+    Routes map to the bucket hash Discord reports for them. Like Discord, state is kept per bucket and major key (the
+    user's token for user routes), so one user's limit doesn't hold back the others. A request waits until its bucket
+    resets when the bucket is used up, or until a global limit is over.
+
+    Only used up buckets are kept, a bucket with requests left or past its reset makes no one wait. Those are dropped
+    as they're updated and, every prune_interval seconds, swept, so there's no state left for users that went idle.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, prune_interval: float = 60.0):
+        self.clock = clock
+        self.prune_interval = prune_interval
+        self._route_buckets: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[str, str], RateLimitBucket] = {}
+        self._global_reset_at = 0.0
+        self._next_prune = clock() + prune_interval
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def get_bucket_key(self, route: str, major: str = "") -> Tuple[str, str]:
+        return self._route_buckets.get(route, route), major
+
+    def get_bucket(self, route: str, major: str = "") -> RateLimitBucket:
+        key = self.get_bucket_key(route, major)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = RateLimitBucket()
+            self._buckets[key] = bucket
+        return bucket
+
+    def get_wait(self, route: str, major: str = "") -> float:
+        now = self.clock()
+        bucket = self._buckets.get(self.get_bucket_key(route, major))
+        bucket_wait = 0.0 if bucket is None else bucket.get_wait(now)
+        return max(self._global_reset_at - now, bucket_wait, 0.0)
+
+    async def wait(self, route: str, major: str = "") -> float:
+        delay = self.get_wait(route, major)
+        if delay > 0:
+            _logger.debug(f"Waiting {delay:.2f}s for the {route} rate limit")
+            await asyncio.sleep(delay)
+        return delay
+
+    def update(self, route: str, headers: Mapping[str, str], major: str = ""):
+        bucket_hash = headers.get("X-RateLimit-Bucket")
+        if bucket_hash is not None:
+            self._route_buckets[route] = bucket_hash
+        bucket = self.get_bucket(route, major)
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            bucket.remaining = int(remaining)
+        if reset_after is not None:
+            bucket.reset_at = self.clock() + float(reset_after)
+        if bucket.get_wait(self.clock()) == 0:
+            del self._buckets[self.get_bucket_key(route, major)]
+        self.prune()
+
+    # Drops the buckets that have reset, at most once every prune_interval seconds
+    def prune(self):
+        now = self.clock()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.prune_interval
+        expired = [key for key, bucket in self._buckets.items() if bucket.get_wait(now) == 0]
+        for key in expired:
+            del self._buckets[key]
+
+    def on_rate_limited(
+        self, route: str, retry_after: float, is_global: bool, major: str = ""
+    ):
+        reset_at = self.clock() + retry_after
+        if is_global:
+            self._global_reset_at = max(self._global_reset_at, reset_at)
+        else:
+            bucket = self.get_bucket(route, major)
+            bucket.remaining = 0
+            bucket.reset_at = max(bucket.reset_at, reset_at)
+        self.prune()
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is failing, not sending requests for {retry_in:.1f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a degraded service after failure_threshold failures in a row.
+
+    Once open, calls are refused for reset_timeout seconds, then one trial call is let through (half open). Its success
+    closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str = "discord",
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+    def get_state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        state = self.get_state()
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+        retry_in = max(self._opened_at + self.reset_timeout - self.clock(), 0.0)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    # For calls that ended without an outcome, like cancelled ones, a half open trial can be retried by the next call
+    def release_trial(self):
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_running:
+                _logger.warning(f"Opening the {self.name} circuit after {self.failures} failures")
+            self._opened_at = self.clock()
+        self._trial_running = False
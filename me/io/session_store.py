@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+from me.io.db_util import SQLiteDB
+from me.session_info import SessionInfo
+
+DEFAULT_SESSION_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_SESSIONS = 10000
+
+_logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Maps the website's session ids to SessionInfo records that expire ttl seconds after they are stored.
+
+    Expired sessions are never returned, sweep() removes them for good. Code on the event loop uses the async
+    variants, backends that block override them to do their I/O in a worker thread.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+
+    def get(self, session_id: str) -> SessionInfo | None:
+        raise NotImplementedError("SessionStore is an interface, override get()")
+
+    def put(self, session_id: str, info: SessionInfo):
+        raise NotImplementedError("SessionStore is an interface, override put()")
+
+    def delete(self, session_id: str):
+        raise NotImplementedError("SessionStore is an interface, override delete()")
+
+    def sweep(self) -> int:
+        raise NotImplementedError("SessionStore is an interface, override sweep()")
+
+    def contains(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    async def aget(self, session_id: str) -> SessionInfo | None:
+        return self.get(session_id)
+
+    async def aput(self, session_id: str, info: SessionInfo):
+        self.put(session_id, info)
+
+    async def adelete(self, session_id: str):
+        self.delete(session_id)
+
+    async def acontains(self, session_id: str) -> bool:
+        return await self.aget(session_id) is not None
+
+    def get_expiry(self) -> float:
+        return time.time() + self.ttl
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Process local store, least recently used sessions are dropped once max_sessions is reached.
+    """
+
+    def __init__(
+        self, ttl: float = DEFAULT_SESSION_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS
+    ):
+        super().__init__(ttl=ttl)
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, SessionInfo] = OrderedDict()
+
+    def get(self, session_id: str) -> SessionInfo | None:
+        info = self._sessions.get(session_id)
+        if info is None:
+            return None
+        if info.is_expired():
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return info
+
+    def put(self, session_id: str, info: SessionInfo):
+        if info.expires_at is None:
+            info.expires_at = self.get_expiry()
+        self._sessions[session_id] = info
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        expired = [k for k, v in self._sessions.items() if v.is_expired(now)]
+        for session_id in expired:
+            del self._sessions[session_id]
+        return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Stores sessions in the sessions table so they survive restarts and are shared by every worker using the db.
+    """
+
+    def __init__(self, db: SQLiteDB, ttl: float = DEFAULT_SESSION_TTL):
+        super().__init__(ttl=ttl)
+        self.db = db
+
+    def get(self, session_id: str) -> SessionInfo | None:
+        with closing(self.db.connect()) as conn:
+            row = conn.execute(
+                "SELECT info_session_id, token_dict, expires_at FROM sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        token_dict = json.loads(row[1]) if row[1] is not None else None
+        return SessionInfo(row[0], token_dict, expires_at=row[2])
+
+    def put(self, session_id: str, info: SessionInfo):
+        if info.expires_at is None:
+            info.expires_at = self.get_expiry()
+        token_dict = json.dumps(info.token_dict) if info.token_dict is not None else None
+        with closing(self.db.connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, info_session_id, token_dict, expires_at) VALUES (?, ?, ?, ?)",
+                (session_id, info.session_id, token_dict, info.expires_at),
+            )
+
+    def delete(self, session_id: str):
+        with closing(self.db.connect()) as conn, conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    async def aget(self, session_id: str) -> SessionInfo | None:
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def aput(self, session_id: str, info: SessionInfo):
+        await asyncio.to_thread(self.put, session_id, info)
+
+    async def adelete(self, session_id: str):
+        await asyncio.to_thread(self.delete, session_id)
+
+    def sweep(self) -> int:
+        with closing(self.db.connect()) as conn, conn:
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+            )
+            return cursor.rowcount
+
+
+def get_session_store(backend: str, db: SQLiteDB, ttl: float, max_sessions: int):
+    if backend == "memory":
+        return MemorySessionStore(ttl=ttl, max_sessions=max_sessions)
+    elif backend == "sqlite":
+        return SQLiteSessionStore(db, ttl=ttl)
+    raise ValueError(f"Unknown session backend {backend}, expected memory or sqlite")
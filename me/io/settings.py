@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from contextlib import closing
+from typing import Any, Callable, Collection, Dict, Generic, Set, Tuple, TypeVar
+
+from me.io.cache import LRUCache
+from me.io.db_util import PRAGMA, SQLiteDB
+from me.io.write_behind import WriteBehind
+
+T = TypeVar("T")
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclasses.dataclass(frozen=True)
+class Setting(Generic[T]):
+    """
+    A typed setting key, values are stored as text and parsed back with parse.
+    """
+
+    name: str
+    default: T
+    parse: Callable[[str], T] = str
+    dump: Callable[[T], str] = str
+
+    def load(self, raw: str | None) -> T:
+        if raw is None:
+            return self.default
+        try:
+            return self.parse(raw)
+        except (TypeError, ValueError):
+            _logger.warning(f"Ignoring bad value {raw!r} for setting {self.name}")
+            return self.default
+
+
+def int_setting(name: str, default: int) -> Setting[int]:
+    return Setting(name, default, int)
+
+
+def bool_setting(name: str, default: bool) -> Setting[bool]:
+    return Setting(name, default, parse_bool, lambda v: "true" if v else "false")
+
+
+# (user_id or None for the guild's own value, setting name)
+_Key = Tuple[int | None, str]
+
+
+@dataclasses.dataclass
+class GuildSettings:
+    server: Dict[str, str] = dataclasses.field(default_factory=dict)
+    users: Dict[int, Dict[str, str]] = dataclasses.field(default_factory=dict)
+    # Keys dropped by invalidate, read again from the database on their next use
+    stale: Set[_Key] = dataclasses.field(default_factory=set)
+
+    def get_raw(self, key: _Key) -> str | None:
+        user_id, name = key
+        if user_id is None:
+            return self.server.get(name)
+        return self.users.get(user_id, {}).get(name)
+
+    def set_raw(self, key: _Key, raw: str | None):
+        user_id, name = key
+        values = self.server if user_id is None else self.users.setdefault(user_id, {})
+        if raw is None:
+            values.pop(name, None)
+        else:
+            values[name] = raw
+
+
+class SettingsStore(WriteBehind[Dict[Tuple[int, int | None, str], str | None]]):
+    """
+    Server and user settings from the server_settings and user_settings tables.
+
+    A guild's settings (its own and every user's) are loaded with one query the first time any of them is read and are
+    served from memory after that. Writes update memory right away and reach the database in batches, flush_delay
+    seconds after the first unwritten change. A user's setting falls back to the guild's value, then to the default.
+    """
+
+    def __init__(self, db: SQLiteDB, max_guilds: int = 1000, flush_delay: float = 0.5):
+        super().__init__(flush_delay=flush_delay)
+        self.db = db
+        self._guilds = LRUCache(max_entries=max_guilds, sizeof=lambda _: 0)
+        # (server_id, user_id, name) -> text to write, None deletes
+        self._pending: Dict[Tuple[int, int | None, str], str | None] = {}
+
+    def get_guild(self, server_id: int) -> GuildSettings:
+        server_id = int(server_id)
+        guild = self._guilds.get(server_id)
+        if guild is None:
+            guild = self.load_guild(server_id)
+            self._guilds.put(server_id, guild)
+        return guild
+
+    def load_guild(self, server_id: int) -> GuildSettings:
+        sql = "SELECT NULL, setting, setting_value FROM server_settings WHERE server_id = ? UNION ALL SELECT user_id, setting, setting_value FROM user_settings WHERE server_id = ?"
+        with closing(self.db.connect()) as conn:
+            rows = conn.execute(sql, (server_id, server_id)).fetchall()
+        guild = GuildSettings()
+        for user_id, name, raw in rows:
+            guild.set_raw((user_id, name), raw)
+        # Writes still waiting for a flush are newer than what the database returned
+        for (pending_server_id, user_id, name), raw in self._pending.items():
+            if pending_server_id == server_id:
+                guild.set_raw((user_id, name), raw)
+        return guild
+
+    def load_key(self, server_id: int, key: _Key) -> str | None:
+        user_id, name = key
+        with closing(self.db.connect()) as conn:
+            if user_id is None:
+                row = conn.execute(
+                    "SELECT setting_value FROM server_settings WHERE server_id = ? AND setting = ?",
+                    (server_id, name),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT setting_value FROM user_settings WHERE server_id = ? AND user_id = ? AND setting = ?",
+                    (server_id, user_id, name),
+                ).fetchone()
+        return None if row is None else row[0]
+
+    def _get_raw(self, server_id: int, key: _Key) -> str | None:
+        guild = self.get_guild(server_id)
+        if key in guild.stale:
+            guild.stale.discard(key)
+            guild.set_raw(key, self.load_key(int(server_id), key))
+        return guild.get_raw(key)
+
+    def get(self, server_id: int, setting: Setting[T], user_id: int | None = None) -> T:
+        raw = None
+        if user_id is not None:
+            raw = self._get_raw(server_id, (int(user_id), setting.name))
+        if raw is None:
+            raw = self._get_raw(server_id, (None, setting.name))
+        return setting.load(raw)
+
+    def get_many(
+        self,
+        server_id: int,
+        settings: Collection[Setting],
+        user_id: int | None = None,
+    ) -> Dict[str, Any]:
+        return {setting.name: self.get(server_id, setting, user_id) for setting in settings}
+
+    def set(self, server_id: int, setting: Setting[T], value: T | None, user_id: int | None = None):
+        raw = None if value is None else setting.dump(value)
+        key = (None if user_id is None else int(user_id), setting.name)
+        self.get_guild(server_id).set_raw(key, raw)
+        self._pending[(int(server_id), key[0], key[1])] = raw
+        self.schedule_flush()
+
+    def delete(self, server_id: int, setting: Setting, user_id: int | None = None):
+        self.set(server_id, setting, None, user_id=user_id)
+
+    # For changes made to the tables by something else, like another process
+    def invalidate(self, server_id: int, setting: Setting | None = None, user_id: int | None = None):
+        if setting is None:
+            self._guilds.pop(int(server_id))
+            return
+        guild = self._guilds.get(int(server_id))
+        if guild is not None:
+            guild.stale.add((None if user_id is None else int(user_id), setting.name))
+
+    def _has_pending(self) -> bool:
+        return len(self._pending) > 0
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, {}
+        return pending
+
+    # Unless a newer value is already waiting
+    def _restore_pending(self, pending):
+        for key, raw in pending.items():
+            self._pending.setdefault(key, raw)
+
+    def _write(self, pending: Dict[Tuple[int, int | None, str], str | None]):
+        server_upserts, server_deletes, user_upserts, user_deletes = [], [], [], []
+        for (server_id, user_id, name), raw in pending.items():
+            if user_id is None:
+                if raw is None:
+                    server_deletes.append((server_id, name))
+                else:
+                    server_upserts.append((server_id, name, raw))
+            elif raw is None:
+                user_deletes.append((server_id, user_id, name))
+            else:
+                user_upserts.append((server_id, user_id, name, raw))
+        try:
+            with closing(self.db.connect()) as conn, conn:
+                conn.execute(PRAGMA)
+                conn.executemany(
+                    "INSERT INTO servers (server_id) VALUES (?) ON CONFLICT DO NOTHING",
+                    [(server_id,) for server_id in {key[0] for key in pending}],
+                )
+                conn.executemany(
+                    "INSERT INTO users (user_id, active_server) VALUES (?, NULL) ON CONFLICT DO NOTHING",
+                    [(row[1],) for row in user_upserts],
+                )
+                conn.executemany(
+                    "INSERT INTO server_settings (server_id, setting, setting_value) VALUES (?, ?, ?) ON CONFLICT DO UPDATE SET setting_value = excluded.setting_value",
+                    server_upserts,
+                )
+                conn.executemany(
+                    "DELETE FROM server_settings WHERE server_id = ? AND setting = ?",
+                    server_deletes,
+                )
+                conn.executemany(
+                    "INSERT INTO user_settings (server_id, user_id, setting, setting_value) VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE SET setting_value = excluded.setting_value",
+                    user_upserts,
+                )
+                conn.executemany(
+                    "DELETE FROM user_settings WHERE server_id = ? AND user_id = ? AND setting = ?",
+                    user_deletes,
+                )
+        except Exception as e:
+            _logger.exception(f"Failed to write {len(pending)} settings: {e}")
+            raise
+        _logger.debug(f"Wrote {len(pending)} settings")
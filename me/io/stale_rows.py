@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from contextlib import closing
+from sqlite3 import Connection
+from typing import Callable, Collection, Dict, Set, Tuple
+
+from me.io.db_util import PRAGMA, SQLiteDB
+from me.io.write_behind import WriteBehind
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class StaleRows:
+    """
+    Rows of one server that point at things deleted in Discord.
+    """
+
+    # (channel_id, message_id)
+    messages: Set[Tuple[int, int]] = dataclasses.field(default_factory=set)
+    channels: Set[int] = dataclasses.field(default_factory=set)
+    roles: Set[int] = dataclasses.field(default_factory=set)
+    # The bot left the server, its messages can't be reached anymore
+    server: bool = False
+
+    def __len__(self):
+        return len(self.messages) + len(self.channels) + len(self.roles) + int(self.server)
+
+    def merge(self, other: StaleRows):
+        self.messages |= other.messages
+        self.channels |= other.channels
+        self.roles |= other.roles
+        self.server = self.server or other.server
+
+
+class StaleRowReaper(WriteBehind[Dict[int, StaleRows]]):
+    """
+    Removes rows for messages, channels and roles deleted in Discord, as reported by the MEClient's gateway events.
+
+    Deletions are queued and written in one transaction flush_delay seconds after the first one, so a bulk delete or a
+    burst of events costs one write, failed writes are retried (see WriteBehind). on_deleted is called with the ids of
+    the servers whose rows actually changed.
+
+    Leaving a server only removes its message rows. Its roles, categories, permissions and settings are kept in case
+    the bot is added back.
+    """
+
+    def __init__(
+        self,
+        db: SQLiteDB,
+        flush_delay: float = 0.5,
+        on_deleted: Callable[[Set[int]], None] | None = None,
+    ):
+        super().__init__(flush_delay=flush_delay)
+        self.db = db
+        self.on_deleted = on_deleted
+        self._pending: Dict[int, StaleRows] = {}
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._pending.values())
+
+    def get_rows(self, server_id: int) -> StaleRows:
+        server_id = int(server_id)
+        rows = self._pending.get(server_id)
+        if rows is None:
+            rows = StaleRows()
+            self._pending[server_id] = rows
+        return rows
+
+    def delete_messages(self, server_id: int, channel_id: int, message_ids: Collection[int]):
+        self.get_rows(server_id).messages.update(
+            (int(channel_id), int(message_id)) for message_id in message_ids
+        )
+        self.schedule_flush()
+
+    def delete_channel(self, server_id: int, channel_id: int):
+        self.get_rows(server_id).channels.add(int(channel_id))
+        self.schedule_flush()
+
+    def delete_role(self, server_id: int, role_id: int):
+        self.get_rows(server_id).roles.add(int(role_id))
+        self.schedule_flush()
+
+    def delete_server(self, server_id: int):
+        self.get_rows(server_id).server = True
+        self.schedule_flush()
+
+    def _has_pending(self) -> bool:
+        return len(self._pending) > 0
+
+    def _take_pending(self) -> Dict[int, StaleRows]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore_pending(self, pending: Dict[int, StaleRows]):
+        for server_id, rows in pending.items():
+            self.get_rows(server_id).merge(rows)
+
+    def _on_written(self, pending: Dict[int, StaleRows], changed: Set[int]):
+        if len(changed) > 0 and self.on_deleted is not None:
+            self.on_deleted(changed)
+
+    def _write(self, pending: Dict[int, StaleRows]) -> Set[int]:
+        changed = set()
+        try:
+            with closing(self.db.connect()) as conn, conn:
+                conn.execute(PRAGMA)
+                for server_id, rows in pending.items():
+                    before = conn.total_changes
+                    delete_rows(conn, server_id, rows)
+                    if conn.total_changes > before:
+                        changed.add(server_id)
+        except Exception as e:
+            _logger.exception(f"Failed to delete stale rows of {len(pending)} servers: {e}")
+            raise
+        if len(changed) > 0:
+            _logger.info(f"Deleted stale rows of servers {sorted(changed)}")
+        return changed
+
+
+def delete_rows(conn: Connection, server_id: int, rows: StaleRows):
+    if rows.server:
+        conn.execute(
+            "DELETE FROM messages WHERE (first_message_id, channel_id) IN (SELECT first_message_id, channel_id FROM message_groups WHERE server_id = ?)",
+            (server_id,),
+        )
+        conn.execute("DELETE FROM message_groups WHERE server_id = ?", (server_id,))
+        return
+    channels = [(channel_id,) for channel_id in rows.channels]
+    conn.executemany("DELETE FROM messages WHERE channel_id = ?", channels)
+    conn.executemany("DELETE FROM message_groups WHERE channel_id = ?", channels)
+    conn.executemany(
+        "UPDATE roles SET channel_id = NULL WHERE server_id = ? AND channel_id = ?",
+        [(server_id, channel_id) for channel_id in rows.channels],
+    )
+    conn.executemany(
+        "DELETE FROM messages WHERE channel_id = ? AND message_id = ?",
+        sorted(rows.messages),
+    )
+    # Groups whose every message is gone
+    conn.executemany(
+        "DELETE FROM message_groups WHERE channel_id = ? AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.first_message_id = message_groups.first_message_id AND m.channel_id = message_groups.channel_id)",
+        [(channel_id,) for channel_id in {channel_id for channel_id, _ in rows.messages}],
+    )
+    roles = [(server_id, role_id) for role_id in rows.roles]
+    conn.executemany("DELETE FROM roles WHERE server_id = ? AND role_id = ?", roles)
+    conn.executemany("DELETE FROM permissions WHERE server_id = ? AND role_id = ?", roles)
+    conn.executemany(
+        "UPDATE role_categories SET role_id = NULL WHERE server_id = ? AND role_id = ?",
+        roles,
+    )
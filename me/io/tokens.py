@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Set
+
+import aiohttp
+
+from me.io.cache import SingleFlight
+from me.io.requestor import DiscordRequestor
+from me.io.session_store import SessionStore
+from me.session_info import SessionInfo
+
+# Added to every token dict we receive, expires_in alone doesn't say when the token was issued
+EXPIRES_AT = "expires_at"
+BOT_TOKEN_KEY = "bot"
+
+_logger = logging.getLogger(__name__)
+
+
+def stamp_expiry(token_dict: dict, now: float | None = None) -> dict:
+    if now is None:
+        now = time.time()
+    expires_in = token_dict.get("expires_in")
+    if expires_in is not None:
+        token_dict[EXPIRES_AT] = now + float(expires_in)
+    return token_dict
+
+
+def get_seconds_left(token_dict: dict, now: float | None = None) -> float:
+    expires_at = token_dict.get(EXPIRES_AT)
+    if expires_at is None:
+        return float("inf")
+    if now is None:
+        now = time.time()
+    return float(expires_at) - now
+
+
+class TokenManager:
+    """
+    Hands out discord OAuth tokens, refreshing them before they expire so token requests stay off the hot path.
+
+    A token with less than margin seconds left is refreshed before it is returned. One with less than refresh_ahead
+    seconds left is returned as is while a background task refreshes it. Concurrent refreshes of the same token share
+    one request. User tokens and their refresh tokens live in the session store, the bot's client-credentials token in
+    memory.
+    """
+
+    def __init__(
+        self,
+        requestor: DiscordRequestor,
+        sessions: SessionStore,
+        margin: float = 60,
+        refresh_ahead: float = 24 * 60 * 60,
+        bot_scope: str = "identify connections",
+    ):
+        self.requestor = requestor
+        self.sessions = sessions
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self.bot_scope = bot_scope
+        self._bot_token: dict | None = None
+        self._flights = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+
+    async def put_user_token(self, session_id: str, info_session_id: str, token_dict: dict):
+        stamp_expiry(token_dict)
+        await self.sessions.aput(session_id, SessionInfo(info_session_id, token_dict))
+
+    async def get_user_token(self, session_id: str) -> dict | None:
+        info = await self.sessions.aget(session_id)
+        if info is None or not info.is_logged_in():
+            return None
+        seconds_left = get_seconds_left(info.token_dict)
+        if seconds_left > self.refresh_ahead:
+            return info.token_dict
+        if seconds_left > self.margin:
+            self.refresh_in_background(("user", session_id), self.refresh_user_token(session_id))
+            return info.token_dict
+        return await self.refresh_user_token(session_id)
+
+    async def refresh_user_token(self, session_id: str) -> dict | None:
+        return await self._flights.do(("user", session_id), lambda: self._refresh_user_token(session_id))
+
+    async def _refresh_user_token(self, session_id: str) -> dict | None:
+        info = await self.sessions.aget(session_id)
+        if info is None or not info.is_logged_in():
+            return None
+        refresh_token = info.token_dict.get("refresh_token")
+        if refresh_token is None:
+            return info.token_dict if get_seconds_left(info.token_dict) > 0 else None
+        try:
+            token_dict = await self.requestor.refresh_token_async(refresh_token)
+        except aiohttp.ClientResponseError as e:
+            if e.status in (400, 401):
+                # The refresh token was revoked or already used, the user has to log in again
+                _logger.info(f"Refresh token for session {session_id} was rejected, logging it out")
+                await self.sessions.adelete(session_id)
+                return None
+            raise
+        # Discord may leave out the refresh token when it didn't rotate it
+        token_dict.setdefault("refresh_token", refresh_token)
+        stamp_expiry(token_dict)
+        info.token_dict = token_dict
+        await self.sessions.aput(session_id, info)
+        return token_dict
+
+    async def get_bot_token(self) -> dict:
+        token_dict = self._bot_token
+        if token_dict is not None:
+            seconds_left = get_seconds_left(token_dict)
+            if seconds_left > self.refresh_ahead:
+                return token_dict
+            if seconds_left > self.margin:
+                self.refresh_in_background(BOT_TOKEN_KEY, self.refresh_bot_token())
+                return token_dict
+        return await self.refresh_bot_token()
+
+    async def refresh_bot_token(self) -> dict:
+        return await self._flights.do(BOT_TOKEN_KEY, self._refresh_bot_token)
+
+    async def _refresh_bot_token(self) -> dict:
+        token_dict = await self.requestor.get_bot_token_dict_async(self.bot_scope)
+        self._bot_token = stamp_expiry(token_dict)
+        return token_dict
+
+    def refresh_in_background(self, key, refresh):
+        if key in self._flights:
+            refresh.close()
+            return
+        task = asyncio.create_task(refresh)
+        self._background.add(task)
+        task.add_done_callback(self._finish_background)
+
+    def _finish_background(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            _logger.warning(f"Background token refresh failed: {task.exception()}")
+
+    # Keeps the bot token fresh even when nothing asks for it for a while
+    async def refresh_loop(self, interval: float = 5 * 60):
+        while True:
+            await asyncio.sleep(interval)
+            if self._bot_token is None or get_seconds_left(self._bot_token) > self.refresh_ahead:
+                continue
+            try:
+                await self.refresh_bot_token()
+            except Exception as e:
+                _logger.warning(f"Failed to refresh the bot token: {e}")
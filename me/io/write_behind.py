@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Generic, TypeVar
+
+B = TypeVar("B")
+
+_logger = logging.getLogger(__name__)
+
+
+class WriteBehind(Generic[B]):
+    """
+    Base for stores that keep changes in memory and write them to the database in batches.
+
+    schedule_flush writes the pending changes flush_delay seconds after the first unwritten one, and keeps flushing
+    until nothing is pending, so changes made while a batch is written go out with the next one. A batch that fails is
+    merged back with _restore_pending and retried after a delay that doubles up to max_retry_delay. Without a running
+    event loop, and from flush and flush_async, changes are written right away.
+
+    Subclasses keep the pending changes and implement _has_pending, _take_pending, _restore_pending and _write, which
+    runs in a worker thread when called from the event loop.
+    """
+
+    def __init__(self, flush_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.flush_delay = flush_delay
+        self.max_retry_delay = max_retry_delay
+        self._flush_task: asyncio.Task | None = None
+
+    def _has_pending(self) -> bool:
+        raise NotImplementedError("WriteBehind is a base class, override _has_pending()")
+
+    # Returns the pending changes and starts a new, empty batch
+    def _take_pending(self) -> B:
+        raise NotImplementedError("WriteBehind is a base class, override _take_pending()")
+
+    # Puts a batch that failed to write back, changes made since then win
+    def _restore_pending(self, batch: B):
+        raise NotImplementedError("WriteBehind is a base class, override _restore_pending()")
+
+    def _write(self, batch: B) -> Any:
+        raise NotImplementedError("WriteBehind is a base class, override _write()")
+
+    # Called on the caller's thread with what _write returned
+    def _on_written(self, batch: B, result: Any):
+        pass
+
+    def schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush_later())
+
+    async def flush_later(self):
+        delay = self.flush_delay
+        while self._has_pending():
+            await asyncio.sleep(delay)
+            try:
+                await self.flush_async()
+                delay = self.flush_delay
+            except Exception as e:
+                delay = min(delay * 2, self.max_retry_delay)
+                _logger.warning(f"{type(self).__name__} flush failed, retrying in {delay}s: {e!r}")
+
+    async def flush_async(self):
+        if not self._has_pending():
+            return
+        batch = self._take_pending()
+        try:
+            result = await asyncio.to_thread(self._write, batch)
+        except BaseException:
+            self._restore_pending(batch)
+            raise
+        self._on_written(batch, result)
+
+    def flush(self):
+        if not self._has_pending():
+            return
+        batch = self._take_pending()
+        try:
+            result = self._write(batch)
+        except BaseException:
+            self._restore_pending(batch)
+            raise
+        self._on_written(batch, result)
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict
+
+GATEWAY_CONNECTED = "gateway_connected"
+READY = "ready"
+COMMANDS_SYNCED = "commands_synced"
+MESSAGES_REFRESHED = "messages_refreshed"
+STAGES = (GATEWAY_CONNECTED, READY, COMMANDS_SYNCED, MESSAGES_REFRESHED)
+
+# The client publishes its status on the ipc.StatusBoard under this name
+BOT_STATUS_NAME = "bot"
+
+
+class Lifecycle:
+    """
+    Startup stages of the discord client as events, so callers can wait for a stage instead of sleeping.
+
+    The client is ready once every stage is done, gateway_connected is cleared again while disconnected. A stage that
+    finished with an error still counts as done, its error is reported in the status.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._events: Dict[str, asyncio.Event] = {stage: asyncio.Event() for stage in STAGES}
+        self._done_at: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+
+    def mark(self, stage: str, error: str | None = None):
+        self._events[stage].set()
+        self._done_at[stage] = time.time()
+        if error is None:
+            self._errors.pop(stage, None)
+        else:
+            self._errors[stage] = error
+
+    def clear(self, stage: str):
+        self._events[stage].clear()
+        self._done_at.pop(stage, None)
+        self._errors.pop(stage, None)
+
+    def is_done(self, stage: str) -> bool:
+        return self._events[stage].is_set()
+
+    def is_ready(self) -> bool:
+        return all(self.is_done(stage) for stage in STAGES)
+
+    async def wait(self, stage: str = READY, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(self._events[stage].wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait_ready(self, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(event.wait() for event in self._events.values())),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def status(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "started_at": self.started_at,
+            "stages": {
+                stage: {
+                    "done": self.is_done(stage),
+                    "at": self._done_at.get(stage),
+                    "error": self._errors.get(stage),
+                }
+                for stage in STAGES
+            },
+        }
@@ -1,26 +1,33 @@
 import asyncio
 import dataclasses
 import logging
+from contextlib import asynccontextmanager
 
-import requests
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse, Response
 
-from me import session_info
+from me import lifecycle, session_info
 from me.io import config
+from me.io.cache import TTLCache
 from me.io.db_util import SQLiteDB
-from me.discord_bot.me_client import client
-from me.io.requestor import DiscordRequestor
+from me.io.ipc import CommandQueue, StatusBoard
+from me.io import metrics
+from me.io.pages import MAX_PAGE_SIZE, CachedTable, parse_fields
+from me.io.session_store import SessionStore, get_session_store
+from me.io.tokens import TokenManager
+from me.io.requestor import DiscordRequestor, get_grant_retry_policy
+from me.io.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
 
-startup_wait = 4
+# A bot in another process that hasn't published its status for this long (seconds) counts as down
+BOT_STATUS_MAX_AGE = 30
 
 _logger = logging.getLogger(__name__)
 
 
 class MEFastAPI(FastAPI):
-    user_sessions = {}
-
     def __init__(
         self: FastAPI, cfg=None, discord_requestor: DiscordRequestor = None, **kwargs
     ):
@@ -32,106 +39,460 @@ class MEFastAPI(FastAPI):
         db = SQLiteDB()
         self.db = db
         db.setup()
+        self.sessions: SessionStore = get_session_store(
+            cfg.session_backend,
+            db,
+            ttl=float(cfg.session_ttl),
+            max_sessions=int(cfg.session_max),
+        )
+        self.command_queue = CommandQueue(db)
+        self.status_board = StatusBoard(db)
+        self.identity_cache = TTLCache(
+            ttl=float(cfg.identity_cache_ttl),
+            max_entries=int(cfg.identity_cache_max),
+        )
+        self.guild_data_cache = TTLCache(ttl=float(cfg.guild_data_cache_ttl))
 
         if discord_requestor is None:
+            retry_policy = RetryPolicy(
+                max_attempts=int(cfg.http_max_attempts),
+                base_delay=float(cfg.http_backoff_base),
+                max_delay=float(cfg.http_backoff_max),
+            )
             discord_requestor = DiscordRequestor(
                 cfg.me_bot_id,
                 cfg.oauth_secret,
                 cfg.oauth_redirect_uri,
                 api_endpoint=cfg.discord_api_endpoint,
+                pool_limit=int(cfg.http_pool_limit),
+                pool_limit_per_host=int(cfg.http_pool_limit_per_host),
+                timeout=float(cfg.http_timeout),
+                retry_policy=retry_policy,
+                grant_retry_policy=get_grant_retry_policy(retry_policy),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(cfg.circuit_failure_threshold),
+                    reset_timeout=float(cfg.circuit_reset_timeout),
+                ),
             )
         self.discord_requestor = discord_requestor
+        self.tokens = TokenManager(
+            discord_requestor,
+            self.sessions,
+            margin=float(cfg.token_refresh_margin),
+            refresh_ahead=float(cfg.token_refresh_ahead),
+        )
         super().__init__(**kwargs)
 
 
-app = MEFastAPI()
-REDIRECT_URI = app.config.oauth_redirect_uri
-API_ENDPOINT = app.config.discord_api_endpoint
-
-origins = [
-    "http://localhost:3000*",
-    "http://localhost:8000*",
-    "http://127.0.0.1:*",
-    "*",
-]
-
-try:
-    website_base = (
-        app.config.website_url.lstrip("https")
-        .lstrip("http")
-        .lstrip(":")
-        .lstrip("/")
-        .split("/")[0]
+def get_origins(website_url: str) -> list[str]:
+    origins = [
+        "http://localhost:3000*",
+        "http://localhost:8000*",
+        "http://127.0.0.1:*",
+        "*",
+    ]
+
+    try:
+        website_base = (
+            website_url.lstrip("https")
+            .lstrip("http")
+            .lstrip(":")
+            .lstrip("/")
+            .split("/")[0]
+        )
+        website_base = website_url.split(website_base, 1)[0] + website_base + "*"
+        origins.append(website_base)
+    except Exception as e:
+        print("WARNING: FAILED TO PARSE WEBSITE URL FOR ORIGIN - CODE BAD? ", e)
+    return origins
+
+
+# The routes reach the app through request.app, so they work with any app create_app built
+router = APIRouter()
+
+
+def create_app(cfg=None, discord_requestor: DiscordRequestor = None) -> MEFastAPI:
+    app = MEFastAPI(cfg, discord_requestor=discord_requestor, lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=get_origins(app.config.website_url),
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
-    website_base = app.config.website_url.split(website_base, 1)[0] + website_base + "*"
-    origins.append(website_base)
-except Exception as e:
-    print("WARNING: FAILED TO PARSE WEBSITE URL FOR ORIGIN - CODE BAD? ", e)
+    app.include_router(router)
+    app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+    app.add_exception_handler(RequestValidationError, validation_error_handler)
+    return app
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
+# Bad query params are answered like the handlers' own checks, with 400
+async def validation_error_handler(request, e: RequestValidationError):
+    return JSONResponse({"detail": jsonable_encoder(e.errors())}, status_code=400)
 
-@app.get("/")
+
+async def circuit_open_handler(request, e: CircuitOpenError):
+    return JSONResponse(
+        {"detail": "Discord is unavailable, try again shortly"},
+        status_code=503,
+        headers={"Retry-After": str(max(int(e.retry_in), 1))},
+    )
+
+
+_app: MEFastAPI | None = None
+
+
+# "me.me_api:app" builds the app on first access, so importing this module doesn't set up the database
+def __getattr__(name: str):
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@router.get("/")
 async def hello_world():
     return {"hello": "world"}
 
 
-@app.get("/hello/")
+@router.get("/hello/")
 async def hello_world2():
     return {"hello": "world"}
 
 
-@app.on_event("startup")
-async def startup_event():  # this function will run before the main API starts
+async def sweep_sessions(app: MEFastAPI):
+    while True:
+        await asyncio.sleep(float(app.config.session_sweep_interval))
+        try:
+            swept = await asyncio.to_thread(app.sessions.sweep)
+            _logger.debug(f"Swept {swept} expired sessions")
+        except Exception as e:
+            _logger.exception(f"Failed to sweep sessions: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: MEFastAPI):
+    await startup_event(app)
+    try:
+        yield
+    finally:
+        await shutdown_event(app)
+
+
+async def startup_event(app: MEFastAPI):  # this function will run before the main API starts
     _logger.info("Beginning startup_event")
+    app.state.session_sweeper = asyncio.create_task(sweep_sessions(app))
+    app.state.token_refresher = asyncio.create_task(
+        app.tokens.refresh_loop(float(app.config.token_refresh_interval))
+    )
+    if app.config.run_mode == "api":
+        _logger.info("Run mode is api, the discord client runs in its own process")
+        return
+    from me.discord_bot import me_client
+
+    client = me_client.get_client()
     try:
-        # await client.start(client.token)
         token = app.config.me_run_token
-        # _logger.info(f"Started client, waiting for {startup_wait} seconds for connectivity...")
         _logger.info("Starting client...")
-        client.me_setup(app.db, app.config)
-        asyncio.create_task(client.start(token))
-        _logger.info("Client started!")
-        await asyncio.sleep(
-            startup_wait
-        )  # optional sleep for established connection with discord
+        client.me_setup(app.db, app.config, command_queue=app.command_queue)
+        # Not awaited, the API serves right away and /readyz reports the client's progress
+        app.state.client_task = asyncio.create_task(client.start(token))
     except KeyboardInterrupt:
         await client.logout()
 
-    _logger.info(f"{client.user} has connected to Discord!")
     _logger.info("startup_event complete for ME Bot")
 
 
-@app.get("/oauth/callback")
-def callback(code=None, state=None):
-    token_dict = app.discord_requestor.exchange_code(code=code)
-    app.user_sessions[state] = session_info.SessionInfo(code, token_dict)
+def get_bot_status(app: MEFastAPI) -> dict:
+    if app.config.run_mode == "api":
+        status = app.status_board.read(
+            lifecycle.BOT_STATUS_NAME, max_age=BOT_STATUS_MAX_AGE
+        )
+        if status is None:
+            return {"ready": False, "stages": {}, "reachable": False}
+        status["reachable"] = True
+        return status
+    from me.discord_bot import me_client
+
+    return me_client.get_client().lifecycle.status()
+
+
+@router.get("/healthz")
+async def healthz(request: Request):
+    app = request.app
+    return {"status": "ok", "run_mode": app.config.run_mode, "bot": get_bot_status(app)}
+
+
+@router.get("/metrics/")
+async def get_metrics(request: Request):
+    app = request.app
+    return {
+        "counters": metrics.counters.snapshot(),
+        "discord_circuit": app.discord_requestor.breaker.get_state(),
+        "identity_cache": {
+            "hits": app.identity_cache.hits,
+            "misses": app.identity_cache.misses,
+            "size": len(app.identity_cache),
+        },
+        "guild_data_cache": {
+            "hits": app.guild_data_cache.hits,
+            "misses": app.guild_data_cache.misses,
+            "size": len(app.guild_data_cache),
+        },
+    }
+
+
+@router.get("/readyz")
+async def readyz(request: Request):
+    status = get_bot_status(request.app)
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+async def shutdown_event(app: MEFastAPI):
+    for name in ("session_sweeper", "token_refresher"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    await app.discord_requestor.close()
+
+
+@router.get("/oauth/callback")
+async def callback(request: Request, code=None, state=None):
+    app = request.app
+    # state carries the session id, without it there's no session to store the token under
+    if not state:
+        raise HTTPException(status_code=400, detail="Missing state")
+    if not code:
+        raise HTTPException(status_code=400, detail="Missing code")
+    token_dict = await app.discord_requestor.exchange_code_async(code=code)
+    await app.tokens.put_user_token(state, code, token_dict)
+    forget_identity(app, state)
     return RedirectResponse(url=app.config.website_url)
 
 
-@app.get("/logged-in/")
-async def logged_in(session_id: str):
+@router.get("/logged-in/")
+async def logged_in(request: Request, session_id: str):
     session_id = str(session_id)
-    status = len(session_id) == 16 and session_id in app.user_sessions
+    status = len(session_id) == 16 and await request.app.sessions.acontains(session_id)
     return status
 
 
-@app.get("/whoami/")
-async def whoami(session_id=None):
-    session = requests.session()
-    session.cookies["session_id"] = 123
-
-    if session_id is None or session_id not in app.user_sessions:
+@router.get("/whoami/")
+async def whoami(request: Request, session_id=None):
+    info = await request.app.sessions.aget(session_id) if session_id is not None else None
+    if info is None:
         info = session_info.get_session_info()
-    else:
-        info = app.user_sessions[session_id]
     ret_dict = dataclasses.asdict(info)
     ret_dict["logged_in"] = info.is_logged_in()
     _logger.info(f"LOGGED IN {ret_dict}")
     return ret_dict
+
+
+async def get_user_token(app: MEFastAPI, session_id) -> dict:
+    token_dict = None
+    if session_id is not None:
+        token_dict = await app.tokens.get_user_token(session_id)
+    if token_dict is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    return token_dict
+
+
+async def get_user(app: MEFastAPI, session_id) -> dict:
+    token_dict = await get_user_token(app, session_id)
+    return await app.identity_cache.get_or_load(
+        ("user", session_id),
+        lambda: app.discord_requestor.get_user_info_async(token_dict),
+    )
+
+
+async def get_user_guilds(app: MEFastAPI, session_id) -> list:
+    token_dict = await get_user_token(app, session_id)
+    return await app.identity_cache.get_or_load(
+        ("guilds", session_id),
+        lambda: app.discord_requestor.get_user_guilds_async(token_dict),
+    )
+
+
+def forget_identity(app: MEFastAPI, session_id):
+    app.identity_cache.pop(("user", session_id))
+    app.identity_cache.pop(("guilds", session_id))
+
+
+@router.get("/me/")
+async def me(request: Request, session_id=None):
+    return await get_user(request.app, session_id)
+
+
+@router.get("/me/guilds/")
+async def me_guilds(request: Request, session_id=None):
+    return await get_user_guilds(request.app, session_id)
+
+
+# table name -> (loader, cursor column)
+GUILD_TABLES = {
+    "roles": (
+        lambda db, guild_id, filters: db.get_server_roles_df(guild_id, filters=filters),
+        "role_id",
+    ),
+    "categories": (
+        lambda db, guild_id, filters: db.get_server_role_categories_df(
+            guild_id, filters=filters
+        ),
+        "category_name",
+    ),
+    "message-groups": (
+        lambda db, guild_id, filters: db.get_server_message_groups_df(
+            guild_id, filters=filters
+        ),
+        "first_message_id",
+    ),
+}
+
+
+# Query params as filters the table's query runs in SQLite, params left as None don't filter
+def get_query_filters(equals: dict, contains: dict):
+    # data_filter imports pandas, which the API only loads once a table is read
+    from me.io.data_filter import FilterManager, IsInFilter, NameFilter
+
+    filters = [
+        IsInFilter(col, [value], selected_index=1)
+        for col, value in equals.items()
+        if value is not None
+    ]
+    filters += [
+        NameFilter(col, [value], selected_index=1)
+        for col, value in contains.items()
+        if value is not None and value != ""
+    ]
+    return FilterManager(filters=filters)
+
+
+async def check_guild_member(app: MEFastAPI, session_id, guild_id: int):
+    guilds = await get_user_guilds(app, session_id)
+    if str(guild_id) not in {str(g["id"]) for g in guilds}:
+        raise HTTPException(status_code=403, detail="Not a member of this guild")
+
+
+async def get_guild_table(
+    app: MEFastAPI,
+    table: str,
+    guild_id: int,
+    equals: dict | None = None,
+    contains: dict | None = None,
+) -> CachedTable:
+    load_df, cursor_col = GUILD_TABLES[table]
+    equals = equals or {}
+    contains = contains or {}
+
+    async def load():
+        filters = get_query_filters(equals, contains)
+        df = await asyncio.to_thread(load_df, app.db, guild_id, filters)
+        return CachedTable.from_df(df, cursor_col)
+
+    key = (table, guild_id, tuple(sorted(equals.items())), tuple(sorted(contains.items())))
+    return await app.guild_data_cache.get_or_load(key, load)
+
+
+async def get_guild_page(
+    app: MEFastAPI,
+    table: str,
+    guild_id: int,
+    session_id,
+    after: str | None,
+    limit: int,
+    fields: str | None,
+    if_none_match: str | None,
+    equals: dict | None = None,
+    contains: dict | None = None,
+):
+    await check_guild_member(app, session_id, guild_id)
+    cached = await get_guild_table(app, table, guild_id, equals, contains)
+    try:
+        field_list = parse_fields(fields, cached.columns)
+        items, next_cursor = cached.get_page(after, limit, field_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    etag = cached.get_page_etag(after, limit, field_list)
+    if if_none_match is not None and etag in [
+        tag.strip() for tag in if_none_match.split(",")
+    ]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(
+        {"items": items, "next": next_cursor}, headers={"ETag": etag}
+    )
+
+
+@router.get("/guilds/{guild_id}/roles/")
+async def guild_roles(
+    request: Request,
+    guild_id: int,
+    session_id=None,
+    after: str | None = None,
+    limit: int = Query(default=50, ge=1, le=MAX_PAGE_SIZE),
+    fields: str | None = None,
+    channel_id: int | None = None,
+    category: str | None = None,
+    if_none_match: str | None = Header(default=None),
+):
+    return await get_guild_page(
+        request.app,
+        "roles",
+        guild_id,
+        session_id,
+        after,
+        limit,
+        fields,
+        if_none_match,
+        equals={"channel_id": channel_id, "category_name": category},
+    )
+
+
+@router.get("/guilds/{guild_id}/categories/")
+async def guild_categories(
+    request: Request,
+    guild_id: int,
+    session_id=None,
+    after: str | None = None,
+    limit: int = Query(default=50, ge=1, le=MAX_PAGE_SIZE),
+    fields: str | None = None,
+    name: str | None = None,
+    if_none_match: str | None = Header(default=None),
+):
+    return await get_guild_page(
+        request.app,
+        "categories",
+        guild_id,
+        session_id,
+        after,
+        limit,
+        fields,
+        if_none_match,
+        contains={"category_name": name},
+    )
+
+
+@router.get("/guilds/{guild_id}/message-groups/")
+async def guild_message_groups(
+    request: Request,
+    guild_id: int,
+    session_id=None,
+    after: str | None = None,
+    limit: int = Query(default=50, ge=1, le=MAX_PAGE_SIZE),
+    fields: str | None = None,
+    channel_id: int | None = None,
+    type_id: int | None = None,
+    if_none_match: str | None = Header(default=None),
+):
+    return await get_guild_page(
+        request.app,
+        "message-groups",
+        guild_id,
+        session_id,
+        after,
+        limit,
+        fields,
+        if_none_match,
+        equals={"channel_id": channel_id, "type_id": type_id},
+    )
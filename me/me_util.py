@@ -1,3 +1,4 @@
+import re
 from pathlib import Path
 from typing import Union
 
@@ -16,6 +17,17 @@ def can_manage(user: Union[discord.User, discord.Member], role: discord.Role):
     )
 
 
+# Discord lowercases text channel names and swaps spaces for dashes, compare names in that form
+def normalize_channel_name(name: str | None) -> str | None:
+    if name is None:
+        return None
+    name = name.replace(" ", "-").lower()
+    name = re.sub(r"[^a-zA-Z0-9_\-]", "", name)
+    if name == "":
+        return None
+    return name
+
+
 def validate_emoji(emoji, default="", raise_error=True):
     if emoji is None:
         return default
@@ -1,4 +1,7 @@
-from enum import Enum
+from __future__ import annotations
+
+from enum import Enum, IntFlag
+from typing import List
 
 
 class PermType(Enum):
@@ -6,3 +9,34 @@ class PermType(Enum):
     CHANNELS_CREATE = 2
     ROLES_VIEW = 3
     ROLES_CREATE = 4
+
+    @property
+    def flag(self) -> PermFlags:
+        return PermFlags[self.name]
+
+    # The flag as a plain int, IntFlag operators are much slower than int ones
+    @property
+    def bit(self) -> int:
+        return PERM_BITS[self]
+
+
+# One bit per PermType, bit (value - 1), so the types' ids in permission_types stay as they are
+class PermFlags(IntFlag):
+    NONE = 0
+    CHANNELS_VIEW = 1 << 0
+    CHANNELS_CREATE = 1 << 1
+    ROLES_VIEW = 1 << 2
+    ROLES_CREATE = 1 << 3
+
+    @classmethod
+    def of(cls, *permissions: PermType | PermFlags) -> PermFlags:
+        flags = cls.NONE
+        for permission in permissions:
+            flags |= permission.flag if isinstance(permission, PermType) else permission
+        return flags
+
+    def get_types(self) -> List[PermType]:
+        return [p for p in PermType if self & p.flag]
+
+
+PERM_BITS = {p: 1 << (p.value - 1) for p in PermType}
@@ -1,29 +1,171 @@
+from __future__ import annotations
+
 import dataclasses
+import logging
+from contextlib import closing
 from typing import Dict
 
-from me.io.db_util import SQLiteDB
-from permission_types import PermType
+import discord
+
+from me.io.cache import LRUCache
+from me.io.db_util import PRAGMA, SQLiteDB
+from me.permission_types import PERM_BITS, PermFlags, PermType
+
+# A permissions row is for a user or a role, the other id column holds NO_ID
+NO_ID = 0
 
+_logger = logging.getLogger(__name__)
 
+
+# Bits are kept as plain ints, they are checked on every interaction
 @dataclasses.dataclass
-class Permission:
-    name: str
-    # default = None # TODO Get default from discord roles - eg creating channels/roles
+class GuildPermissions:
+    users: Dict[int, int] = dataclasses.field(default_factory=dict)
+    roles: Dict[int, int] = dataclasses.field(default_factory=dict)
+    # Member id -> effective bits, filled on first check and kept current by the member and role events
+    effective: Dict[int, int] = dataclasses.field(default_factory=dict)
+
+    def set_bits(self, user_id: int, role_id: int, bits: int):
+        values, key = (self.users, user_id) if role_id == NO_ID else (self.roles, role_id)
+        if bits:
+            values[key] = bits
+        else:
+            values.pop(key, None)
+
+    def compute_member_bits(self, member: discord.Member) -> int:
+        bits = self.users.get(member.id, 0)
+        for role in member.roles:
+            bits |= self.roles.get(role.id, 0)
+        return bits
+
+    def forget_roles(self):
+        self.effective.clear()
 
 
 @dataclasses.dataclass
 class PermissionManager:
+    """
+    Permission grants as PermFlags bitmasks, one permissions row per (server, user, role).
+
+    A guild's rows are read with one query on first use and kept in memory, checks are bitwise operations on them.
+    A member's effective permissions are their own grants and those of every role they hold, precomputed on first use
+    and updated by the MEClient's events.
+    """
+
     db: SQLiteDB
+    max_guilds: int = 1000
+    _guilds: LRUCache = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._guilds = LRUCache(max_entries=self.max_guilds, sizeof=lambda _: 0)
+
+    def get_guild(self, server_id) -> GuildPermissions:
+        server_id = int(server_id)
+        guild = self._guilds.get(server_id)
+        if guild is None:
+            guild = GuildPermissions()
+            for user_id, role_id, bits in self.db.get_server_permission_rows(server_id):
+                guild.set_bits(user_id, role_id, bits)
+            self._guilds.put(server_id, guild)
+        return guild
+
+    def get_bits(self, server_id, user_id) -> int:
+        return self.get_guild(server_id).users.get(int(user_id), 0)
+
+    def get_all(self, server_id, user_id) -> PermFlags:
+        return PermFlags(self.get_bits(server_id, user_id))
+
+    def has(self, server_id, user_id, permission: PermType | PermFlags) -> bool:
+        bits = get_permission_bits(permission)
+        return self.get_bits(server_id, user_id) & bits == bits
+
+    def get_member_bits(self, member: discord.Member) -> int:
+        guild = self.get_guild(member.guild.id)
+        bits = guild.effective.get(member.id)
+        if bits is None:
+            bits = guild.compute_member_bits(member)
+            guild.effective[member.id] = bits
+        return bits
+
+    def get_member_permissions(self, member: discord.Member) -> PermFlags:
+        return PermFlags(self.get_member_bits(member))
+
+    def member_has(self, member: discord.Member, permission: PermType | PermFlags) -> bool:
+        bits = get_permission_bits(permission)
+        return self.get_member_bits(member) & bits == bits
+
+    # Members with Manage Server may do everything, like they may grant ME permissions
+    def member_can(self, member: discord.Member, permission: PermType | PermFlags) -> bool:
+        return member.guild_permissions.manage_guild or self.member_has(member, permission)
+
+    def get_role_grants(self, server_id) -> Dict[int, PermFlags]:
+        return {
+            role_id: PermFlags(bits)
+            for role_id, bits in self.get_guild(server_id).roles.items()
+        }
+
+    # Only members already computed are touched, everyone else is computed on their next check
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        guild = self._guilds.get(after.guild.id)
+        if guild is not None and after.id in guild.effective:
+            if before.roles != after.roles:
+                guild.effective[after.id] = guild.compute_member_bits(after)
+
+    def on_member_remove(self, member: discord.Member):
+        guild = self._guilds.get(member.guild.id)
+        if guild is not None:
+            guild.effective.pop(member.id, None)
+
+    # The role's rows are deleted by the StaleRowReaper, its grant leaves the cache right away
+    def on_role_delete(self, server_id, role_id):
+        guild = self._guilds.get(int(server_id))
+        if guild is not None:
+            guild.roles.pop(int(role_id), None)
+            guild.forget_roles()
+
+    # Grants, or with value False revokes, a permission for a user, or for a role when role_id is given
+    def grant(
+        self,
+        server_id,
+        user_id,
+        permission: PermType | PermFlags,
+        value: bool = True,
+        role_id=NO_ID,
+    ) -> PermFlags:
+        server_id, user_id, role_id = int(server_id), int(user_id), int(role_id)
+        flags = int(PermFlags.of(permission))
+        if value:
+            sql = "INSERT INTO permissions (server_id, user_id, role_id, permission_bits) VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE SET permission_bits = permission_bits | excluded.permission_bits RETURNING permission_bits"
+            params = (server_id, user_id, role_id, flags)
+        else:
+            sql = "UPDATE permissions SET permission_bits = permission_bits & ~? WHERE server_id = ? AND user_id = ? AND role_id = ? RETURNING permission_bits"
+            params = (flags, server_id, user_id, role_id)
+        with closing(self.db.connect()) as conn, conn:
+            conn.execute(PRAGMA)
+            conn.execute(
+                "INSERT INTO servers (server_id) VALUES (?) ON CONFLICT DO NOTHING",
+                (server_id,),
+            )
+            row = conn.execute(sql, params).fetchone()
+            bits = row[0] if row is not None else 0
+            if not bits:
+                conn.execute(
+                    "DELETE FROM permissions WHERE server_id = ? AND user_id = ? AND role_id = ?",
+                    (server_id, user_id, role_id),
+                )
+        guild = self._guilds.get(server_id)
+        if guild is not None:
+            guild.set_bits(user_id, role_id, bits)
+            if role_id == NO_ID:
+                guild.effective.pop(user_id, None)
+            else:
+                guild.forget_roles()
+        return PermFlags(bits)
 
-    def has(self, server_id, user_id, permission: Permission) -> bool:
-        df = self.db.get_permission(server_id, user_id, permission.name)
-        return len(df) > 0 and df["permission_value"].iloc[0]
+    def forget_guild(self, server_id):
+        self._guilds.pop(int(server_id))
 
-    def grant(self, server_id, user_id, permission: Permission or str, value: bool):
-        self.db.execute(
-            "INSERT INTO permissions (server_id, user_id, permission_id, permission_value) VALUES (?, ?, ?, ?, ?)",
-            (server_id, user_id, permission.id, value),
-        )
 
-    def get_all(self, user_id, server_id) -> Dict[PermType, bool]:
-        return {p: self.has(user_id, server_id, p) for p in PermType}
+def get_permission_bits(permission: PermType | PermFlags) -> int:
+    bits = PERM_BITS.get(permission)
+    return int(permission) if bits is None else bits
@@ -1,15 +1,24 @@
 import dataclasses
+import time
 from uuid import uuid4
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class SessionInfo:
     session_id: str
     token_dict: dict[str, str] or None = None
+    expires_at: float | None = None
 
     def is_logged_in(self):
         return self.token_dict is not None
 
+    def is_expired(self, now: float | None = None):
+        if self.expires_at is None:
+            return False
+        if now is None:
+            now = time.time()
+        return self.expires_at <= now
+
 
 def get_session_info():
     return SessionInfo(str(uuid4()))